@@ -1,8 +1,12 @@
 # app_sleep.py
-import time, csv, os, sys
+import time, csv, os, sys, atexit
 from datetime import datetime
 from cortex import Cortex
-from sleep_engine import SleepEngine
+from sleep_engine import SleepEngine, CSV_HEADER, csv_row
+from raw_log import RawLogWriter, RAW_LOG_EXT, FAC_COLUMNS, dev_columns
+from user_management import update_user_session, update_session_stats
+from session_summary import SessionSummary, summary_path
+from stream_queue import StreamQueue, StreamWorker, KEEP, COALESCE, DROP
 from dotenv import load_dotenv
 
 # Load environment variables from .env if present
@@ -13,63 +17,33 @@ CLIENT_ID     = os.getenv("CLIENT_ID", "")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET", "")
 HEADSET_ID    = os.getenv("HEADSET_ID", "")   # 任意
 BASE_CSV_NAME = "sleep_candidates"
-USER_CSV_FILE = "user_data/users.csv"
+QUEUE_MAXSIZE = 2048   # 受信スレッドとワーカーの間のキュー（mot 64Hz で約30秒ぶん）
+SUMMARY_FLUSH_ROWS = 12    # 要約 JSON と登録簿はこの行数ごとか
+SUMMARY_FLUSH_SEC = 30.0   # この秒数ごとに書く（セッション終了時にも書く）
 
 def _is_all_zero(vec):
     return all((v == 0 or v is None) for v in vec)
 
-def update_user_session(username, session_file):
-    """ユーザーのセッション情報を更新"""
-    if not os.path.exists(USER_CSV_FILE):
-        return False
-    
-    # 全ユーザーを読み込み
-    users = []
-    with open(USER_CSV_FILE, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            users.append(row)
-    
-    # 指定ユーザーを更新
-    for user in users:
-        if user['username'] == username:
-            user['last_session'] = session_file
-            user['total_sessions'] = str(int(user['total_sessions']) + 1)
-            break
-    
-    # CSVファイルを再書き込み
-    with open(USER_CSV_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "username", "display_name", "created_date", 
-            "last_session", "total_sessions", "notes"
-        ])
-        for user in users:
-            writer.writerow([
-                user['username'], user['display_name'], user['created_date'],
-                user['last_session'], user['total_sessions'], user['notes']
-            ])
-    
-    return True
+STREAMS = ['pow', 'mot', 'dev', 'fac']
 
-class SleepApp:
+class SleepRecorder:
+    """
+    1人ぶんの SleepEngine と記録（派生行 CSV・生ストリーム・要約・登録簿）。Cortex には依存せず、
+    SleepApp（1プロセス1人）と app_sleep_multi.py（1プロセス複数人）の両方から使う。
+    """
     def __init__(self, username=None):
-        self.c = Cortex(CLIENT_ID, CLIENT_SECRET, debug_mode=False, headset_id=HEADSET_ID)
         self.eng = SleepEngine()
-        self._last_data_ts = time.time()
         self._session_start_time = None  # 計測開始時刻
-        self._subscribed = False
         self._csv_filename = None  # CSVファイル名
         self._username = username  # ユーザー名
-
-        self.c.bind(create_session_done=self.on_create_session_done)
-        self.c.bind(new_data_labels=self.on_new_data_labels)
-        self.c.bind(new_pow_data=self.on_new_pow_data)
-        self.c.bind(new_mot_data=self.on_new_mot_data)
-        self.c.bind(new_dev_data=self.on_new_dev_data)
-        self.c.bind(new_fe_data=self.on_new_fe_data)
-        self.c.bind(warn_cortex_stop_all_sub=self.on_stop_all_streams)
-        self.c.bind(inform_error=self.on_error)
+        self._session_rows = 0     # 現在のセッション CSV に書いた行数
+        self._summary = SessionSummary()
+        self._unflushed = 0        # 要約・登録簿にまだ書いていない行数
+        self._last_flush = time.monotonic()
+        self._last_row_t = None    # 最後に書いた行の絶対時刻
+        self._raw_log = None       # 生ストリームの記録（セッションごと）
+        self._stream_cols = {"fac": FAC_COLUMNS}  # new_data_labels で届いた列構成
+        atexit.register(self.stop_session)
 
     def _get_relative_time(self, absolute_time):
         """絶対時間を相対時間（秒）に変換"""
@@ -77,14 +51,15 @@ class SleepApp:
             return 0.0
         return absolute_time - self._session_start_time
 
-    def start(self):
-        print("[INFO] Opening Cortex...")
-        self.c.open()
-
-    def on_create_session_done(self, *args, **kwargs):
-        print("[INFO] Session created. Subscribing streams...")
+    def start_session(self):
+        """Cortex のセッションが作られたら呼ぶ。タイムスタンプ付きの新しい CSV と生ログを開く"""
+        self.stop_session()
         # セッション開始時にタイムスタンプ付きCSVファイル名を生成（再接続時も新しいファイルを作成）
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        # セッション開始時刻を設定（再接続時もリセット）
+        self._session_start_time = time.time()
+        self._session_rows = 0
+        self._summary = SessionSummary()
         
         if self._username:
             # ユーザー別ディレクトリを作成
@@ -95,92 +70,90 @@ class SleepApp:
             
             # ユーザーのセッション情報を更新
             session_filename = os.path.basename(self._csv_filename)
-            if update_user_session(self._username, session_filename):
+            if update_user_session(self._username, session_filename, start_time=self._session_start_time):
                 print(f"[INFO] Updated session info for user: {self._username}")
         else:
             self._csv_filename = f"{BASE_CSV_NAME}_{timestamp}.csv"
         
-        # セッション開始時刻を設定（再接続時もリセット）
-        self._session_start_time = time.time()
         print(f"[INFO] Session start time set: {self._session_start_time}")
         print(f"[INFO] CSV filename: {self._csv_filename}")
-        
-        self.c.sub_request(['pow', 'mot', 'dev', 'fac'])
-        self._subscribed = True
+        self._open_raw_log(timestamp)
 
-    def on_new_data_labels(self, *args, **kwargs):
-        data = kwargs.get('data', {})
-        if data.get('streamName') == 'pow':
-            self.eng.set_pow_labels(data.get('labels', []))
-            print("[INFO] pow labels:", data.get('labels', []))
+    def stop_session(self):
+        """今のセッションの要約・登録簿を書き切り、生ログを閉じる（何度呼んでもよい）"""
+        self._flush_summary()
+        self._close_raw_log()
 
-    def on_new_pow_data(self, *args, **kwargs):
-        d = kwargs.get('data', {})
-        if not d: return
+    def close(self):
+        self.stop_session()
+
+    def _open_raw_log(self, timestamp):
+        """生ストリームの記録を新しいファイルで開き直す（replay.py / rescore.py で再計算できる）"""
+        self._close_raw_log()
+        raw_dir = os.path.dirname(self._csv_filename)
+        path = os.path.join(raw_dir, f"raw_{timestamp}{RAW_LOG_EXT}")
+        self._raw_log = RawLogWriter(path, meta={"session_start": self._session_start_time,
+                                                 "username": self._username})
+        for stream, cols in self._stream_cols.items():
+            self._raw_log.set_schema(stream, cols)
+        print(f"[INFO] Raw log: {path}")
+
+    def _close_raw_log(self):
+        if self._raw_log is not None:
+            self._raw_log.close()
+            self._raw_log = None
+
+    def _record(self, stream, t, values):
+        if self._raw_log is not None:
+            self._raw_log.write(stream, t, values)
+
+    def on_labels(self, stream, labels):
+        if stream:
+            self._stream_cols[stream] = dev_columns(labels) if stream == 'dev' else labels
+            if self._raw_log is not None:
+                self._raw_log.set_schema(stream, self._stream_cols[stream])
+        if stream == 'pow':
+            self.eng.set_pow_labels(labels)
+            print("[INFO] pow labels:", labels)
+
+    def on_pow(self, d):
+        """pow を1フレーム処理する。派生行を書いたらその行を返す"""
+        if not d: return None
         vec = d.get('pow', [])
         t = d.get('time', time.time())
         relative_t = self._get_relative_time(t)
-        if not vec or _is_all_zero(vec): return
-        self._last_data_ts = time.time()
+        self._record('pow', t, vec)
+        if not vec or _is_all_zero(vec): return None
         self.eng.on_pow(relative_t, vec)
-        self._maybe_step(relative_t)
+        return self._maybe_step(relative_t)
 
-    def on_new_mot_data(self, *args, **kwargs):
-        d = kwargs.get('data', {})
+    def on_mot(self, d):
         if not d: return
-        self._last_data_ts = time.time()
         t = d.get('time', time.time())
         relative_t = self._get_relative_time(t)
+        self._record('mot', t, d.get('mot', []))
         self.eng.on_mot(relative_t, d.get('mot', []))
 
-    def on_new_dev_data(self, *args, **kwargs):
-        d = kwargs.get('data', {})
+    def on_dev(self, d):
         if not d: return
-        self._last_data_ts = time.time()
         t = d.get('time', time.time())
         relative_t = self._get_relative_time(t)
+        self._record('dev', t, [d.get('signal'), d.get('batteryPercent')] + list(d.get('dev') or []))
         self.eng.on_dev(relative_t, float(d.get('signal', 1.0)))
 
-    def on_new_fe_data(self, *args, **kwargs):
-        d = kwargs.get('data', {})
+    def on_fac(self, d):
         if not d: return
-        self._last_data_ts = time.time()
         t = d.get('time', time.time())
         relative_t = self._get_relative_time(t)
+        self._record('fac', t, [d.get(k) for k in FAC_COLUMNS])
         self.eng.on_fac(relative_t, d.get('eyeAct'), float(d.get('uPow', 0.0)), float(d.get('lPow', 0.0)))
 
-    def on_stop_all_streams(self, *args, **kwargs):
-        print("[WARN] Cortex stopped all streams. Recovering...")
-        try:
-            self.c.create_session()
-            time.sleep(1.0)
-            if self._subscribed:
-                self.c.sub_request(['pow','mot','dev','fac'])
-        except Exception as e:
-            print("[ERR] recover failed:", e)
-
-    def on_error(self, *args, **kwargs):
-        print("[ERR]", kwargs.get('error_data', {}))
-
     def _maybe_step(self, t_now):
         row = self.eng.step(t_now)
-        if not row: return
+        if not row: return None
         self._print_row(row)
         self._append_csv(row)
-
-        now = time.time()
-        if now - self._last_data_ts > 5:
-            print("[WARN] no data >5s, resubscribing...")
-            try:
-                self.c.sub_request(['pow','mot','dev','fac'])
-                time.sleep(2)
-                if time.time() - self._last_data_ts > 7:
-                    print("[WARN] recreate session...")
-                    self.c.create_session()
-                    time.sleep(1)
-                    self.c.sub_request(['pow','mot','dev','fac'])
-            except Exception as e:
-                print("[ERR] watchdog:", e)
+        return row
 
     def _print_row(self, r):
         # 表示用には絶対時間を使用
@@ -201,12 +174,145 @@ class SleepApp:
         with open(self._csv_filename, "a", newline="", encoding="utf-8") as f:
             w = csv.writer(f)
             if newfile:
-                w.writerow(["time","stage","confidence","theta_alpha","beta_rel","motion_rms","fac_rate","fac_active","signal","eog_on","eog_sacc"])
-            w.writerow([
-                round(r['t'], 1), r['stage'] or "", r['confidence'],
-                r['theta_alpha'], r['beta_rel'], r['motion_rms'],
-                r['fac_rate'], r.get('fac_active',0.0), r['signal'], r.get('eog_on',0.0), r.get('eog_sacc',0.0)
-            ])
+                w.writerow(CSV_HEADER)
+            w.writerow(csv_row(r))
+        self._session_rows += 1
+        # 夜全体の要約は毎行更新し、ファイルと登録簿へは間引いて書く
+        self._summary.add_row(r)
+        self._unflushed += 1
+        self._last_row_t = r['t'] + (self._session_start_time or 0)
+        if (self._unflushed >= SUMMARY_FLUSH_ROWS
+                or time.monotonic() - self._last_flush >= SUMMARY_FLUSH_SEC):
+            self._flush_summary()
+
+    def _flush_summary(self):
+        """要約を CSV の隣に保存し、登録簿の終了時刻・行数・要約を更新する"""
+        if not self._unflushed or not self._csv_filename:
+            return
+        self._unflushed = 0
+        self._last_flush = time.monotonic()
+        summary = self._summary.to_dict()
+        try:
+            self._summary.save(summary_path(self._csv_filename))
+        except OSError as e:
+            print("[WARN] session summary:", e)
+        if self._username:
+            try:
+                update_session_stats(self._username, os.path.basename(self._csv_filename),
+                                     end_time=self._last_row_t,
+                                     rows=self._session_rows, summary=summary)
+            except Exception as e:
+                print("[WARN] session stats:", e)
+
+class SleepApp:
+    """
+    websocket の受信スレッドはデコードしたデータを StreamQueue に入れるだけにし、
+    特徴量計算・CSV/生ログの書き込み・watchdog の待ちはワーカースレッドで行う。
+    """
+    def __init__(self, username=None):
+        self.c = Cortex(CLIENT_ID, CLIENT_SECRET, debug_mode=False, headset_id=HEADSET_ID)
+        self.rec = SleepRecorder(username)
+        self._subscribed = False
+        self._last_rx = time.time()  # 受信スレッドが最後にデータを受けた時刻（watchdog 用）
+        # セッション開始・列名・復旧も同じキューに流して、データとの順序を保つ
+        self.q = StreamQueue(QUEUE_MAXSIZE, policies={
+            'pow': KEEP, 'dev': COALESCE, 'mot': DROP, 'fac': DROP,
+            'session': KEEP, 'labels': KEEP, 'recover': KEEP})
+        self.worker = StreamWorker(self.q, {
+            'session': self._on_session,
+            'labels': self._on_labels,
+            'pow': self.rec.on_pow,
+            'mot': self.rec.on_mot,
+            'dev': self.rec.on_dev,
+            'fac': self.rec.on_fac,
+            'recover': self._recover,
+        }, name="SleepWorker", idle=self._watchdog)
+
+        self.c.bind(create_session_done=self.on_create_session_done)
+        self.c.bind(new_data_labels=self.on_new_data_labels)
+        self.c.bind(new_pow_data=self.on_new_pow_data)
+        self.c.bind(new_mot_data=self.on_new_mot_data)
+        self.c.bind(new_dev_data=self.on_new_dev_data)
+        self.c.bind(new_fe_data=self.on_new_fe_data)
+        self.c.bind(warn_cortex_stop_all_sub=self.on_stop_all_streams)
+        self.c.bind(inform_error=self.on_error)
+
+    def start(self):
+        print("[INFO] Opening Cortex...")
+        self.worker.start()
+        try:
+            self.c.open()
+        finally:
+            self.worker.stop()
+            print("[INFO] stream queue:", self.q.format_stats())
+            self.rec.close()
+
+    # ---- websocket スレッド（キューに入れるだけ） ----
+    def on_create_session_done(self, *args, **kwargs):
+        print("[INFO] Session created. Subscribing streams...")
+        self.q.put('session', None)
+        self.c.sub_request(STREAMS)
+        self._subscribed = True
+
+    def on_new_data_labels(self, *args, **kwargs):
+        self.q.put('labels', kwargs.get('data', {}))
+
+    def on_new_pow_data(self, *args, **kwargs):
+        self._last_rx = time.time()
+        self.q.put('pow', kwargs.get('data', {}))
+
+    def on_new_mot_data(self, *args, **kwargs):
+        self._last_rx = time.time()
+        self.q.put('mot', kwargs.get('data', {}))
+
+    def on_new_dev_data(self, *args, **kwargs):
+        self._last_rx = time.time()
+        self.q.put('dev', kwargs.get('data', {}))
+
+    def on_new_fe_data(self, *args, **kwargs):
+        self._last_rx = time.time()
+        self.q.put('fac', kwargs.get('data', {}))
+
+    def on_stop_all_streams(self, *args, **kwargs):
+        print("[WARN] Cortex stopped all streams. Recovering...")
+        self.q.put('recover', None)
+
+    def on_error(self, *args, **kwargs):
+        print("[ERR]", kwargs.get('error_data', {}))
+
+    # ---- ワーカースレッド ----
+    def _on_session(self, _):
+        self.rec.start_session()
+
+    def _on_labels(self, data):
+        self.rec.on_labels(data.get('streamName'), data.get('labels', []))
+
+    def _recover(self, _):
+        try:
+            self.c.create_session()
+            time.sleep(1.0)
+            if self._subscribed:
+                self.c.sub_request(STREAMS)
+        except Exception as e:
+            print("[ERR] recover failed:", e)
+        self._last_rx = time.time()
+
+    def _watchdog(self):
+        """ワーカーのバッチごとに呼ばれる。待ちはワーカーだけを止め、受信スレッドはキューに入れ続ける"""
+        if not self._subscribed or time.time() - self._last_rx <= 5:
+            return
+        print("[WARN] no data >5s, resubscribing...")
+        try:
+            self.c.sub_request(STREAMS)
+            time.sleep(2)
+            if time.time() - self._last_rx > 7:
+                print("[WARN] recreate session...")
+                self.c.create_session()
+                time.sleep(1)
+                self.c.sub_request(STREAMS)
+        except Exception as e:
+            print("[ERR] watchdog:", e)
+        self._last_rx = time.time()
 
 if __name__ == "__main__":
     if not CLIENT_ID or not CLIENT_SECRET:
@@ -1,5 +1,6 @@
 # app_sleep_eog.py
 import time, csv, os, threading
+from queue import Empty
 from cortex import Cortex
 from sleep_engine import SleepEngine
 from quality import is_all_zero, safe_get
@@ -14,6 +15,7 @@ CLIENT_ID     = os.getenv("CLIENT_ID", "")
 CLIENT_SECRET = os.getenv("CLIENT_SECRET", "")
 HEADSET_ID    = os.getenv("HEADSET_ID", "")   # 任意
 OUT_CSV = "sleep_candidates_eog.csv"
+EOG_DRAIN_MAX = 512  # 1回のドレインで取り出す EOG サンプルの上限
 
 class SleepAppEOG:
     def __init__(self):
@@ -40,9 +42,17 @@ class SleepAppEOG:
         while True:
             try:
                 t, v = self.eog_q.get(timeout=1.0)
-                self.eng.on_eog_sample(t, v, src_fs_hint=200.0)
+                ts, vs = [t], [v]
+                # キューに溜まっている分はまとめて取り出して一括投入
+                while len(ts) < EOG_DRAIN_MAX:
+                    try:
+                        t, v = self.eog_q.get_nowait()
+                    except Empty:
+                        break
+                    ts.append(t); vs.append(v)
+                self.eng.on_eog_block(ts, vs, src_fs_hint=200.0)
                 # 単独EOGでstepを進めたい時はこれでOK
-                self._maybe_step(t)
+                self._maybe_step(ts[-1])
             except Exception:
                 pass
 
@@ -0,0 +1,199 @@
+# app_sleep_multi.py
+"""
+複数のヘッドセット・複数のユーザーを1プロセスで記録するスーパーバイザ。
+Cortex への接続（cortex_async.AsyncCortex）は1本だけで、ヘッドセットごとにセッションを作り、
+各セッションのストリームを sid で振り分けて、ユーザーごとの SleepRecorder（SleepEngine と記録）に渡す。
+受信と再接続は1つのイベントループ上で動き、特徴量計算・ファイル書き込みはユーザーごとの
+ワーカースレッド（stream_queue.StreamWorker）で行うので、1人の処理が遅れても他の受信は止まらない。
+
+  python app_sleep_multi.py mitachi:EPOCX-A1B2C3D4 gotou:INSIGHT-5E6F7A8B
+
+ユーザーごとの出力（user_data/<username>/ の CSV・生ログ・要約・登録簿の更新）は app_sleep.py と同じ。
+- ヘッドセットが繋がらないユーザーがいても、他のユーザーの記録は続ける
+- データが WATCHDOG_SEC 途切れたら再購読し、それでも来なければセッションを作り直す
+  （Cortex がセッションを止めた warning を受けたときもすぐ作り直す）
+"""
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from cortex_async import AsyncCortex, CortexError, StreamChannel
+from cortex import CORTEX_STOP_ALL_STREAMS, CORTEX_CLOSE_SESSION
+from app_sleep import SleepRecorder, STREAMS, CLIENT_ID, CLIENT_SECRET, QUEUE_MAXSIZE
+from stream_queue import StreamQueue, StreamWorker, KEEP, COALESCE, DROP
+
+WATCHDOG_SEC = 5.0          # これだけデータが来なければ再購読
+RESUBSCRIBE_WAIT_SEC = 2.0  # 再購読後、セッションを作り直すまでに待つ時間
+RETRY_SEC = 10.0            # ヘッドセット接続・セッション作成に失敗したときの再試行間隔
+
+
+class Sleeper:
+    """1ヘッドセット = 1ユーザーぶんのセッションと記録"""
+    def __init__(self, client: AsyncCortex, username: str, headset_id: str):
+        self.c = client
+        self.username = username
+        self.headset_id = headset_id
+        self.rec = SleepRecorder(username)
+        self.session_id: Optional[str] = None
+        self._ch: Optional[StreamChannel] = None
+        # セッション開始・列名もデータと同じキューに流して順序を保つ
+        self.q = StreamQueue(QUEUE_MAXSIZE, policies={
+            'pow': KEEP, 'dev': COALESCE, 'mot': DROP, 'fac': DROP,
+            'session': KEEP, 'labels': KEEP})
+        self.worker = StreamWorker(self.q, {
+            'session': self._on_session,
+            'labels': self._on_labels,
+            'pow': self.rec.on_pow,
+            'mot': self.rec.on_mot,
+            'dev': self.rec.on_dev,
+            'fac': self.rec.on_fac,
+        }, name=f"Sleeper-{username}")
+
+    def _log(self, level: str, msg: str):
+        print(f"[{level}] [{self.username}@{self.headset_id}] {msg}")
+
+    async def _open_session(self):
+        await self.c.connect_headset(self.headset_id)
+        self.session_id = await self.c.create_session(self.headset_id)
+        # subscribe の応答より先にデータが届いても取りこぼさないよう、先に受け口を作る
+        self._ch = self.c.streams(self.session_id, STREAMS)
+        labels = await self.c.subscribe(self.session_id, STREAMS)
+        # 記録（CSV・登録簿）は購読できてから始める。受け口のデータはこのあと run() がキューに入れる
+        self.q.put('session', None)
+        for stream, cols in labels.items():
+            self.q.put('labels', (stream, cols))
+
+    # ---- ワーカースレッド ----
+    def _on_session(self, _):
+        self.rec.start_session()
+
+    def _on_labels(self, item):
+        self.rec.on_labels(*item)
+
+    async def _drop_session(self):
+        """受け口を外し、Cortex 側のセッションも閉じる（閉じられなくても続ける）"""
+        sid, self.session_id = self.session_id, None
+        if self._ch is not None and sid is not None:
+            self.c.unstream(sid, self._ch)
+        self._ch = None
+        if sid is not None and self.c.connected:
+            try:
+                await self.c.close_session(sid)
+            except CortexError as e:
+                self._log("WARN", f"close session {sid}: {e}")
+
+    def session_lost(self):
+        """Cortex がこのセッションを止めた。受け口を閉じると run() がセッションを作り直す"""
+        self._log("WARN", "Cortex stopped the session. Recovering...")
+        if self._ch is not None:
+            self._ch.close()
+
+    async def _next(self) -> Optional[Tuple[str, Dict]]:
+        """次のデータ。WATCHDOG_SEC 来なければ None（受け口が閉じたら StopAsyncIteration）"""
+        try:
+            return await asyncio.wait_for(self._ch.__anext__(), WATCHDOG_SEC)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _recover(self):
+        """再購読してデータが戻るのを待ち、戻らなければセッションを捨てる（run() が作り直す）"""
+        self._log("WARN", f"no data >{WATCHDOG_SEC:.0f}s, resubscribing...")
+        try:
+            await self.c.subscribe(self.session_id, STREAMS)
+            await asyncio.sleep(RESUBSCRIBE_WAIT_SEC)
+            if self._ch is not None and self._ch.qsize() > 0:
+                return
+        except CortexError as e:
+            self._log("ERR", f"watchdog: {e}")
+        self._log("WARN", "recreate session...")
+        await self._drop_session()
+
+    async def run(self):
+        self.worker.start()
+        try:
+            await self._loop()
+        finally:
+            # 残りを書き切ってから閉じる（待つあいだも他のユーザーの受信は続ける）
+            await asyncio.to_thread(self.worker.stop)
+            self._log("INFO", f"stream queue: {self.q.format_stats()}")
+            self.rec.close()
+
+    async def _loop(self):
+        while self.c.connected:
+            if self.session_id is None:
+                try:
+                    await self._open_session()
+                except CortexError as e:
+                    self._log("ERR", f"{e}; retry in {RETRY_SEC:.0f}s")
+                    await self._drop_session()
+                    await asyncio.sleep(RETRY_SEC)
+                    continue
+            try:
+                item = await self._next()
+            except StopAsyncIteration:
+                await self._drop_session()    # session_lost() か接続断
+                continue
+            if item is None:
+                await self._recover()
+                continue
+            stream, data = item
+            self.q.put(stream, data)
+
+
+class Supervisor:
+    def __init__(self, pairs: List[Tuple[str, str]], client: Optional[AsyncCortex] = None):
+        self.pairs = pairs
+        self.c = client or AsyncCortex(CLIENT_ID, CLIENT_SECRET)
+        self.sleepers: List[Sleeper] = []
+
+    async def _watch_warnings(self):
+        async for w in self.c.warning_stream():
+            if w.get('code') not in (CORTEX_STOP_ALL_STREAMS, CORTEX_CLOSE_SESSION):
+                continue
+            sid = (w.get('message') or {}).get('sessionId')
+            for s in self.sleepers:
+                if s.session_id is not None and s.session_id == sid:
+                    s.session_lost()
+
+    async def run(self):
+        async with self.c:
+            await self.c.authorize()
+            self.sleepers = [Sleeper(self.c, u, h) for u, h in self.pairs]
+            watcher = asyncio.create_task(self._watch_warnings())
+            results = await asyncio.gather(*(s.run() for s in self.sleepers), return_exceptions=True)
+            watcher.cancel()
+            for s, r in zip(self.sleepers, results):
+                if isinstance(r, Exception):
+                    print(f"[ERR] [{s.username}@{s.headset_id}] stopped: {r}")
+
+
+def parse_pairs(args: List[str]) -> List[Tuple[str, str]]:
+    """"user:headset" の並びを (username, headset_id) にする（ヘッドセットとユーザーはそれぞれ重複不可）"""
+    pairs = []
+    for a in args:
+        username, sep, headset = a.partition(":")
+        if not sep or not username or not headset:
+            raise SystemExit(f"invalid pair (expected user:headset): {a}")
+        pairs.append((username, headset))
+    for i, name in ((0, "user"), (1, "headset")):
+        seen = [p[i] for p in pairs]
+        dup = {x for x in seen if seen.count(x) > 1}
+        if dup:
+            raise SystemExit(f"duplicate {name}: {', '.join(sorted(dup))}")
+    return pairs
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="複数ヘッドセット・複数ユーザーを1プロセスで記録する")
+    ap.add_argument("pairs", nargs="+", metavar="USER:HEADSET", help="ユーザー名とヘッドセット ID の組")
+    args = ap.parse_args()
+    if not CLIENT_ID or not CLIENT_SECRET:
+        raise SystemExit("Please set CLIENT_ID / CLIENT_SECRET via environment variables or .env file")
+
+    pairs = parse_pairs(args.pairs)
+    for u, h in pairs:
+        print(f"[INFO] {u} <- {h}")
+    try:
+        asyncio.run(Supervisor(pairs).run())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,72 @@
+# bench_codec.py
+"""
+Cortex のストリームフレーム（pow / mot / eeg）を JSON デコードする速さを、
+インストールされている各バックエンド（標準 json, ujson, orjson）で比べるマイクロベンチマーク。
+
+  python bench_codec.py [--n 50000]
+
+json_codec が実際に選ぶバックエンドには * が付く。
+"""
+import json, random, time
+from typing import Callable, Dict
+
+import json_codec
+
+EEG_CHANNELS = 14
+
+
+def sample_frames() -> Dict[str, str]:
+    """実機と同じ形・桁数のフレーム（sid, time, <stream>）を作る"""
+    rnd = random.Random(0)
+    sid = "7f899d66-6d1b-4a7a-9b2c-1f0c1a2b3c4d"
+    t = 1725120123.456789
+    pow_vals = [round(rnd.uniform(0, 30), 3) for _ in range(EEG_CHANNELS * 5)]
+    mot_vals = [rnd.randint(0, 65535)] + [0] + [round(rnd.uniform(-1, 1), 6) for _ in range(8)]
+    eeg_vals = ([rnd.randint(0, 127), 0] + [round(rnd.uniform(4000, 4400), 6) for _ in range(EEG_CHANNELS)]
+                + [0, 0, []])
+    return {
+        "pow": json.dumps({"sid": sid, "time": t, "pow": pow_vals}),
+        "mot": json.dumps({"sid": sid, "time": t, "mot": mot_vals}),
+        "eeg": json.dumps({"sid": sid, "time": t, "eeg": eeg_vals}),
+    }
+
+
+def backends() -> Dict[str, Callable]:
+    found = {"json": json.loads}
+    try:
+        import ujson
+        found["ujson"] = ujson.loads
+    except ImportError:
+        pass
+    try:
+        import orjson
+        found["orjson"] = orjson.loads
+    except ImportError:
+        pass
+    return found
+
+
+def bench(loads: Callable, frame: str, n: int) -> float:
+    """1秒あたりにデコードできるフレーム数"""
+    for _ in range(min(n, 1000)):
+        loads(frame)
+    t0 = time.perf_counter()
+    for _ in range(n):
+        loads(frame)
+    return n / (time.perf_counter() - t0)
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Cortex フレームの JSON デコード速度")
+    ap.add_argument("--n", type=int, default=50000, help="1組み合わせあたりのデコード回数")
+    args = ap.parse_args()
+
+    frames = sample_frames()
+    found = backends()
+    print(f"[INFO] json_codec backend: {json_codec.BACKEND}")
+    print(f"{'stream':<6} {'bytes':>6} " + " ".join(f"{name + ('*' if name == json_codec.BACKEND else ''):>14}"
+                                                for name in found))
+    for stream, frame in frames.items():
+        rates = [bench(loads, frame, args.n) for loads in found.values()]
+        print(f"{stream:<6} {len(frame):>6} " + " ".join(f"{r:>10,.0f} msg/s" for r in rates))
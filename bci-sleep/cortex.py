@@ -24,7 +24,7 @@ except ImportError:
 import threading
 import ssl
 import time
-import json
+import json_codec
 from datetime import datetime
 import os
 from dotenv import load_dotenv
@@ -85,6 +85,56 @@ HEADSET_CANNOT_WORK_WITH_BTLE = 112
 HEADSET_CANNOT_CONNECT_DISABLE_MOTION = 113
 HEADSET_SCANNING_FINISHED = 142
 
+# ---- ストリームデータのデコーダ ----
+# pow/mot/met/eeg はメッセージの dict をそのまま渡す（'sid' が付いたまま、値のリストは作り直さない）
+def _decode_passthrough(result_dic):
+    return result_dic
+
+def _decode_eeg(result_dic):
+    result_dic['eeg'].pop() # remove markers
+    return result_dic
+
+def _decode_com(result_dic):
+    com = result_dic['com']
+    return {'action': com[0], 'power': com[1], 'time': result_dic['time']}
+
+def _decode_fac(result_dic):
+    fac = result_dic['fac']
+    return {'eyeAct': fac[0],   #eye action
+            'uAct': fac[1],     #upper action
+            'uPow': fac[2],     #upper action power
+            'lAct': fac[3],     #lower action
+            'lPow': fac[4],     #lower action power
+            'time': result_dic['time']}
+
+def _decode_dev(result_dic):
+    dev = result_dic['dev']
+    return {'signal': dev[1], 'dev': dev[2], 'batteryPercent': dev[3], 'time': result_dic['time']}
+
+def _decode_sys(result_dic):
+    return result_dic['sys']
+
+STREAM_DECODERS = {
+    'com': ('new_com_data', _decode_com),
+    'fac': ('new_fe_data', _decode_fac),
+    'eeg': ('new_eeg_data', _decode_eeg),
+    'mot': ('new_mot_data', _decode_passthrough),
+    'dev': ('new_dev_data', _decode_dev),
+    'met': ('new_met_data', _decode_passthrough),
+    'pow': ('new_pow_data', _decode_passthrough),
+    'sys': ('new_sys_data', _decode_sys),
+}
+
+def data_labels_of(stream_name, stream_cols):
+    """subscribe 応答の cols から、デコード後のデータに対応する列名を取り出す"""
+    if stream_name == 'eeg':
+        # remove MARKERS
+        return stream_cols[:-1]
+    elif stream_name == 'dev':
+        # get cq header column except battery, signal and battery percent
+        return stream_cols[2]
+    return stream_cols
+
 class Cortex(Dispatcher):
 
     _events_ = ['inform_error','create_session_done', 'query_profile_done', 'load_unload_profile_done', 
@@ -370,58 +420,34 @@ class Cortex(Dispatcher):
             if (self.isHeadsetConnected == False):
                 self.refresh_headset_list()
 
+    def _has_listeners(self, event_name):
+        e = self.get_dispatcher_event(event_name)
+        return bool(len(e.listeners) or len(e.aio_listeners) or e.aio_waiters.waiters)
+
     def handle_stream_data(self, result_dic):
-        if result_dic.get('com') != None:
-            com_data = {}
-            com_data['action'] = result_dic['com'][0]
-            com_data['power'] = result_dic['com'][1]
-            com_data['time'] = result_dic['time']
-            self.emit('new_com_data', data=com_data)
-        elif result_dic.get('fac') != None:
-            fe_data = {}
-            fe_data['eyeAct'] = result_dic['fac'][0]    #eye action
-            fe_data['uAct'] = result_dic['fac'][1]      #upper action
-            fe_data['uPow'] = result_dic['fac'][2]      #upper action power
-            fe_data['lAct'] = result_dic['fac'][3]      #lower action
-            fe_data['lPow'] = result_dic['fac'][4]      #lower action power
-            fe_data['time'] = result_dic['time']
-            self.emit('new_fe_data', data=fe_data)
-        elif result_dic.get('eeg') != None:
-            eeg_data = {}
-            eeg_data['eeg'] = result_dic['eeg']
-            eeg_data['eeg'].pop() # remove markers
-            eeg_data['time'] = result_dic['time']
-            self.emit('new_eeg_data', data=eeg_data)
-        elif result_dic.get('mot') != None:
-            mot_data = {}
-            mot_data['mot'] = result_dic['mot']
-            mot_data['time'] = result_dic['time']
-            self.emit('new_mot_data', data=mot_data)
-        elif result_dic.get('dev') != None:
-            dev_data = {}
-            dev_data['signal'] = result_dic['dev'][1]
-            dev_data['dev'] = result_dic['dev'][2]
-            dev_data['batteryPercent'] = result_dic['dev'][3]
-            dev_data['time'] = result_dic['time']
-            self.emit('new_dev_data', data=dev_data)
-        elif result_dic.get('met') != None:
-            met_data = {}
-            met_data['met'] = result_dic['met']
-            met_data['time'] = result_dic['time']
-            self.emit('new_met_data', data=met_data)
-        elif result_dic.get('pow') != None:
-            pow_data = {}
-            pow_data['pow'] = result_dic['pow']
-            pow_data['time'] = result_dic['time']
-            self.emit('new_pow_data', data=pow_data)
-        elif result_dic.get('sys') != None:
-            sys_data = result_dic['sys']
-            self.emit('new_sys_data', data=sys_data)
-        else :
+        # ストリーム名 -> (イベント名, デコーダ) の表引き。購読中のストリームは1メッセージに1つだけ
+        for key in result_dic:
+            entry = STREAM_DECODERS.get(key)
+            if entry is not None:
+                break
+        else:
             print(result_dic)
+            return
+        event_name, decode = entry
+        # 誰も bind していないストリームはデコードせずに捨てる
+        if not self._has_listeners(event_name):
+            return
+        self.emit(event_name, data=decode(result_dic))
+
+    def _send(self, request, label=None):
+        """リクエストを1回だけシリアライズして送る。debug 時は送るのと同じ文字列を表示する"""
+        payload = json_codec.dumpb(request)
+        if self.debug and label:
+            print(label, payload.decode('utf-8'))
+        self.ws.send(payload)
 
     def on_message(self, *args):
-        recv_dic = json.loads(args[1])
+        recv_dic = json_codec.loads(args[1])
         if 'sid' in recv_dic:
             self.handle_stream_data(recv_dic)
         elif 'result' in recv_dic:
@@ -441,10 +467,7 @@ class Cortex(Dispatcher):
             "method": "queryHeadsets",
             "params": {}
         }
-        if self.debug:
-            print('queryHeadsets request \n', json.dumps(query_headset_request, indent=4))
-
-        self.ws.send(json.dumps(query_headset_request, indent=4))
+        self._send(query_headset_request, 'queryHeadsets request \n')
 
     def connect_headset(self, headset_id):
         print('connect headset --------------------------------')
@@ -457,10 +480,7 @@ class Cortex(Dispatcher):
                 "headset": headset_id
             }
         }
-        if self.debug:
-            print('controlDevice request \n', json.dumps(connect_headset_request, indent=4))
-
-        self.ws.send(json.dumps(connect_headset_request, indent=4))
+        self._send(connect_headset_request, 'controlDevice request \n')
 
     def request_access(self):
         print('request access --------------------------------')
@@ -474,7 +494,7 @@ class Cortex(Dispatcher):
             "id": REQUEST_ACCESS_ID
         }
 
-        self.ws.send(json.dumps(request_access_request, indent=4))
+        self._send(request_access_request)
 
     def has_access_right(self):
         print('check has access right --------------------------------')
@@ -487,7 +507,7 @@ class Cortex(Dispatcher):
             },
             "id": HAS_ACCESS_RIGHT_ID
         }
-        self.ws.send(json.dumps(has_access_request, indent=4))
+        self._send(has_access_request)
 
     def authorize(self):
         print('authorize --------------------------------')
@@ -503,10 +523,7 @@ class Cortex(Dispatcher):
             "id": AUTHORIZE_ID
         }
 
-        if self.debug:
-            print('auth request \n', json.dumps(authorize_request, indent=4))
-
-        self.ws.send(json.dumps(authorize_request))
+        self._send(authorize_request, 'auth request \n')
 
     def create_session(self):
         if self.session_id != '':
@@ -525,10 +542,7 @@ class Cortex(Dispatcher):
             }
         }
         
-        if self.debug:
-            print('create session request \n', json.dumps(create_session_request, indent=4))
-
-        self.ws.send(json.dumps(create_session_request))
+        self._send(create_session_request, 'create session request \n')
 
     def close_session(self):
         print('close session --------------------------------')
@@ -543,7 +557,7 @@ class Cortex(Dispatcher):
             }
         }
 
-        self.ws.send(json.dumps(close_session_request))
+        self._send(close_session_request)
 
     def get_cortex_info(self):
         print('get cortex version --------------------------------')
@@ -553,7 +567,7 @@ class Cortex(Dispatcher):
             "id":GET_CORTEX_INFO_ID
         }
 
-        self.ws.send(json.dumps(get_cortex_info_request))
+        self._send(get_cortex_info_request)
 
     """
         Prepare steps include:
@@ -584,7 +598,7 @@ class Cortex(Dispatcher):
             }
         }
 
-        self.ws.send(json.dumps(disconnect_headset_request))
+        self._send(disconnect_headset_request)
 
     def sub_request(self, stream):
         print('subscribe request --------------------------------')
@@ -598,10 +612,7 @@ class Cortex(Dispatcher):
             }, 
             "id": SUB_REQUEST_ID
         }
-        if self.debug:
-            print('subscribe request \n', json.dumps(sub_request_json, indent=4))
-
-        self.ws.send(json.dumps(sub_request_json))
+        self._send(sub_request_json, 'subscribe request \n')
 
     def unsub_request(self, stream):
         print('unsubscribe request --------------------------------')
@@ -615,25 +626,12 @@ class Cortex(Dispatcher):
             }, 
             "id": UNSUB_REQUEST_ID
         }
-        if self.debug:
-            print('unsubscribe request \n', json.dumps(unsub_request_json, indent=4))
-
-        self.ws.send(json.dumps(unsub_request_json))
+        self._send(unsub_request_json, 'unsubscribe request \n')
 
     def extract_data_labels(self, stream_name, stream_cols):
         labels = {}
         labels['streamName'] = stream_name
-
-        data_labels = []
-        if stream_name == 'eeg':
-            # remove MARKERS
-            data_labels = stream_cols[:-1]
-        elif stream_name == 'dev':
-            # get cq header column except battery, signal and battery percent
-            data_labels = stream_cols[2]
-        else:
-            data_labels = stream_cols
-
+        data_labels = data_labels_of(stream_name, stream_cols)
         labels['labels'] = data_labels
         print(labels)
         self.emit('new_data_labels', data=labels)
@@ -649,11 +647,7 @@ class Cortex(Dispatcher):
             "id": QUERY_PROFILE_ID
         }
 
-        if self.debug:
-            print('query profile request \n', json.dumps(query_profile_json, indent=4))
-            print('\n')
-
-        self.ws.send(json.dumps(query_profile_json))
+        self._send(query_profile_json, 'query profile request \n')
 
     def get_current_profile(self):
         print('get current profile:')
@@ -667,11 +661,7 @@ class Cortex(Dispatcher):
             "id": GET_CURRENT_PROFILE_ID
         }
         
-        if self.debug:
-            print('get current profile json:\n', json.dumps(get_profile_json, indent=4))
-            print('\n')
-
-        self.ws.send(json.dumps(get_profile_json))
+        self._send(get_profile_json, 'get current profile json:\n')
 
     def setup_profile(self, profile_name, status):
         print('setup profile: ' + status + ' -------------------------------- ')
@@ -687,11 +677,7 @@ class Cortex(Dispatcher):
             "id": SETUP_PROFILE_ID
         }
         
-        if self.debug:
-            print('setup profile json:\n', json.dumps(setup_profile_json, indent=4))
-            print('\n')
-
-        self.ws.send(json.dumps(setup_profile_json))
+        self._send(setup_profile_json, 'setup profile json:\n')
 
     def train_request(self, detection, action, status):
         print('train request --------------------------------')
@@ -707,11 +693,7 @@ class Cortex(Dispatcher):
             }, 
             "id": TRAINING_ID
         }
-        if self.debug:
-            print('training request:\n', json.dumps(train_request_json, indent=4))
-            print('\n')
-
-        self.ws.send(json.dumps(train_request_json))
+        self._send(train_request_json, 'training request:\n')
 
     def create_record(self, title, **kwargs):
         print('create record --------------------------------')
@@ -733,10 +715,7 @@ class Cortex(Dispatcher):
             "params": params_val, 
             "id": CREATE_RECORD_REQUEST_ID
         }
-        if self.debug:
-            print('create record request:\n', json.dumps(create_record_request, indent=4))
-
-        self.ws.send(json.dumps(create_record_request))
+        self._send(create_record_request, 'create record request:\n')
 
     def stop_record(self):
         print('stop record --------------------------------')
@@ -750,9 +729,7 @@ class Cortex(Dispatcher):
 
             "id": STOP_RECORD_REQUEST_ID
         }
-        if self.debug:
-            print('stop record request:\n', json.dumps(stop_record_request, indent=4))
-        self.ws.send(json.dumps(stop_record_request))
+        self._send(stop_record_request, 'stop record request:\n')
 
     def export_record(self, folder, stream_types, export_format, record_ids,
                       version, **kwargs):
@@ -783,11 +760,7 @@ class Cortex(Dispatcher):
             "params": params_val
         }
 
-        if self.debug:
-            print('export record request \n',
-                json.dumps(export_record_request, indent=4))
-        
-        self.ws.send(json.dumps(export_record_request))
+        self._send(export_record_request, 'export record request \n')
 
     def inject_marker_request(self, time, value, label, **kwargs):
         print('inject marker --------------------------------')
@@ -806,9 +779,7 @@ class Cortex(Dispatcher):
             "method": "injectMarker", 
             "params": params_val
         }
-        if self.debug:
-            print('inject marker request \n', json.dumps(inject_marker_request, indent=4))
-        self.ws.send(json.dumps(inject_marker_request))
+        self._send(inject_marker_request, 'inject marker request \n')
 
     def update_marker_request(self, marker_id, time, **kwargs):
         print('update marker --------------------------------')
@@ -826,9 +797,7 @@ class Cortex(Dispatcher):
             "method": "updateMarker", 
             "params": params_val
         }
-        if self.debug:
-            print('update marker request \n', json.dumps(update_marker_request, indent=4))
-        self.ws.send(json.dumps(update_marker_request))
+        self._send(update_marker_request, 'update marker request \n')
 
     def get_mental_command_action_sensitivity(self, profile_name):
         print('get mental command sensitivity ------------------')
@@ -842,10 +811,7 @@ class Cortex(Dispatcher):
                 "status": "get"
             }
         }
-        if self.debug:
-            print('get mental command sensitivity \n', json.dumps(sensitivity_request, indent=4))
-
-        self.ws.send(json.dumps(sensitivity_request))
+        self._send(sensitivity_request, 'get mental command sensitivity \n')
 
     def set_mental_command_action_sensitivity(self, profile_name, values):
         print('set mental command sensitivity ------------------')
@@ -861,10 +827,7 @@ class Cortex(Dispatcher):
                                     "values": values
                                 }
                             }
-        if self.debug:
-            print('set mental command sensitivity \n', json.dumps(sensitivity_request, indent=4))
-            
-        self.ws.send(json.dumps(sensitivity_request))
+        self._send(sensitivity_request, 'set mental command sensitivity \n')
 
     def get_mental_command_active_action(self, profile_name):
         print('get mental command active action ------------------')
@@ -878,10 +841,7 @@ class Cortex(Dispatcher):
                 "status": "get"
             }
         }
-        if self.debug:
-            print('get mental command active action \n', json.dumps(command_active_request, indent=4))
-
-        self.ws.send(json.dumps(command_active_request))
+        self._send(command_active_request, 'get mental command active action \n')
 
     def set_mental_command_active_action(self, actions):
         print('set mental command active action ------------------')
@@ -897,10 +857,7 @@ class Cortex(Dispatcher):
             }
         }
 
-        if self.debug:
-            print('set mental command active action \n', json.dumps(command_active_request, indent=4))
-
-        self.ws.send(json.dumps(command_active_request))
+        self._send(command_active_request, 'set mental command active action \n')
 
     def get_mental_command_brain_map(self, profile_name):
         print('get mental command brain map ------------------')
@@ -914,9 +871,7 @@ class Cortex(Dispatcher):
                 "session": self.session_id
             }
         }
-        if self.debug:
-            print('get mental command brain map \n', json.dumps(brain_map_request, indent=4))
-        self.ws.send(json.dumps(brain_map_request))
+        self._send(brain_map_request, 'get mental command brain map \n')
 
     def get_mental_command_training_threshold(self, profile_name):
         print('get mental command training threshold -------------')
@@ -929,9 +884,7 @@ class Cortex(Dispatcher):
                 "session": self.session_id
             }
         }
-        if self.debug:
-            print('get mental command training threshold \n', json.dumps(training_threshold_request, indent=4))
-        self.ws.send(json.dumps(training_threshold_request))
+        self._send(training_threshold_request, 'get mental command training threshold \n')
 
     def refresh_headset_list(self):
         print('refresh headset list --------------------------------')
@@ -943,10 +896,7 @@ class Cortex(Dispatcher):
                 "command": "refresh"
             }
         }
-        if self.debug:
-            print('controlDevice refresh request \n', json.dumps(refresh_request, indent=4))
-
-        self.ws.send(json.dumps(refresh_request, indent=4))
+        self._send(refresh_request, 'controlDevice refresh request \n')
 
 # -------------------------------------------------------------------
 # -------------------------------------------------------------------
@@ -0,0 +1,357 @@
+# cortex_async.py
+"""
+asyncio 版の Cortex クライアント。1本の websocket を受信タスク1つで読み、
+- リクエストごとに一意な id と Future を割り当てて応答を対応付ける（await client.call(...)）
+- ストリームデータは (session, stream) ごとの非同期イテレータに振り分ける
+ので、複数のヘッドセット・セッションを1つのイベントループで扱え、遅い処理が他の受信を止めない。
+
+  async with AsyncCortex(CLIENT_ID, CLIENT_SECRET) as c:
+      await c.authorize()
+      headset = await c.connect_headset()          # 省略時は最初に見つかったヘッドセット
+      sid = await c.create_session(headset)
+      pow_stream = c.stream(sid, 'pow')            # subscribe より先に作るとデータを取りこぼさない
+      labels = await c.subscribe(sid, ['pow', 'mot', 'dev'])
+      async for d in pow_stream:
+          print(d['time'], d['pow'][:5])
+
+データの形は cortex.Cortex の new_*_data イベントと同じ（STREAM_DECODERS を共有）。
+消費が追いつかないストリームは古いものから捨て、StreamChannel.dropped に数える。
+"""
+import asyncio, itertools, ssl, sys, warnings
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+try:
+    import websockets
+except ImportError:
+    print(f"[ERROR] Required library 'websockets' is not installed. Please run: {sys.executable} -m pip install websockets", file=sys.stderr)
+    sys.exit(1)
+
+import json_codec
+from cortex import (STREAM_DECODERS, data_labels_of, ACCESS_RIGHT_GRANTED, ACCESS_RIGHT_REJECTED,
+                    CORTEX_STOP_ALL_STREAMS, CORTEX_CLOSE_SESSION)
+
+CORTEX_URL = "wss://localhost:6868"
+REQUEST_TIMEOUT_SEC = 30.0
+ACCESS_WAIT_SEC = 120.0         # Emotiv Launcher での承認待ち
+HEADSET_POLL_SEC = 3.0          # 'connecting' の間 queryHeadsets を繰り返す間隔
+HEADSET_CONNECT_SEC = 60.0
+STREAM_QUEUE_SIZE = 1024
+
+
+class CortexError(Exception):
+    """Cortex が error 応答を返した（または応答が来なかった）"""
+    def __init__(self, method: str, code: Optional[int], message: str, data: Any = None):
+        super().__init__(f"{method}: {message} (code={code})")
+        self.method = method
+        self.code = code
+        self.message = message
+        self.data = data
+
+
+class StreamChannel:
+    """1購読先ぶんの有限キュー。満杯なら一番古いデータを捨てる（受信タスクは待たない）"""
+    _CLOSED = object()
+
+    def __init__(self, maxsize: int = STREAM_QUEUE_SIZE, tagged: bool = False):
+        self._q: asyncio.Queue = asyncio.Queue(maxsize)
+        self.tagged = tagged    # True なら (ストリーム名, データ) を流す
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, item):
+        if self.closed:
+            return
+        if self._q.full():
+            self._q.get_nowait()
+            self.dropped += 1
+        self._q.put_nowait(item)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self._q.full():
+            self._q.get_nowait()
+            self.dropped += 1
+        self._q.put_nowait(self._CLOSED)
+
+    def qsize(self) -> int:
+        return self._q.qsize()
+
+    def __aiter__(self) -> AsyncIterator:
+        return self
+
+    async def __anext__(self):
+        item = await self._q.get()
+        if item is self._CLOSED:
+            self._q.put_nowait(item)    # 他の待ち手にも終わりを伝える
+            raise StopAsyncIteration
+        return item
+
+
+class AsyncCortex:
+    def __init__(self, client_id: str, client_secret: str, license: str = '', debit: int = 10,
+                 url: str = CORTEX_URL, debug: bool = False):
+        if client_id == '':
+            raise ValueError('Empty your_app_client_id. Please fill in your_app_client_id before running the example.')
+        if client_secret == '':
+            raise ValueError('Empty your_app_client_secret. Please fill in your_app_client_secret before running the example.')
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.license = license
+        self.debit = debit
+        self.url = url
+        self.debug = debug
+        self.auth = ''
+        self.ws = None
+        self._ids = itertools.count(1)
+        self._pending: Dict[int, Tuple[str, asyncio.Future]] = {}
+        self._streams: Dict[Tuple[str, str], List[StreamChannel]] = {}
+        self._warnings: List[StreamChannel] = []
+        self._access_granted: Optional[asyncio.Event] = None
+        self._reader: Optional[asyncio.Task] = None
+
+    # ---- 接続 ----
+    async def open(self):
+        # Emotiv の自己署名証明書を検証しない（cortex.Cortex と同じ）
+        ctx = None
+        if self.url.startswith("wss://"):
+            ctx = ssl.create_default_context()
+            ctx.check_hostname = False
+            ctx.verify_mode = ssl.CERT_NONE
+        self.ws = await websockets.connect(self.url, ssl=ctx, max_size=None)
+        self._access_granted = asyncio.Event()
+        self._reader = asyncio.create_task(self._read_loop(), name="cortex-reader")
+        print(f"[INFO] cortex websocket opened: {self.url}")
+        return self
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self._reader is not None:
+            await asyncio.gather(self._reader, return_exceptions=True)
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def connected(self) -> bool:
+        return self._reader is not None and not self._reader.done()
+
+    async def _read_loop(self):
+        err: Exception = ConnectionError("cortex websocket closed")
+        try:
+            async for frame in self.ws:
+                msg = json_codec.loads(frame)
+                if 'sid' in msg:
+                    self._dispatch_stream(msg)
+                elif 'id' in msg:
+                    self._resolve(msg)
+                elif 'warning' in msg:
+                    self._handle_warning(msg['warning'])
+                elif self.debug:
+                    print(msg)
+        except Exception as e:
+            err = e
+            print(f"[ERR] cortex reader: {e}")
+        finally:
+            for method, fut in self._pending.values():
+                if not fut.done():
+                    fut.set_exception(err)
+            self._pending.clear()
+            for chans in self._streams.values():
+                for ch in chans:
+                    ch.close()
+            for ch in self._warnings:
+                ch.close()
+
+    def _resolve(self, msg: Dict):
+        entry = self._pending.pop(msg['id'], None)
+        if entry is None:
+            return
+        method, fut = entry
+        if fut.done():      # タイムアウト済み
+            return
+        if 'error' in msg:
+            e = msg['error']
+            fut.set_exception(CortexError(method, e.get('code'), e.get('message', ''), e.get('data')))
+        else:
+            fut.set_result(msg.get('result'))
+
+    def _dispatch_stream(self, msg: Dict):
+        for key in msg:
+            entry = STREAM_DECODERS.get(key)
+            if entry is not None:
+                break
+        else:
+            return
+        chans = self._streams.get((msg['sid'], key))
+        if not chans:
+            return
+        data = entry[1](msg)
+        for ch in chans:
+            ch.put((key, data) if ch.tagged else data)
+
+    def _handle_warning(self, warning: Dict):
+        if self.debug:
+            print(warning)
+        code = warning.get('code')
+        if code == ACCESS_RIGHT_GRANTED:
+            self._access_granted.set()
+        elif code in (CORTEX_STOP_ALL_STREAMS, CORTEX_CLOSE_SESSION):
+            sid = (warning.get('message') or {}).get('sessionId')
+            print(f"[WARN] cortex stopped session {sid} (code={code})")
+        for ch in self._warnings:
+            ch.put(warning)
+
+    # ---- リクエスト ----
+    async def call(self, method: str, params: Optional[Dict] = None, timeout: float = REQUEST_TIMEOUT_SEC):
+        """JSON-RPC を1つ送り、result を返す（error 応答は CortexError）"""
+        if self.ws is None:
+            raise RuntimeError("AsyncCortex.open() has not been called")
+        req_id = next(self._ids)
+        fut = asyncio.get_running_loop().create_future()
+        self._pending[req_id] = (method, fut)
+        request = {"jsonrpc": "2.0", "id": req_id, "method": method, "params": params or {}}
+        payload = json_codec.dumps(request)    # str はテキストフレームで送られる
+        if self.debug:
+            print(f"{method} request \n", payload)
+        try:
+            await self.ws.send(payload)
+            return await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            raise CortexError(method, None, f"no response in {timeout:.0f}s") from None
+        finally:
+            self._pending.pop(req_id, None)
+
+    async def authorize(self, wait_sec: float = ACCESS_WAIT_SEC) -> str:
+        """アクセス権を確認（無ければ要求して Launcher での承認を待つ）し、cortexToken を得る"""
+        creds = {"clientId": self.client_id, "clientSecret": self.client_secret}
+        res = await self.call("hasAccessRight", creds)
+        if not res.get('accessGranted'):
+            res = await self.call("requestAccess", creds)
+            if not res.get('accessGranted'):
+                warnings.warn(res.get('message', 'waiting for approval in Emotiv Launcher'))
+                try:
+                    await asyncio.wait_for(self._access_granted.wait(), wait_sec)
+                except asyncio.TimeoutError:
+                    raise CortexError("requestAccess", ACCESS_RIGHT_REJECTED, "access was not granted") from None
+        res = await self.call("authorize", dict(creds, license=self.license, debit=self.debit))
+        self.auth = res['cortexToken']
+        print("[INFO] Authorize successfully.")
+        return self.auth
+
+    async def query_headsets(self, headset_id: Optional[str] = None) -> List[Dict]:
+        return await self.call("queryHeadsets", {"id": headset_id} if headset_id else {})
+
+    async def connect_headset(self, headset_id: str = '', timeout: float = HEADSET_CONNECT_SEC) -> str:
+        """headset_id（空なら最初に見つかったもの）が connected になるまで待ち、その id を返す"""
+        await self.call("controlDevice", {"command": "refresh"})
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        requested = False
+        while True:
+            headsets = await self.query_headsets()
+            for hs in headsets:
+                print('headsetId: {0}, status: {1}, connected_by: {2}'.format(hs['id'], hs['status'], hs.get('connectedBy')))
+            if headsets and not headset_id:
+                headset_id = headsets[0]['id']
+            status = next((hs['status'] for hs in headsets if hs['id'] == headset_id), None)
+            if status == 'connected':
+                return headset_id
+            if status == 'discovered' and not requested:
+                await self.call("controlDevice", {"command": "connect", "headset": headset_id})
+                requested = True
+            elif status not in ('discovered', 'connecting'):
+                warnings.warn(f"headset {headset_id or '(any)'} not available (status={status})")
+            if loop.time() >= deadline:
+                raise CortexError("controlDevice", None, f"headset {headset_id} did not connect")
+            await asyncio.sleep(HEADSET_POLL_SEC)
+
+    async def disconnect_headset(self, headset_id: str):
+        return await self.call("controlDevice", {"command": "disconnect", "headset": headset_id})
+
+    async def create_session(self, headset_id: str) -> str:
+        res = await self.call("createSession", {"cortexToken": self.auth, "headset": headset_id, "status": "active"})
+        print("[INFO] The session " + res['id'] + " is created successfully.")
+        return res['id']
+
+    async def close_session(self, session_id: str):
+        res = await self.call("updateSession", {"cortexToken": self.auth, "session": session_id, "status": "close"})
+        for key in [k for k in self._streams if k[0] == session_id]:
+            for ch in self._streams.pop(key):
+                ch.close()
+        return res
+
+    async def subscribe(self, session_id: str, streams: List[str]) -> Dict[str, List[str]]:
+        """購読して {ストリーム名: 列名} を返す（列名は cortex.Cortex の new_data_labels と同じ）"""
+        res = await self.call("subscribe", {"cortexToken": self.auth, "session": session_id, "streams": streams})
+        labels = {}
+        for s in res.get('success', []):
+            print('The data stream ' + s['streamName'] + ' is subscribed successfully.')
+            labels[s['streamName']] = data_labels_of(s['streamName'], s['cols'])
+        for s in res.get('failure', []):
+            print('The data stream ' + s['streamName'] + ' is subscribed unsuccessfully. Because: ' + s['message'])
+        return labels
+
+    async def unsubscribe(self, session_id: str, streams: List[str]):
+        return await self.call("unsubscribe", {"cortexToken": self.auth, "session": session_id, "streams": streams})
+
+    # ---- ストリーム ----
+    def stream(self, session_id: str, name: str, maxsize: int = STREAM_QUEUE_SIZE) -> StreamChannel:
+        """session_id の name ストリームを受け取る非同期イテレータ（接続が切れるかセッションを閉じると終わる）"""
+        ch = StreamChannel(maxsize)
+        self._streams.setdefault((session_id, name), []).append(ch)
+        return ch
+
+    def streams(self, session_id: str, names: List[str], maxsize: int = STREAM_QUEUE_SIZE) -> StreamChannel:
+        """session_id の複数ストリームを受信順のまま (ストリーム名, データ) で流す非同期イテレータ"""
+        ch = StreamChannel(maxsize, tagged=True)
+        for name in names:
+            self._streams.setdefault((session_id, name), []).append(ch)
+        return ch
+
+    def unstream(self, session_id: str, ch: StreamChannel):
+        for key, chans in list(self._streams.items()):
+            if key[0] == session_id and ch in chans:
+                chans.remove(ch)
+                if not chans:
+                    del self._streams[key]
+        ch.close()
+
+    def warning_stream(self, maxsize: int = 64) -> StreamChannel:
+        """Cortex の warning メッセージを受け取る非同期イテレータ"""
+        ch = StreamChannel(maxsize)
+        self._warnings.append(ch)
+        return ch
+
+
+if __name__ == "__main__":
+    import argparse, os
+    from dotenv import load_dotenv
+    load_dotenv()
+    ap = argparse.ArgumentParser(description="asyncio Cortex クライアントの動作確認（ストリームを表示する）")
+    ap.add_argument("--headset", default="", help="ヘッドセット ID（省略時は最初のもの）")
+    ap.add_argument("--streams", nargs="*", default=["pow", "dev"], help="購読するストリーム")
+    args = ap.parse_args()
+
+    async def _print_stream(name, ch):
+        async for d in ch:
+            print(name, d)
+
+    async def main():
+        async with AsyncCortex(os.getenv("CLIENT_ID", ""), os.getenv("CLIENT_SECRET", "")) as c:
+            await c.authorize()
+            headset = await c.connect_headset(args.headset)
+            sid = await c.create_session(headset)
+            chans = {name: c.stream(sid, name) for name in args.streams}
+            print("[INFO] labels:", await c.subscribe(sid, args.streams))
+            await asyncio.gather(*(_print_stream(n, ch) for n, ch in chans.items()))
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,133 @@
+# downsample.py
+"""
+チャート表示用の間引き。どちらも元の行の添字を返すので、呼び出し側は行をそのまま選べる。
+
+- lttb_indices: Largest-Triangle-Three-Buckets。連続値（θ/α, 体動など）の形を保ったまま n_out 点にする
+- step_indices: ステージ列（階段グラフ）用。切り替わり点だけを残し、それでも多ければ短い区間を
+  前の区間に吸収する
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# /api/series・/api/history の行で間引きの対象にする連続値の列
+SERIES_FEATURES = ("theta_alpha", "beta_rel", "motion_rms", "eog_sacc", "fac_rate")
+
+
+def lttb_indices(x, y, n_out: int) -> np.ndarray:
+    x = np.asarray(x, dtype=np.float64)
+    y = np.nan_to_num(np.asarray(y, dtype=np.float64))
+    n = len(x)
+    if n_out >= n:
+        return np.arange(n)
+    if n_out < 3:
+        return np.array([0, n - 1][:max(n_out, 0)], dtype=np.int64)
+
+    # 先頭と末尾を除いた n-2 点を n_out-2 個のバケットに分ける
+    edges = np.append(np.floor(np.linspace(1, n - 1, n_out - 1)).astype(np.int64), n)
+    out = np.empty(n_out, dtype=np.int64)
+    out[0], out[-1] = 0, n - 1
+    a = 0
+    for b in range(n_out - 2):
+        lo, hi = edges[b], edges[b + 1]
+        # 次のバケットの平均点（最後のバケットの次は末尾の点）
+        nlo, nhi = edges[b + 1], edges[b + 2]
+        ax, ay = x[nlo:nhi].mean(), y[nlo:nhi].mean()
+        area = np.abs((x[a] - ax) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (ay - y[a]))
+        a = lo + int(np.argmax(area))
+        out[b + 1] = a
+    return out
+
+
+def step_indices(keys: Sequence, n_out: int) -> np.ndarray:
+    """
+    階段グラフ用。値が変わる行（と末尾）だけを残す。区間数が n_out-1 を超えるときは
+    長い区間から n_out-1 個を残し、捨てた短い区間は直前の区間が続いていたものとして扱う。
+    """
+    n = len(keys)
+    if n == 0 or n_out <= 0:
+        return np.empty(0, dtype=np.int64)
+    starts = [0] + [i for i in range(1, n) if keys[i] != keys[i - 1]]
+    if len(starts) + 1 > n_out:
+        lengths = np.diff(np.append(starts, n))
+        # 先頭の区間は必ず残し、残りは長い順（同じ長さなら先のもの）
+        order = np.lexsort((np.arange(len(starts)), -lengths))
+        keep = set(order[:max(n_out - 1, 1)].tolist()) | {0}
+        merged = []
+        for j in sorted(keep):
+            s = starts[j]
+            if not merged or keys[s] != keys[merged[-1]]:
+                merged.append(s)
+        starts = merged
+    if starts[-1] != n - 1:
+        starts.append(n - 1)
+    return np.asarray(starts, dtype=np.int64)
+
+
+def _thin(sel: np.ndarray, max_points: int) -> np.ndarray:
+    """昇順の添字を先頭と末尾を残したまま等間隔に max_points 個まで減らす"""
+    if len(sel) <= max_points:
+        return sel
+    if max_points < 2:
+        return sel[:max(max_points, 0)]
+    return sel[np.round(np.linspace(0, len(sel) - 1, max_points)).astype(np.int64)]
+
+
+def select_indices(t, features: Dict[str, Sequence], stages: Optional[Sequence], max_points: int) -> np.ndarray:
+    """
+    1系列（1ユーザー・時刻昇順）の行から残す添字を選ぶ。max_points をステージ列と各連続値で
+    等分して選んだものの和集合を返す。系列ごとの最低点数のぶん和集合が溢れたときは
+    先頭と末尾を残して等間隔に削り、合計は max_points を超えない。
+    """
+    n = len(t)
+    if n <= max_points:
+        return np.arange(n)
+    if max_points < 3:
+        return _thin(np.arange(n), max_points)
+    n_sel = len(features) + (1 if stages is not None else 0)
+    share = max(3, max_points // max(n_sel, 1))
+    best = None
+    # 選択が重なって点数が余ったら、配分を増やして2回まで選び直す
+    for _ in range(3):
+        picked = [np.array([0, n - 1])]
+        if stages is not None:
+            picked.append(step_indices(stages, share))
+        for y in features.values():
+            picked.append(lttb_indices(t, y, share))
+        sel = np.unique(np.concatenate(picked))
+        if best is not None and len(sel) > max_points:
+            break
+        best = sel
+        if len(sel) >= 0.8 * max_points:
+            break
+        share = int(share * max_points / max(len(sel), 1))
+    return _thin(best, max_points)
+
+
+def downsample_rows(rows: List[Dict], max_points: int, features: Sequence[str] = SERIES_FEATURES) -> List[Dict]:
+    """
+    /api/series 形式の行（time 昇順の dict）を max_points 行以内に間引く。
+    統合ビューのように user 列があるときはユーザーごとに行数に比例した点数を割り当てる
+    （端数は最大剰余で配り、合計がちょうど max_points になるようにする）。
+    """
+    if max_points <= 0 or len(rows) <= max_points:
+        return rows
+    groups: Dict[Optional[str], List[int]] = {}
+    for i, r in enumerate(rows):
+        groups.setdefault(r.get("user"), []).append(i)
+
+    sizes = [len(idx) for idx in groups.values()]
+    budgets = [max_points * m // len(rows) for m in sizes]
+    rest = sorted(range(len(sizes)), key=lambda j: -(max_points * sizes[j] % len(rows)))
+    for j in rest[:max_points - sum(budgets)]:
+        budgets[j] += 1
+
+    keep = []
+    for idx, budget in zip(groups.values(), budgets):
+        g = [rows[i] for i in idx]
+        t = np.array([r["time"] for r in g], dtype=np.float64)
+        feats = {k: np.array([r.get(k) or 0.0 for r in g], dtype=np.float64) for k in features}
+        sel = select_indices(t, feats, [r.get("stage") for r in g], budget)
+        keep.extend(idx[i] for i in sel.tolist())
+    keep.sort()
+    return [rows[i] for i in keep]
@@ -0,0 +1,203 @@
+# eog_dsp.py
+import math
+from collections import deque
+from fractions import Fraction
+from typing import Dict, Tuple
+
+import numpy as np
+
+MAD_TO_SD = 1.4826  # 正規分布で MAD を標準偏差に換算する係数
+
+
+class PolyphaseDecimator:
+    """
+    有理数比 L/M のストリーミング polyphase FIR リサンプラ（例: 256→50 Hz は L=25, M=128）。
+    Kaiser 窓付き sinc の低域通過（遮断 cutoff·min(fs_in, fs_out)）でエイリアシングを除いてから
+    間引くので、単純な N サンプルおきの間引きのように高域が折り返さない。
+    直近の入力履歴と位相を呼び出し間で保持するので、process() にはブロックを、
+    push() には1サンプルずつを渡せる（push は出力1個分たまるまで Python のリストに貯める）。
+    出力時刻は入力時刻を L/M の位相で補間し、FIR の群遅延を差し引いたもの。
+    """
+    def __init__(self, fs_in: float, fs_out: float, zero_crossings: int = 10,
+                 cutoff: float = 0.45, beta: float = 8.0):
+        ratio = Fraction(fs_out / fs_in).limit_denominator(1000)
+        self.fs_in, self.fs_out = float(fs_in), float(fs_out)
+        self.L, self.M = ratio.numerator, ratio.denominator
+        L, M = self.L, self.M
+
+        # プロトタイプ低域フィルタ（アップサンプル後のレート L*fs_in で設計、利得 L）
+        K = int(math.ceil(2 * zero_crossings * max(L, M) / L))  # 1位相あたりのタップ数
+        N = K * L
+        fc = cutoff * min(1.0, L / M) / L                      # fs_p で正規化した遮断周波数
+        n = np.arange(N) - (N - 1) / 2.0
+        h = 2 * fc * np.sinc(2 * fc * n) * np.kaiser(N, beta)
+        h *= L / h.sum()
+        # 位相 p の係数 h[p::L] を時刻昇順の窓に掛けられるよう逆順にしておく
+        self._phases = h.reshape(K, L).T[:, ::-1].copy()
+        self.taps = K
+        self.delay_sec = (N - 1) / 2.0 / (L * self.fs_in)
+        self.min_block = int(math.ceil(M / L))
+        self.reset()
+
+    def reset(self):
+        self._hist = None       # 直近 K-1 個の入力
+        self._n_in = 0          # これまでに受け取った入力数
+        self._n_out = 0         # これまでに出した出力数
+        self._pend_t = []
+        self._pend_v = []
+
+    def process(self, ts, xs) -> Tuple[np.ndarray, np.ndarray]:
+        """入力ブロック（時刻昇順）を処理し、新たに確定した (時刻, 値) の配列を返す"""
+        if self._pend_v:
+            # push() で貯めた分を先に流す
+            ts = np.concatenate((self._pend_t, np.asarray(ts, dtype=np.float64)))
+            xs = np.concatenate((self._pend_v, np.asarray(xs, dtype=np.float64)))
+            self._pend_t, self._pend_v = [], []
+        xs = np.asarray(xs, dtype=np.float64)
+        ts = np.asarray(ts, dtype=np.float64)
+        B = len(xs)
+        if B == 0:
+            return np.empty(0), np.empty(0)
+        if self.L == self.M:
+            return ts.copy(), xs.copy()
+        if self._hist is None:
+            # 立ち上がりのステップ応答を避けるため最初の値で履歴を埋める
+            self._hist = np.full(self.taps - 1, xs[0])
+
+        buf = np.concatenate((self._hist, xs))
+        n_in = self._n_in
+        last = n_in + B - 1
+        # 入力位置 (n*M)//L が今回のブロック内に入る出力 n をまとめて計算
+        n_end = ((last + 1) * self.L - 1) // self.M + 1
+        out_n = np.arange(self._n_out, n_end)
+        y = np.empty(0)
+        t = np.empty(0)
+        if len(out_n):
+            j = out_n * self.M
+            i = j // self.L - n_in
+            windows = np.lib.stride_tricks.sliding_window_view(buf, self.taps)[i]
+            y = np.einsum("nk,nk->n", windows, self._phases[j % self.L])
+            t = ts[i] + (j % self.L) / (self.L * self.fs_in) - self.delay_sec
+            self._n_out = int(n_end)
+        self._hist = buf[-(self.taps - 1):].copy() if self.taps > 1 else buf[:0]
+        self._n_in = n_in + B
+        return t, y
+
+    def push(self, t: float, v: float) -> Tuple[np.ndarray, np.ndarray]:
+        """1サンプル入力。出力1個分たまったときだけ process() を呼ぶ"""
+        self._pend_t.append(t)
+        self._pend_v.append(v)
+        if len(self._pend_v) < self.min_block:
+            return np.empty(0), np.empty(0)
+        return self.process((), ())
+
+
+class SaccadeDetector:
+    """
+    ストリーミング EOG サッカード検出。
+    サンプル間差分 |Δx| がロバスト閾値（中央値 + k·1.4826·MAD）を超えた点をイベントとし、
+    refractory_sec 以内の再検出は捨てる。閾値は新しく届いたブロックの中央値/MAD を
+    指数移動平均（時定数 tau_sec）で追従させるので、窓全体の統計を毎回計算し直さない。
+    k=5 は |Δx| がガウス雑音なら約 3.6σ に相当し、サッカードで SD が膨らんだ
+    旧実装（平均 + 2.5SD）と同程度の検出率になる。
+
+    イベントは (t, 振幅, 向き) として window_sec の間だけ保持し、件数・振幅和・向き和を
+    追加/削除のたびに増分更新する。振幅は閾値を超えた差分の大きさ、向きはその符号（+1/-1）。
+    """
+    def __init__(self, fs: float = 50.0, window_sec: float = 30.0,
+                 refractory_sec: float = 0.1, k: float = 5.0, tau_sec: float = 30.0):
+        self.fs = fs
+        self.window_sec = window_sec
+        self.refractory_sec = refractory_sec
+        self.k = k
+        self.tau_sec = tau_sec
+        self.reset()
+
+    def reset(self):
+        self.events = deque()   # (t, amp, direction)
+        self._amp_sum = 0.0
+        self._dir_sum = 0
+        self._last_x = None
+        self._n = 0             # 処理済み差分の通し番号（refractory 管理用）
+        self._next_ok = 0
+        self._seen = 0          # 閾値推定に使った差分の数
+        self._med = 0.0
+        self._mad = 0.0
+
+    def threshold(self) -> float:
+        return self._med + self.k * MAD_TO_SD * self._mad
+
+    def _update_threshold(self, ad):
+        med = float(np.median(ad))
+        mad = float(np.median(np.abs(ad - med)))
+        if self._seen == 0:
+            self._med, self._mad = med, mad
+        else:
+            # ブロック長に応じた重みで追従（立ち上がり直後は観測数に比例して重くする）
+            w = 1.0 - np.exp(-len(ad) / (self.tau_sec * self.fs))
+            w = max(w, len(ad) / (self._seen + len(ad)))
+            self._med += w * (med - self._med)
+            self._mad += w * (mad - self._mad)
+        self._seen += len(ad)
+
+    def update(self, ts, xs):
+        """新しく届いたサンプル列（時刻昇順）を処理してイベントを追加する"""
+        xs = np.asarray(xs, dtype=np.float64)
+        if len(xs) == 0:
+            return
+        ts = np.asarray(ts, dtype=np.float64)
+        if self._last_x is None:
+            d = np.diff(xs)
+            ts = ts[1:]
+        else:
+            d = np.diff(xs, prepend=self._last_x)
+        self._last_x = float(xs[-1])
+        if len(d) == 0:
+            return
+
+        ad = np.abs(d)
+        self._update_threshold(ad)
+        n0 = self._n
+        self._n += len(d)
+        if self._mad * MAD_TO_SD < 1e-9:
+            return
+
+        cand = n0 + np.flatnonzero(ad > self.threshold())
+        if len(cand) == 0:
+            return
+        # 採用したイベントから refractory 分先の最初の候補へ二分探索で飛ぶ
+        # （ループ回数はサンプル数ではなくイベント数）
+        refractory = max(1, int(round(self.refractory_sec * self.fs)))
+        j = int(np.searchsorted(cand, self._next_ok, side="left"))
+        while j < len(cand):
+            i = int(cand[j] - n0)
+            amp = float(ad[i])
+            direction = 1 if d[i] > 0 else -1
+            self.events.append((float(ts[i]), amp, direction))
+            self._amp_sum += amp
+            self._dir_sum += direction
+            self._next_ok = int(cand[j]) + refractory
+            j = int(np.searchsorted(cand, self._next_ok, side="left"))
+
+    def _trim(self, now: float):
+        ev = self.events
+        while ev and now - ev[0][0] > self.window_sec:
+            _, amp, direction = ev.popleft()
+            self._amp_sum -= amp
+            self._dir_sum -= direction
+        if not ev:
+            self._amp_sum, self._dir_sum = 0.0, 0
+
+    def stats(self, now: float, duration_sec: float) -> Dict[str, float]:
+        """
+        now から window_sec 以内のイベント集計。
+        rate は duration_sec（実際に窓にある EOG の長さ）あたりの件数。
+        """
+        self._trim(now)
+        n = len(self.events)
+        return {
+            "count": float(n),
+            "rate": n / duration_sec if duration_sec > 0 else 0.0,
+            "amp": self._amp_sum / n if n else 0.0,
+            "dir": self._dir_sum / n if n else 0.0,   # +1: 全て正方向, -1: 全て負方向
+        }
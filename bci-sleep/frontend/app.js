@@ -119,24 +119,37 @@ function makeFAC(ctx){
   });
 }
 
-async function fetchSeries(){
+const SERIES_LIMIT = 720;
+let seriesCursor = null;   // /api/series が返す cursor（次回はそれ以降の行だけを受け取る）
+let lastRow = null;
+
+function currentUser(){
   // 現在のユーザー名を取得（グローバル変数またはURLから）
-  let currentUser = window.CURRENT_USER;
-  if (!currentUser) {
+  let user = window.CURRENT_USER;
+  if (!user) {
     // URLからユーザー名を抽出
     const pathParts = window.location.pathname.split('/').filter(p => p);
     if (pathParts.length > 0) {
-      currentUser = pathParts[0];
+      user = pathParts[0];
     }
   }
-  
-  // APIリクエストURLを構築
-  let apiUrl = `/api/series?limit=720`;
-  if (currentUser) {
-    apiUrl += `&user=${encodeURIComponent(currentUser)}`;
+  return user;
+}
+
+function seriesQuery(){
+  let q = `limit=${SERIES_LIMIT}`;
+  const user = currentUser();
+  if (user) {
+    q += `&user=${encodeURIComponent(user)}`;
+  }
+  if (seriesCursor) {
+    q += `&since=${encodeURIComponent(seriesCursor)}`;
   }
-  
-  const r = await fetch(apiUrl);
+  return q;
+}
+
+async function fetchSeries(){
+  const r = await fetch(`/api/series?${seriesQuery()}`);
   if(!r.ok) return null;
   return await r.json();
 }
@@ -170,20 +183,61 @@ function updateKPIs(last){
   document.getElementById("kSignal").textContent = fmt(last?.signal,2);
 }
 
-function render(series){
-  const ptsHyp = series.rows.map(r=>({
-    x: r.time,
-    y: r.stage_num ?? null,
-    stage: r.stage, 
-    conf: r.confidence,
-    user: r.user || 'unknown',
-    display_name: r.display_name || 'Unknown'
-  })).filter(p => p.y !== null);
+// ユーザーごとのデータセットを key で探し、無ければ作る
+function datasetFor(chart, key, make){
+  let ds = chart.data.datasets.find(d => d._key === key);
+  if (!ds) {
+    ds = Object.assign({_key: key, data: [], borderWidth: 2, pointRadius: 0}, make());
+    chart.data.datasets.push(ds);
+  }
+  return ds;
+}
+
+function appendRows(rows){
+  rows.forEach(row => {
+    const user = row.user || 'unknown';
+    const color = userColors[user] || userColors.default;
+    if (row.stage_num !== null && row.stage_num !== undefined) {
+      datasetFor(hypnoChart, user, () => ({
+        label: row.display_name || 'Unknown', stepped: true, borderColor: color, backgroundColor: color
+      })).data.push({
+        x: row.time,
+        y: row.stage_num,
+        stage: row.stage,
+        conf: row.confidence,
+        user: user,
+        display_name: row.display_name || 'Unknown'
+      });
+    }
+    datasetFor(brainWavesChart, `${user}/theta_alpha`, () => ({label: `${user} - θ/α`, borderColor: color}))
+      .data.push({x: row.time, y: row.theta_alpha});
+    datasetFor(brainWavesChart, `${user}/beta_rel`, () => ({label: `${user} - β (rel)`, borderColor: color, borderDash: [5, 5]}))
+      .data.push({x: row.time, y: row.beta_rel});
+    datasetFor(motionChart, user, () => ({label: `${user} - Motion RMS`, borderColor: color}))
+      .data.push({x: row.time, y: row.motion_rms});
+    datasetFor(eogChart, user, () => ({label: `${user} - EOG sacc/s`, borderColor: color}))
+      .data.push({x: row.time, y: row.eog_sacc});
+    datasetFor(facChart, user, () => ({label: `${user} - FAC Rate`, borderColor: color}))
+      .data.push({x: row.time, y: row.fac_rate});
+  });
+}
 
-  const last = series.rows[series.rows.length-1];
+function render(series){
+  const charts = [hypnoChart, brainWavesChart, motionChart, eogChart, facChart];
+  // reset のときは全体を描き直し、それ以外は届いた行を既存のデータセットに追加する
+  if (series.reset) {
+    charts.forEach(c => { c.data.datasets = []; });
+    lastRow = null;
+  }
+  appendRows(series.rows);
+  charts.forEach(c => c.data.datasets.forEach(ds => {
+    if (ds.data.length > SERIES_LIMIT) ds.data.splice(0, ds.data.length - SERIES_LIMIT);
+  }));
+  if (series.rows.length) lastRow = series.rows[series.rows.length-1];
+  const last = lastRow;
 
   // データがない場合の処理
-  if (series.rows.length === 0) {
+  if (!last) {
     document.getElementById("noDataMessage").style.display = "block";
     document.getElementById("chartHypno").style.display = "none";
     document.getElementById("chartBrainWaves").style.display = "none";
@@ -204,173 +258,23 @@ function render(series){
     document.getElementById("chartFAC").style.display = "block";
   }
 
-  // ユーザー別のデータセットを作成
-  const userDatasets = {};
-  ptsHyp.forEach(point => {
-    const user = point.user;
-    if (!userDatasets[user]) {
-      userDatasets[user] = [];
-    }
-    userDatasets[user].push(point);
-  });
-
-  // チャートのデータセットを更新
-  const datasets = [];
-  Object.keys(userDatasets).forEach(user => {
-    const color = userColors[user] || userColors.default;
-    datasets.push({
-      label: userDatasets[user][0]?.display_name || user,
-      data: userDatasets[user],
-      stepped: true,
-      borderWidth: 2,
-      pointRadius: 0,
-      borderColor: color,
-      backgroundColor: color
-    });
-  });
-
-  hypnoChart.data.datasets = datasets;
-  hypnoChart.update();
-
-  // 脳波データもユーザー別に分ける
-  const brainWaveDatasets = {
-    theta_alpha: {},
-    beta_rel: {}
-  };
-
-  series.rows.forEach(row => {
-    const user = row.user || 'unknown';
-    if (!brainWaveDatasets.theta_alpha[user]) {
-      brainWaveDatasets.theta_alpha[user] = [];
-      brainWaveDatasets.beta_rel[user] = [];
-    }
-    brainWaveDatasets.theta_alpha[user].push({x: row.time, y: row.theta_alpha});
-    brainWaveDatasets.beta_rel[user].push({x: row.time, y: row.beta_rel});
-  });
-
-  const brainWaveDatasetsArray = [];
-  Object.keys(brainWaveDatasets.theta_alpha).forEach(user => {
-    const color = userColors[user] || userColors.default;
-    brainWaveDatasetsArray.push({
-      label: `${user} - θ/α`,
-      data: brainWaveDatasets.theta_alpha[user],
-      borderWidth: 2,
-      pointRadius: 0,
-      borderColor: color
-    });
-    brainWaveDatasetsArray.push({
-      label: `${user} - β (rel)`,
-      data: brainWaveDatasets.beta_rel[user],
-      borderWidth: 2,
-      pointRadius: 0,
-      borderColor: color,
-      borderDash: [5, 5]
-    });
-  });
-
-  brainWavesChart.data.datasets = brainWaveDatasetsArray;
-  brainWavesChart.update();
-
-  // モーションデータもユーザー別に分ける
-  const motionDatasets = {
-    motion_rms: {},
-    eog_sacc: {}
-  };
-
-  series.rows.forEach(row => {
-    const user = row.user || 'unknown';
-    if (!motionDatasets.motion_rms[user]) {
-      motionDatasets.motion_rms[user] = [];
-      motionDatasets.eog_sacc[user] = [];
-    }
-    motionDatasets.motion_rms[user].push({x: row.time, y: row.motion_rms});
-    motionDatasets.eog_sacc[user].push({x: row.time, y: row.eog_sacc});
-  });
-
-  const motionDatasetsArray = [];
-  Object.keys(motionDatasets.motion_rms).forEach(user => {
-    const color = userColors[user] || userColors.default;
-    motionDatasetsArray.push({
-      label: `${user} - Motion RMS`,
-      data: motionDatasets.motion_rms[user],
-      borderWidth: 2,
-      pointRadius: 0,
-      borderColor: color
-    });
-  });
-
-  motionChart.data.datasets = motionDatasetsArray;
-  motionChart.update();
-
-  // EOGデータもユーザー別に分ける
-  const eogDatasets = {
-    eog_sacc: {}
-  };
-
-  series.rows.forEach(row => {
-    const user = row.user || 'unknown';
-    if (!eogDatasets.eog_sacc[user]) {
-      eogDatasets.eog_sacc[user] = [];
-    }
-    eogDatasets.eog_sacc[user].push({x: row.time, y: row.eog_sacc});
-  });
-
-  const eogDatasetsArray = [];
-  Object.keys(eogDatasets.eog_sacc).forEach(user => {
-    const color = userColors[user] || userColors.default;
-    eogDatasetsArray.push({
-      label: `${user} - EOG sacc/s`,
-      data: eogDatasets.eog_sacc[user],
-      borderWidth: 2,
-      pointRadius: 0,
-      borderColor: color
-    });
-  });
-
-  eogChart.data.datasets = eogDatasetsArray;
-  eogChart.update();
-
-  // FACデータもユーザー別に分ける
-  const facDatasets = {
-    fac_rate: {}
-  };
-
-  series.rows.forEach(row => {
-    const user = row.user || 'unknown';
-    if (!facDatasets.fac_rate[user]) {
-      facDatasets.fac_rate[user] = [];
-    }
-    facDatasets.fac_rate[user].push({x: row.time, y: row.fac_rate});
-  });
-
-  const facDatasetsArray = [];
-  Object.keys(facDatasets.fac_rate).forEach(user => {
-    const color = userColors[user] || userColors.default;
-    facDatasetsArray.push({
-      label: `${user} - FAC Rate`,
-      data: facDatasets.fac_rate[user],
-      borderWidth: 2,
-      pointRadius: 0,
-      borderColor: color
-    });
-  });
-
-  facChart.data.datasets = facDatasetsArray;
-  facChart.update();
+  if (series.reset || series.rows.length) {
+    charts.forEach(c => c.update("none"));
+  }
 
   updateBadges(series, last);
   updateKPIs(last);
 }
 
+function applySeries(s){
+  render(s);
+  seriesCursor = s.cursor || null;
+}
+
 async function tick(){
   try{
-    console.log('Fetching data...');
     const s = await fetchSeries();
-    console.log('Data received:', s ? 'success' : 'no data');
-    if(s) {
-      console.log('Rendering data, rows:', s.rows.length);
-      render(s);
-    }
+    if(s) applySeries(s);
   }catch(e){
     console.error('Error in tick():', e);
   }finally{
@@ -378,6 +282,29 @@ async function tick(){
   }
 }
 
+// /api/stream（Server-Sent Events）で新しい行を受け取る。
+// 切断時はブラウザが Last-Event-ID 付きで再接続し、使えなければポーリングに戻る
+function startStream(){
+  if (!window.EventSource) {
+    tick();
+    return;
+  }
+  const es = new EventSource(`/api/stream?${seriesQuery()}`);
+  es.addEventListener("rows", (e) => {
+    try{
+      applySeries(JSON.parse(e.data));
+    }catch(err){
+      console.error('Error in stream:', err);
+    }
+  });
+  es.onerror = () => {
+    if (es.readyState === EventSource.CLOSED) {
+      console.warn('Stream closed, falling back to polling');
+      tick();
+    }
+  };
+}
+
 window.addEventListener("DOMContentLoaded", ()=>{
   console.log('DOM loaded, initializing charts...');
   hypnoChart = makeHypno(document.getElementById("chartHypno"));
@@ -385,6 +312,6 @@ window.addEventListener("DOMContentLoaded", ()=>{
   motionChart = makeMotion(document.getElementById("chartMotion"));
   eogChart = makeEOG(document.getElementById("chartEOG")); // EOGチャートを追加
   facChart = makeFAC(document.getElementById("chartFAC")); // FACチャートを追加
-  console.log('Charts initialized, starting tick...');
-  tick();
+  console.log('Charts initialized, starting stream...');
+  startStream();
 });
@@ -0,0 +1,52 @@
+# json_codec.py
+"""
+Cortex の websocket で使う JSON コーデック。orjson → ujson → 標準 json の順に、
+インストールされているものを使う。
+
+  from json_codec import loads, dumpb
+  msg = loads(frame)           # str / bytes どちらでも
+  ws.send(dumpb(request))      # UTF-8 の bytes（テキストフレームとしてそのまま送れる）
+
+速いデコーダは NaN / Infinity を受け付けないので、失敗したフレームだけ標準 json で読み直す。
+"""
+import json
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+    _fast_loads = orjson.loads
+    dumpb = orjson.dumps
+elif ujson is not None:
+    BACKEND = "ujson"
+    _fast_loads = ujson.loads
+
+    def dumpb(obj: Any) -> bytes:
+        return ujson.dumps(obj, ensure_ascii=False).encode("utf-8")
+else:
+    BACKEND = "json"
+    _fast_loads = None
+
+    def dumpb(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    if _fast_loads is not None:
+        try:
+            return _fast_loads(data)
+        except ValueError:
+            pass
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> str:
+    return dumpb(obj).decode("utf-8")
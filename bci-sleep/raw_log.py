@@ -0,0 +1,350 @@
+# raw_log.py
+"""
+生ストリーム（pow/mot/dev/fac/EOG）をセッションごとに追記するバイナリログ。
+
+ファイル構成（リトルエンディアン）:
+  ヘッダ   : MAGIC(8) + version(u16)
+  レコード : length(u32, 以降のバイト数) + type(u8) + body
+    REC_META   : JSON（session_start, username など）
+    REC_SCHEMA : stream_id(u8) + JSON {"name": ..., "columns": [...]}
+    REC_DICT   : stream_id(u8) + code(u16) + UTF-8 文字列（fac の eyeAct などの文字列列）
+    REC_BLOCK  : stream_id(u8) + n(u32) + float64 時刻×n + float64 値×(n×列数)（行優先）
+               値は受信した JSON の数値そのまま（リプレイで記録時と同じ派生行を出すため）。
+               version 1 のファイルは値が float32
+
+書き込みはバックグラウンドスレッドで行い、websocket のコールバックは
+キューに積むだけで戻る。サンプルはストリームごとに block_rows 行か block_sec 秒ぶん
+まとめて1ブロックにし、fsync_sec ごとに fsync する。
+キューは max_queue 件までで、溢れたサンプルは捨てて dropped に数える。
+書き込みに失敗したら（ディスクフル等）一度だけログを出して failed にし、以降は何もしない。
+"""
+import json, mmap, os, queue, struct, threading, time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MAGIC = b"DDRAWLOG"
+VERSION = 2
+_VALUE_DTYPES = {1: np.float32, 2: np.float64}    # version -> REC_BLOCK の値の型
+RAW_LOG_EXT = ".ddraw"
+
+REC_META, REC_SCHEMA, REC_DICT, REC_BLOCK = range(4)
+
+_HEADER = struct.Struct("<8sH")
+_REC_HEAD = struct.Struct("<IB")
+_BLOCK_HEAD = struct.Struct("<BI")
+_DICT_HEAD = struct.Struct("<BH")
+
+# new_data_labels が来ないストリームの列
+FAC_COLUMNS = ["eyeAct", "uAct", "uPow", "lAct", "lPow"]
+EOG_COLUMNS = ["eog"]
+
+
+def dev_columns(cq_labels: List[str]) -> List[str]:
+    """dev は signal と batteryPercent の後ろに接触品質（new_data_labels の列）を並べる"""
+    return ["signal", "batteryPercent"] + list(cq_labels)
+
+
+class RawLogWriter:
+    """
+    セッション1つ分の生ストリームログを書き込む。
+    write()/set_schema() はキューに積むだけなので、受信スレッドから呼んでもブロックしない。
+    """
+    def __init__(self, path: str, meta: Optional[Dict] = None, block_rows: int = 256,
+                 block_sec: float = 1.0, fsync_sec: float = 10.0, max_queue: int = 65536):
+        self.path = path
+        self.block_rows = block_rows
+        self.block_sec = block_sec
+        self.fsync_sec = fsync_sec
+        self.n_samples = 0
+        self.n_bytes = 0
+        self.dropped = 0        # キューが溢れて捨てたサンプル数
+        self.failed = False     # 書き込みに失敗して止まった
+
+        self._q = queue.Queue(maxsize=max_queue)
+        self._ids: Dict[str, int] = {}
+        self._next_sid = 0                      # stream_id は u8 なので 256 個まで、使い回さない
+        self._rejected = set()                  # ID を使い切ったあとに列構成が変わったストリーム（以降は捨てる）
+        self._columns: Dict[str, List[str]] = {}
+        self._codes: Dict[str, Dict[str, int]] = {}
+        self._pend: Dict[str, tuple] = {}       # stream -> (times, rows, first_enqueue_ts)
+
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._f = open(path, "wb")
+        self._f.write(_HEADER.pack(MAGIC, VERSION))
+        if meta:
+            self._write_rec(REC_META, json.dumps(meta).encode("utf-8"))
+        self._thread = threading.Thread(target=self._run, name="RawLogWriter", daemon=True)
+        self._thread.start()
+
+    # ------- 受信スレッドから呼ぶ API -------
+    def set_meta(self, **meta):
+        self._put(("meta", meta))
+
+    def set_schema(self, stream: str, columns: List[str]):
+        self._put(("schema", stream, list(columns)))
+
+    def write(self, stream: str, t: float, values):
+        self._put(("data", stream, t, values))
+
+    def _put(self, item):
+        if self.failed:
+            return
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # 書き込みスレッドが生きている間だけ待つ（止まっていれば close を積まない）
+        while self._thread.is_alive():
+            try:
+                self._q.put(("close",), timeout=1.0)
+                break
+            except queue.Full:
+                continue
+        self._thread.join()
+        if self.dropped:
+            print(f"[WARN] raw log {self.path}: dropped {self.dropped} samples (queue full)")
+
+    # ------- 書き込みスレッド -------
+    def _run(self):
+        try:
+            self._loop()
+        except OSError as e:
+            self.failed = True
+            print(f"[ERR] raw log {self.path}: {e}; raw logging stopped")
+        finally:
+            try:
+                self._f.close()
+            except OSError:
+                pass
+
+    def _loop(self):
+        last_fsync = time.monotonic()
+        while True:
+            try:
+                item = self._q.get(timeout=self.block_sec)
+            except queue.Empty:
+                item = None
+            if item is not None:
+                kind = item[0]
+                if kind == "close":
+                    break
+                try:
+                    if kind == "data":
+                        self._add(item[1], item[2], item[3])
+                    elif kind == "schema":
+                        self._schema(item[1], item[2])
+                    elif kind == "meta":
+                        self._write_rec(REC_META, json.dumps(item[1]).encode("utf-8"))
+                except ValueError as e:
+                    print(f"[ERR] raw log: {e}")
+
+            now = time.monotonic()
+            for stream, (ts, rows, since) in list(self._pend.items()):
+                if len(ts) >= self.block_rows or now - since >= self.block_sec:
+                    self._flush_stream(stream)
+            if now - last_fsync >= self.fsync_sec:
+                self._sync()
+                last_fsync = now
+
+        for stream in list(self._pend):
+            self._flush_stream(stream)
+        self._sync()
+
+    def _write_rec(self, rec_type: int, body: bytes):
+        self._f.write(_REC_HEAD.pack(len(body) + 1, rec_type))
+        self._f.write(body)
+        self.n_bytes += _REC_HEAD.size + len(body)
+
+    def _sync(self):
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def _schema(self, stream: str, columns: List[str]):
+        if stream in self._rejected or self._columns.get(stream) == columns:
+            return
+        if stream in self._pend:
+            self._flush_stream(stream)
+        # 列構成が変わったら新しい ID で書く（読み手が同名ストリームをつなぐ）。
+        # 文字列の辞書コードはストリーム名ごとに引き継ぐ
+        if self._next_sid > 255:
+            self._rejected.add(stream)
+            self._columns.pop(stream, None)
+            raise ValueError(f"too many schemas in one raw log; dropping stream {stream}")
+        sid = self._next_sid
+        self._next_sid += 1
+        self._ids[stream] = sid
+        self._columns[stream] = columns
+        self._codes.setdefault(stream, {})
+        body = json.dumps({"name": stream, "columns": columns}).encode("utf-8")
+        self._write_rec(REC_SCHEMA, struct.pack("<B", sid) + body)
+
+    def _add(self, stream: str, t: float, values):
+        if stream in self._rejected:
+            return
+        if stream not in self._columns:
+            self._schema(stream, [f"c{i}" for i in range(len(values))])
+        pend = self._pend.get(stream)
+        if pend is None:
+            pend = self._pend[stream] = ([], [], time.monotonic())
+        pend[0].append(t)
+        pend[1].append(values)
+        self.n_samples += 1
+
+    def _encode(self, stream: str, v):
+        # 文字列は辞書コードに置き換える（初出なら REC_DICT を先に書く）
+        if v is None:
+            return np.nan
+        if isinstance(v, str):
+            codes = self._codes[stream]
+            code = codes.get(v)
+            if code is None:
+                code = codes[v] = len(codes)
+                body = _DICT_HEAD.pack(self._ids[stream], code) + v.encode("utf-8")
+                self._write_rec(REC_DICT, body)
+            return code
+        return v if isinstance(v, (int, float)) else np.nan
+
+    def _flush_stream(self, stream: str):
+        ts, rows, _ = self._pend.pop(stream)
+        ncols = len(self._columns[stream])
+        try:
+            arr = np.asarray(rows, dtype=np.float64)
+            if arr.shape != (len(rows), ncols):
+                raise ValueError
+        except (TypeError, ValueError):
+            arr = np.full((len(rows), ncols), np.nan, dtype=np.float64)
+            for i, row in enumerate(rows):
+                row = [self._encode(stream, v) for v in row[:ncols]]
+                arr[i, :len(row)] = row
+        body = (_BLOCK_HEAD.pack(self._ids[stream], len(ts))
+                + np.asarray(ts, dtype=np.float64).tobytes() + arr.tobytes())
+        self._write_rec(REC_BLOCK, body)
+
+
+class LogScanner:
+    """
+    ログのレコードを前から読む。読み終えた位置（offset）とスキーマ・辞書を state() で
+    JSON にして保存でき、次は LogScanner(state) で伸びた分だけを読める（session_reader の列キャッシュ用）。
+    同名ストリームの列は和集合（最初に出てきた順）で持つ。
+    """
+    def __init__(self, state: Optional[Dict] = None):
+        state = state or {}
+        self.offset = state.get("offset", 0)
+        self.version = state.get("version")
+        self.meta: Dict = dict(state.get("meta", {}))
+        self.schemas: Dict[int, Dict] = {int(k): v for k, v in state.get("schemas", {}).items()}
+        self.columns: Dict[str, List[str]] = {k: list(v) for k, v in state.get("columns", {}).items()}
+        self.dicts: Dict[str, Dict[int, str]] = {k: {int(c): x for c, x in v.items()}
+                                                 for k, v in state.get("dicts", {}).items()}
+
+    def state(self) -> Dict:
+        return {"offset": self.offset, "version": self.version, "meta": self.meta,
+                "schemas": {str(k): v for k, v in self.schemas.items()}, "columns": self.columns,
+                "dicts": {k: {str(c): x for c, x in v.items()} for k, v in self.dicts.items()}}
+
+    @property
+    def value_dtype(self) -> np.dtype:
+        return np.dtype(_VALUE_DTYPES[self.version])
+
+    def scan(self, buf) -> Dict[str, List]:
+        """
+        buf（ファイル全体の bytes か mmap）の offset 以降を読み、ストリーム名ごとの
+        ブロック [(t, v, columns)] を返す。t, v は buf のビュー。書きかけの末尾レコードの手前で止まる。
+        """
+        end = len(buf)
+        if self.offset == 0:
+            if end < _HEADER.size:
+                return {}
+            magic, version = _HEADER.unpack_from(buf, 0)
+            if magic != MAGIC:
+                raise ValueError("not a raw log")
+            if version not in _VALUE_DTYPES:
+                raise ValueError(f"unsupported raw log version {version}")
+            self.version = version
+            self.offset = _HEADER.size
+        vtype = self.value_dtype
+        blocks: Dict[str, List] = {}
+        pos = self.offset
+        while pos + _REC_HEAD.size <= end:
+            length, rec_type = _REC_HEAD.unpack_from(buf, pos)
+            body = pos + _REC_HEAD.size
+            nxt = pos + 4 + length
+            if nxt > end:
+                break   # 書きかけの末尾レコード
+            if rec_type == REC_META:
+                self.meta.update(json.loads(bytes(buf[body:nxt])))
+            elif rec_type == REC_SCHEMA:
+                sid = buf[body]
+                sc = json.loads(bytes(buf[body + 1:nxt]))
+                self.schemas[sid] = sc
+                cols = self.columns.setdefault(sc["name"], [])
+                cols += [c for c in sc["columns"] if c not in cols]
+            elif rec_type == REC_DICT:
+                sid, code = _DICT_HEAD.unpack_from(buf, body)
+                name = self.schemas[sid]["name"]
+                self.dicts.setdefault(name, {})[code] = bytes(buf[body + _DICT_HEAD.size:nxt]).decode("utf-8")
+            elif rec_type == REC_BLOCK:
+                sid, n = _BLOCK_HEAD.unpack_from(buf, body)
+                sc = self.schemas[sid]
+                ncols = len(sc["columns"])
+                p = body + _BLOCK_HEAD.size
+                t = np.frombuffer(buf, dtype=np.float64, count=n, offset=p)
+                v = np.frombuffer(buf, dtype=vtype, count=n * ncols, offset=p + 8 * n)
+                blocks.setdefault(sc["name"], []).append((t, v.reshape(n, ncols), sc["columns"]))
+            pos = nxt
+        self.offset = pos
+        return blocks
+
+
+def merge_blocks(blocks: List, columns: List[str], vtype) -> tuple:
+    """scan() のブロックを columns の並びにそろえてつなぎ、(t, v) のコピーを返す（無い列は NaN）"""
+    vs = []
+    for _, v, cols in blocks:
+        if cols != columns:
+            full = np.full((len(v), len(columns)), np.nan, dtype=vtype)
+            full[:, [columns.index(c) for c in cols]] = v
+            v = full
+        vs.append(v)
+    t = np.concatenate([b[0] for b in blocks]) if blocks else np.empty(0)
+    v = np.concatenate(vs) if vs else np.empty((0, len(columns)), dtype=vtype)
+    return t, v
+
+
+def map_file(path: str):
+    """読み取り専用の mmap（空ファイルは b""）。呼び出し側が close する"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def read_log(path: str):
+    """
+    ログ全体を読み、(meta, streams) を返す。
+    streams[name] = {"columns": [...], "t": float64 配列, "v": 値の配列 (n, 列数), "dict": {code: str}}
+    v は float64（version 1 のファイルは float32）。
+    途中で列構成が変わったストリームは、列を和集合にして（無い列は NaN）ファイル順につなぐ。
+    """
+    buf = map_file(path)
+    try:
+        sc = LogScanner()
+        try:
+            blocks = sc.scan(buf)
+        except ValueError as e:
+            raise ValueError(f"{e}: {path}") from None
+        if sc.version is None:
+            raise ValueError(f"not a raw log: {path}")
+        streams: Dict[str, Dict] = {}
+        for name, columns in sc.columns.items():
+            t, v = merge_blocks(blocks.get(name, []), columns, sc.value_dtype)
+            streams[name] = {"columns": columns, "t": t, "v": v, "dict": sc.dicts.get(name, {})}
+        del blocks
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+    return sc.meta, streams
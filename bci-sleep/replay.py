@@ -0,0 +1,228 @@
+# replay.py
+"""
+記録済みの生ストリームを SleepEngine に壁時計を待たずに流し込み、
+SleepApp._append_csv と同じ派生行 CSV を出力するオフライン再スコアリング。
+
+入力は raw_log のバイナリログ（*.ddraw、SleepApp が記録）か、JSON Lines（1行1フレーム、受信順）:
+  {"session_start": 1724966400.0}                    # 任意: セッション開始時刻
+  {"streamName": "pow", "labels": ["AF3/theta", ...]} # new_data_labels
+  {"pow": [...], "time": 1724966401.2}                # Cortex のストリームフレームそのまま
+  {"mot": [...], "time": ...} / {"dev": [...], "time": ...} / {"fac": [...], "time": ...}
+  {"t": 1724966401.21, "eog": 12.3}                   # 外部 EOG（UDPJsonEOGSource と同じ形）
+
+使い方:
+  python replay.py user_data/mitachi/raw_20250901_010203.ddraw -o rescored.csv
+"""
+import csv, json, os, time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from sleep_engine import SleepEngine, CSV_HEADER, csv_row
+from raw_log import RAW_LOG_EXT
+from session_reader import Stream, open_session
+
+
+def iter_jsonl_events(path: str) -> Iterable[Tuple[str, float, object]]:
+    """JSON Lines の記録を (kind, t, payload) に変換して受信順に返す"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            obj = json.loads(line)
+            if "session_start" in obj:
+                yield "session_start", float(obj["session_start"]), None
+            elif "streamName" in obj:
+                yield "labels", 0.0, (obj["streamName"], obj.get("labels", []))
+            elif "eog" in obj:
+                yield "eog", float(obj.get("t", 0.0)), float(obj["eog"])
+            else:
+                for kind in ("pow", "mot", "dev", "fac"):
+                    if kind in obj:
+                        yield kind, float(obj.get("time", 0.0)), obj[kind]
+                        break
+
+
+class Replayer:
+    """
+    SleepApp と同じ手順（相対時刻化・全ゼロ pow の除外・pow 受信ごとの step）で
+    イベント列をエンジンに流す。連続する mot / EOG はバッチ API でまとめて投入する。
+    """
+    def __init__(self, eog_fs: float = 200.0, session_start: Optional[float] = None):
+        self.eng = SleepEngine()
+        self.eog_fs = eog_fs
+        self.session_start = session_start
+        self.rows: List[Dict] = []
+        self.n_samples = 0
+        self.first_t = None
+        self.last_t = None
+        self._pend_kind = None
+        self._pend_t: List[float] = []
+        self._pend_v: List = []
+
+    def _rel(self, t: float) -> float:
+        if self.session_start is None:
+            self.session_start = t
+        return t - self.session_start
+
+    def _flush(self):
+        if not self._pend_t:
+            return
+        if self._pend_kind == "mot":
+            self.eng.on_mot_batch(self._pend_t, self._pend_v)
+        elif self._pend_kind == "eog":
+            self.eng.on_eog_block(self._pend_t, self._pend_v, src_fs_hint=self.eog_fs)
+        self._pend_t, self._pend_v = [], []
+
+    def feed(self, kind: str, t: float, payload):
+        if kind == "session_start":
+            self.session_start = t
+            return
+        if kind == "labels":
+            name, labels = payload
+            if name == "pow":
+                self.eng.set_pow_labels(labels)
+            return
+
+        self.n_samples += 1
+        if self.first_t is None:
+            self.first_t = t
+        self.last_t = t
+        rel = self._rel(t)
+        if kind in ("mot", "eog"):
+            if kind != self._pend_kind:
+                self._flush()
+                self._pend_kind = kind
+            self._pend_t.append(rel)
+            self._pend_v.append(payload)
+            return
+
+        self._flush()
+        self._pend_kind = None
+        if kind == "pow":
+            if not payload or all((v == 0 or v is None) for v in payload):
+                return
+            self.eng.on_pow(rel, payload)
+            row = self.eng.step(rel)
+            if row:
+                self.rows.append(row)
+        elif kind == "dev":
+            self.eng.on_dev(rel, float(payload[1]))
+        elif kind == "fac":
+            self.eng.on_fac(rel, payload[0], float(payload[2] or 0.0), float(payload[4] or 0.0))
+
+    def feed_streams(self, streams: Dict[str, Stream]):
+        """
+        session_reader のストリームを時刻順に流す。pow/dev/fac は1件ずつ、
+        その間に入る mot/EOG は配列のスライスのままバッチ API で投入する。
+        """
+        if "pow" in streams:
+            self.eng.set_pow_labels(streams["pow"].columns)
+        empty = Stream("", [], np.empty(0), np.empty((0, 1)))
+        mot, eog = streams.get("mot", empty), streams.get("eog", empty)
+
+        kinds = [k for k in ("pow", "dev", "fac") if k in streams]
+        times = [streams[k].t for k in kinds]
+        all_t = np.concatenate([mot.t, eog.t] + times)
+        if not len(all_t):
+            return
+        if self.session_start is None:
+            self.session_start = float(all_t.min())
+        self.first_t = float(all_t.min())
+        self.last_t = float(all_t.max())
+        self.n_samples += len(all_t)
+        t0 = self.session_start
+
+        ev_t = np.concatenate(times) if times else np.empty(0)
+        ev_k = np.concatenate([np.full(len(t), i) for i, t in enumerate(times)]) if times else np.empty(0, int)
+        ev_i = np.concatenate([np.arange(len(t)) for t in times]) if times else np.empty(0, int)
+        order = np.argsort(ev_t, kind="stable")
+
+        im = ie = 0
+        for t, k, i in zip(ev_t[order].tolist(), ev_k[order].tolist(), ev_i[order].tolist()):
+            j = int(np.searchsorted(mot.t, t, side="right"))
+            if j > im:
+                self.eng.on_mot_batch(mot.t[im:j] - t0, mot.v[im:j])
+                im = j
+            j = int(np.searchsorted(eog.t, t, side="right"))
+            if j > ie:
+                self.eng.on_eog_block(eog.t[ie:j] - t0, eog.v[ie:j, 0], src_fs_hint=self.eog_fs)
+                ie = j
+
+            rel = t - t0
+            kind = kinds[k]
+            row = streams[kind].v[i]
+            if kind == "pow":
+                if np.all((row == 0) | np.isnan(row)):
+                    continue
+                self.eng.on_pow(rel, row.astype(np.float64))
+                r = self.eng.step(rel)
+                if r:
+                    self.rows.append(r)
+            elif kind == "dev":
+                self.eng.on_dev(rel, float(row[0]))
+            elif kind == "fac":
+                codes = streams["fac"].dict
+                eye = None if np.isnan(row[0]) else codes.get(int(row[0]))
+                self.eng.on_fac(rel, eye, float(np.nan_to_num(row[2])), float(np.nan_to_num(row[4])))
+
+        if im < len(mot.t):
+            self.eng.on_mot_batch(mot.t[im:] - t0, mot.v[im:])
+        if ie < len(eog.t):
+            self.eng.on_eog_block(eog.t[ie:] - t0, eog.v[ie:, 0], src_fs_hint=self.eog_fs)
+
+    def finish(self) -> List[Dict]:
+        self._flush()
+        return self.rows
+
+
+def replay_events(events: Iterable[Tuple[str, float, object]], eog_fs: float = 200.0) -> Replayer:
+    rp = Replayer(eog_fs=eog_fs)
+    for kind, t, payload in events:
+        rp.feed(kind, t, payload)
+    rp.finish()
+    return rp
+
+
+def replay_file(path: str, eog_fs: float = 200.0, cache: bool = True) -> Replayer:
+    if path.endswith(RAW_LOG_EXT):
+        s = open_session(path, cache=cache)
+        rp = Replayer(eog_fs=eog_fs, session_start=s.meta.get("session_start"))
+        rp.feed_streams(s.streams)
+        rp.finish()
+        return rp
+    return replay_events(iter_jsonl_events(path), eog_fs=eog_fs)
+
+
+def write_rows_csv(rows: List[Dict], path: str):
+    """SleepApp._append_csv と同じ列・同じ丸めで書き出す"""
+    d = os.path.dirname(path)
+    if d:
+        os.makedirs(d, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(CSV_HEADER)
+        for r in rows:
+            w.writerow(csv_row(r))
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="記録済み生ストリームを SleepEngine で再スコアリング")
+    ap.add_argument("raw", help="記録ファイル（*.ddraw または JSON Lines）")
+    ap.add_argument("-o", "--out", help="出力 CSV（省略時は <raw>.rescored.csv）")
+    ap.add_argument("--eog-fs", type=float, default=200.0, help="EOG の元サンプリング周波数")
+    ap.add_argument("--no-cache", action="store_true", help="*.ddraw の列ファイル（<raw>.cols/）を作らない")
+    args = ap.parse_args()
+
+    out = args.out or os.path.splitext(args.raw)[0] + ".rescored.csv"
+    t0 = time.perf_counter()
+    rp = replay_file(args.raw, eog_fs=args.eog_fs, cache=not args.no_cache)
+    elapsed = time.perf_counter() - t0
+    write_rows_csv(rp.rows, out)
+
+    span = (rp.last_t - rp.first_t) if rp.first_t is not None else 0.0
+    print(f"[INFO] {rp.n_samples} samples -> {len(rp.rows)} rows in {elapsed:.2f}s "
+          f"({rp.n_samples / max(elapsed, 1e-9):.0f} samples/s, x{span / max(elapsed, 1e-9):.0f} real time)")
+    print(f"[INFO] wrote {out}")
@@ -0,0 +1,154 @@
+# rescore.py
+"""
+user_data/<username>/ 以下の記録済みセッションをまとめて再スコアリングするバッチ CLI。
+1セッション = 1プロセス（SleepEngine も1つ）で ProcessPoolExecutor に分散し、
+結果 CSV と実行全体のサマリを出力する。
+
+  python rescore.py --out rescore_runs/try1 [--users mitachi gotou] [--workers 8]
+
+- 出力: <out>/<username>/sleep_candidates_<timestamp>.csv（SleepApp と同じ列）
+- サマリ: <out>/summary.csv（ユーザー名・タイムスタンプ順で、完了順に依存しない）
+- 再開: 各セッションの完了時に <csv>.done.json を書くので、同じ --out で再実行すると
+  終わっているセッションは飛ばす（--force で全てやり直し）
+"""
+import csv, glob, json, os, re, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+
+from sleep_engine import STAGES
+from replay import replay_file, write_rows_csv
+from raw_log import RAW_LOG_EXT
+
+USER_DATA_DIR = "user_data"
+RAW_GLOBS = ("raw_*" + RAW_LOG_EXT, "raw_*.jsonl")
+BASE_CSV_NAME = "sleep_candidates"
+
+SUMMARY_FIELDS = (["username", "session", "raw", "samples", "rows", "elapsed_sec", "samples_per_sec"]
+                  + [f"n_{s}" for s in STAGES] + ["n_poor_quality"])
+
+_STAMP_RE = re.compile(r"(\d{8}_\d{6})")
+
+
+def _session_stamp(path: str) -> str:
+    m = _STAMP_RE.search(os.path.basename(path))
+    return m.group(1) if m else os.path.splitext(os.path.basename(path))[0]
+
+
+def find_sessions(root: str = USER_DATA_DIR, users: Optional[List[str]] = None) -> List[Tuple[str, str, str]]:
+    """(username, timestamp, raw_path) をユーザー名・タイムスタンプ順で返す"""
+    sessions = []
+    if users:
+        names = users
+    elif os.path.isdir(root):
+        names = sorted(d for d in os.listdir(root) if os.path.isdir(os.path.join(root, d)))
+    else:
+        names = []
+    for username in names:
+        for pattern in RAW_GLOBS:
+            for raw in glob.glob(os.path.join(root, username, pattern)):
+                sessions.append((username, _session_stamp(raw), raw))
+    sessions.sort()
+    return sessions
+
+
+def _rescore_one(job: Tuple[str, str, str, str, float]) -> Dict:
+    """ワーカープロセスで1セッションを再スコアリングして結果 CSV と done.json を書く"""
+    username, stamp, raw, out_csv, eog_fs = job
+    t0 = time.perf_counter()
+    rp = replay_file(raw, eog_fs=eog_fs)
+    elapsed = time.perf_counter() - t0
+
+    # 途中で止まっても壊れたファイルが残らないよう一時ファイル経由で置き換える
+    tmp = out_csv + ".tmp"
+    write_rows_csv(rp.rows, tmp)
+    os.replace(tmp, out_csv)
+
+    stats = {
+        "username": username, "session": stamp, "raw": raw,
+        "samples": rp.n_samples, "rows": len(rp.rows),
+        "elapsed_sec": round(elapsed, 3),
+        "samples_per_sec": round(rp.n_samples / max(elapsed, 1e-9), 1),
+    }
+    for s in STAGES:
+        stats[f"n_{s}"] = sum(1 for r in rp.rows if r["stage"] == s)
+    stats["n_poor_quality"] = sum(1 for r in rp.rows if r["stage"] is None)
+
+    done = out_csv + ".done.json"
+    with open(done + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(stats, f, ensure_ascii=False)
+    os.replace(done + ".tmp", done)
+    return stats
+
+
+def _load_done(out_csv: str) -> Optional[Dict]:
+    done = out_csv + ".done.json"
+    if not (os.path.exists(done) and os.path.exists(out_csv)):
+        return None
+    try:
+        with open(done, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def run(out_dir: str, root: str = USER_DATA_DIR, users: Optional[List[str]] = None,
+        workers: Optional[int] = None, eog_fs: float = 200.0, force: bool = False) -> List[Dict]:
+    sessions = find_sessions(root, users)
+    results: Dict[Tuple[str, str], Dict] = {}
+    jobs = []
+    for username, stamp, raw in sessions:
+        out_csv = os.path.join(out_dir, username, f"{BASE_CSV_NAME}_{stamp}.csv")
+        prev = None if force else _load_done(out_csv)
+        if prev is not None:
+            results[(username, stamp)] = prev
+        else:
+            os.makedirs(os.path.dirname(out_csv), exist_ok=True)
+            jobs.append((username, stamp, raw, out_csv, eog_fs))
+
+    total = len(sessions)
+    print(f"[INFO] {total} sessions ({total - len(jobs)} already done, {len(jobs)} to run)")
+    t0 = time.perf_counter()
+    n_samples = 0
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            futures = {ex.submit(_rescore_one, job): job for job in jobs}
+            for i, fut in enumerate(as_completed(futures), 1):
+                username, stamp = futures[fut][:2]
+                try:
+                    st = fut.result()
+                except Exception as e:
+                    print(f"[ERR] {username}/{stamp}: {e}")
+                    continue
+                results[(username, stamp)] = st
+                n_samples += st["samples"]
+                el = time.perf_counter() - t0
+                print(f"[{i}/{len(jobs)}] {username}/{stamp} rows={st['rows']} "
+                      f"({st['samples_per_sec']:.0f} samples/s) | "
+                      f"{i / el:.2f} sessions/s, {n_samples / el:.0f} samples/s overall")
+
+    ordered = [results[k] for k in sorted(results)]
+    os.makedirs(out_dir, exist_ok=True)
+    summary = os.path.join(out_dir, "summary.csv")
+    with open(summary + ".tmp", "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=SUMMARY_FIELDS, extrasaction="ignore")
+        w.writeheader()
+        for st in ordered:
+            w.writerow(st)
+    os.replace(summary + ".tmp", summary)
+    print(f"[INFO] {len(ordered)}/{total} sessions in summary: {summary} "
+          f"({time.perf_counter() - t0:.1f}s)")
+    return ordered
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="記録済みセッションの並列再スコアリング")
+    ap.add_argument("--out", required=True, help="出力ディレクトリ（同じ場所で再実行すると続きから）")
+    ap.add_argument("--root", default=USER_DATA_DIR, help="ユーザーデータのルート")
+    ap.add_argument("--users", nargs="*", help="対象ユーザー（省略時は全員）")
+    ap.add_argument("--workers", type=int, default=None, help="プロセス数（省略時は CPU 数）")
+    ap.add_argument("--eog-fs", type=float, default=200.0, help="EOG の元サンプリング周波数")
+    ap.add_argument("--force", action="store_true", help="完了済みのセッションもやり直す")
+    args = ap.parse_args()
+    run(args.out, root=args.root, users=args.users, workers=args.workers,
+        eog_fs=args.eog_fs, force=args.force)
@@ -1,18 +1,31 @@
 # server_frontend.py
-import os, csv, time, glob
+import os, csv, time, glob, gzip, hashlib, heapq, itertools, json, queue, threading
 from pathlib import Path
-from flask import Flask, jsonify, send_from_directory, request, render_template_string
+import numpy as np
+from flask import Flask, Response, jsonify, send_from_directory, request, render_template_string, stream_with_context
+import user_management
+from downsample import SERIES_FEATURES, downsample_rows, select_indices
+from session_reader import open_session, ROWS_STREAM
+from session_summary import load_summary, summarize_rows
+import session_index
+from session_index import session_start_time
+
+try:
+    import brotli   # 任意: 入っていれば Accept-Encoding: br に対応
+except ImportError:
+    brotli = None
 
 app = Flask(__name__, static_folder="frontend", static_url_path="")
 
+COMPRESS_MIN_BYTES = 1024   # これより小さい JSON は圧縮しない
+
 # ユーザーデータディレクトリを作成
-USER_DATA_DIR = "user_data"
-USER_CSV_FILE = os.path.join(USER_DATA_DIR, "users.csv")
+USER_DATA_DIR = user_management.USER_DATA_DIR
 os.makedirs(USER_DATA_DIR, exist_ok=True)
 
 def resolve_csv_path(username=None):
     if username:
-        # ユーザー管理CSVから最新のセッションファイルを取得
+        # ユーザー登録簿から最新のセッションファイルを取得
         latest_session_file = get_latest_session_file(username)
         if latest_session_file:
             return latest_session_file
@@ -23,23 +36,22 @@ def resolve_csv_path(username=None):
         # 全体ダッシュボードでは全ユーザーの最新データを統合
         return "combined"  # 特別な値で統合データを示す
 
-def get_latest_session_file(username):
-    """ユーザー管理CSVから最新のセッションファイルを取得"""
-    if not os.path.exists(USER_CSV_FILE):
+def _user_file(username, filename):
+    """user_data/<username>/<filename> の実パス。USER_DATA_DIR の外を指すなら None"""
+    root = os.path.realpath(USER_DATA_DIR)
+    path = os.path.realpath(os.path.join(root, username, os.path.basename(filename)))
+    if os.path.commonpath([root, path]) != root:
         return None
-    
-    with open(USER_CSV_FILE, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            if row['username'] == username:
-                last_session = row.get('last_session', '')
-                if last_session:
-                    # ユーザー別ディレクトリ内のセッションファイルを返す
-                    session_file = os.path.join(USER_DATA_DIR, username, last_session)
-                    if os.path.exists(session_file):
-                        return session_file
-                break
-    
+    return path
+
+def get_latest_session_file(username):
+    """ユーザー登録簿から最新のセッションファイルを取得"""
+    last_session = user_management.get_latest_session(username)
+    if last_session:
+        # ユーザー別ディレクトリ内のセッションファイルを返す
+        session_file = os.path.join(USER_DATA_DIR, username, last_session)
+        if os.path.exists(session_file):
+            return session_file
     return None
 
 STAGE_TO_NUM = {
@@ -53,138 +65,264 @@ STAGE_TO_NUM = {
 
 def read_combined_data(limit=720):
     """全ユーザーのデータを統合して読み込み"""
-    all_rows = []
+    return read_combined_series(limit)[0]
+
+def _iter_rows_desc(ent, i0, n):
+    """ent.rows[i0:n] を新しい順に (絶対時刻ミリ秒, 行) で返す"""
+    rows = ent.rows
+    start = ent.session_start_time
+    for i in range(n - 1, i0 - 1, -1):
+        r = rows[i]
+        yield ((start + r["time"]) if start else r["time"]) * 1000, r
+
+def read_combined_series(limit=720, since=None):
+    """
+    全ユーザーの統合データを (rows, cursor, reset) で返す。
+    cursor は "user:ユーザー別cursor" のカンマ区切り。どれか1人でも前回の cursor が
+    使えなければ（セッションが切り替わった等）全体を reset として返し直す。
+    各ユーザーのキャッシュ済み行を末尾から新しい順にヒープでマージし、limit 行で打ち切る。
+    """
+    prev = {}
+    if since:
+        for part in since.split(","):
+            user, _, cur = part.partition(":")
+            prev[user] = cur
     registered_users = get_registered_users()
+    reset = not since
     
-    for user in registered_users:
-        if user['has_data']:
-            user_rows = read_rows(limit, user['username'])
-            # ユーザー情報を各行に追加
-            for row in user_rows:
-                row['user'] = user['username']
-                row['display_name'] = user['display_name']
-            all_rows.extend(user_rows)
+    while True:
+        sources, cursors = [], []
+        for user in registered_users:
+            if not user['has_data']:
+                continue
+            username = user['username']
+            rng = _series_range(limit, resolve_csv_path(username), prev.get(username))
+            if rng is None:
+                continue
+            ent, i0, n, cur, user_reset = rng
+            # 前回いなかったユーザーの行はそのまま追加分として返せる
+            if user_reset and username in prev:
+                reset = True
+                break
+            sources.append((user, _iter_rows_desc(ent, i0, n)))
+            cursors.append(f"{username}:{cur}")
+        else:
+            break
+        # 全員分を最初から取り直す
+        prev = {}
     
-    # 時間順にソート
-    all_rows.sort(key=lambda x: x['time'])
-    return all_rows[-limit:] if len(all_rows) > limit else all_rows
+    # ユーザー情報を各行に追加
+    def tagged(user, it):
+        for t, r in it:
+            yield t, user, r
+    merged = heapq.merge(*(tagged(u, it) for u, it in sources), key=lambda x: x[0], reverse=True)
+    all_rows = [dict(r, time=t, user=u['username'], display_name=u['display_name'])
+                for t, u, r in itertools.islice(merged, max(limit, 0))]
+    # 時間順に並べ直す
+    all_rows.reverse()
+    return all_rows, ",".join(cursors), reset
 
-def read_rows(limit=720, username=None):
+# セッション CSV ごとのパース済み行キャッシュ。path -> _RowsCacheEntry
+# 行は追記されるだけなので、前回読んだバイト位置から先の完全な行だけをパースする
+_ROWS_CACHE = {}
+_ROWS_CACHE_LOCK = threading.Lock()
+
+class _RowsCacheEntry:
+    def __init__(self, ino):
+        self.ino = ino
+        self.offset = 0      # パース済みのバイト位置（行末の直後）
+        self.size = 0
+        self.header = None
+        self.rows = []       # 相対時刻のままの行 dict
+        self.session_start_time = None
+        self.lock = threading.Lock()
+
+def _parse_row(row):
+    _f = lambda k: float(row.get(k) or 0)
+    stage = row.get("stage", "")
+    return {
+        "time": _f("time"),
+        "stage": stage,
+        "stage_num": {"Wake": 3, "Light_NREM_candidate": 2, "REM_candidate": 1.5, "Deep_candidate": 1}.get(stage),
+        "confidence": _f("confidence"),
+        "theta_alpha": _f("theta_alpha"),
+        "beta_rel": _f("beta_rel"),
+        "motion_rms": _f("motion_rms"),
+        "fac_rate": _f("fac_rate"),
+        "signal": _f("signal"),
+        "eog_sacc": _f("eog_sacc"),
+        "eog_on": _f("eog_on"),
+    }
+
+def _cached_rows(csv_path):
+    """csv_path のパース済み行（相対時刻）を返す。前回から伸びた分だけを読む"""
+    st = os.stat(csv_path)
+    with _ROWS_CACHE_LOCK:
+        ent = _ROWS_CACHE.get(csv_path)
+        # 置き換え・切り詰められたファイルは最初から読み直す
+        if ent is None or ent.ino != st.st_ino or st.st_size < ent.offset:
+            ent = _ROWS_CACHE[csv_path] = _RowsCacheEntry(st.st_ino)
+    with ent.lock:
+        if st.st_size != ent.size:
+            with open(csv_path, "rb") as f:
+                f.seek(ent.offset)
+                chunk = f.read(st.st_size - ent.offset)
+            # 書きかけの最終行は次回に回す
+            cut = chunk.rfind(b"\n") + 1
+            if cut:
+                lines = chunk[:cut].decode("utf-8").splitlines()
+                reader = csv.reader(lines)
+                if ent.header is None:
+                    ent.header = next(reader, None)
+                for values in reader:
+                    if values:
+                        ent.rows.append(_parse_row(dict(zip(ent.header, values))))
+                ent.offset += cut
+            ent.size = st.st_size
+            if ent.session_start_time is None and ent.rows:
+                # /api/history・/api/summary と同じく登録簿の開始時刻（無ければファイル名）に合わせる。
+                # どちらも無いときだけ、最後の行がファイルの更新時刻に書かれたとみなして推定する。
+                # 一度決めたら固定するので、差分で返した行と以前の行の時刻がずれない
+                ent.session_start_time = _registered_start_time(csv_path)
+                if ent.session_start_time is None:
+                    ent.session_start_time = st.st_mtime - (ent.rows[-1]["time"] - ent.rows[0]["time"])
+        return ent
+
+def _registered_start_time(csv_path):
+    """user_data/<username>/<session_file> の登録簿の開始時刻（無ければファイル名のタイムスタンプ）"""
+    username = os.path.basename(os.path.dirname(csv_path))
+    name = os.path.basename(csv_path)
+    return session_start_time(user_management.get_session(username, name) or {"session_file": name})
+
+def _to_absolute(ent, rows):
+    # 相対時間を絶対時間（ミリ秒）に変換
+    if ent.session_start_time:
+        return [dict(r, time=(ent.session_start_time + r["time"]) * 1000) for r in rows]
+    return [dict(r, time=r["time"] * 1000) for r in rows]
+
+def _series_range(limit, csv_path, since=None):
+    """
+    キャッシュ済み行のうち返す範囲を (ent, i0, n, cursor, reset) で返す（ファイルが無ければ None）。
+    cursor は "<ファイルの inode>.<行数>"。
+    """
+    if not csv_path or not os.path.exists(csv_path):
+        return None
+    ent = _cached_rows(csv_path)
+    n = len(ent.rows)
+    token = f"{ent.ino:x}"
+    cursor = f"{token}.{n}"
+    
+    if since:
+        prev_token, _, prev_n = since.partition(".")
+        if prev_token == token and prev_n.isdigit() and int(prev_n) <= n:
+            return ent, max(int(prev_n), n - limit), n, cursor, False
+    return ent, max(0, n - limit), n, cursor, True
+
+def read_series(limit=720, username=None, since=None):
+    """
+    (rows, cursor, reset) を返す。since に前回の cursor を渡すとそれ以降の行だけを返す。
+    ファイルが変わった・cursor が読めない場合は reset=True で直近 limit 行を返す。
+    """
     csv_path = resolve_csv_path(username)
-    if not csv_path:
-        return []
     
     # 統合データの場合
     if csv_path == "combined":
-        return read_combined_data(limit)
-    
-    if not os.path.exists(csv_path):
-        return []
-    
-    out = []
-    session_start_time = None
-    current_time = time.time()
+        return read_combined_series(limit, since)
     
-    with open(csv_path, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        rows = list(reader)
-        
-        # セッション開始時刻を推定（最初の行の相対時間から）
-        if rows:
-            first_relative_time = float(rows[0].get("time", 0))
-            # 最初の行が収集された絶対時刻を推定
-            session_start_time = current_time - (float(rows[-1].get("time", 0)) - first_relative_time)
-        
-        for row in rows[-limit:]:
-            _f = lambda k: float(row.get(k) or 0)
-            ts_relative = _f("time")
-            
-            # 相対時間を絶対時間（ミリ秒）に変換
-            if session_start_time:
-                ts_absolute = (session_start_time + ts_relative) * 1000
-            else:
-                ts_absolute = ts_relative * 1000
-            
-            stage = row.get("stage", "")
-            num = {"Wake": 3, "Light_NREM_candidate": 2, "REM_candidate": 1.5, "Deep_candidate": 1}.get(stage)
-            
-            out.append({
-                "time": ts_absolute,
-                "stage": stage,
-                "stage_num": num,
-                "confidence": _f("confidence"),
-                "theta_alpha": _f("theta_alpha"),
-                "beta_rel": _f("beta_rel"),
-                "motion_rms": _f("motion_rms"),
-                "fac_rate": _f("fac_rate"),
-                "signal": _f("signal"),
-                "eog_sacc": _f("eog_sacc"),
-                "eog_on": _f("eog_on"),
-            })
-    return out
+    rng = _series_range(limit, csv_path, since)
+    if rng is None:
+        return [], "", True
+    ent, i0, n, cursor, reset = rng
+    return _to_absolute(ent, ent.rows[i0:n]), cursor, reset
+
+def read_rows(limit=720, username=None):
+    return read_series(limit, username)[0]
 
 def get_registered_users():
-    """CSVファイルから登録済みユーザーリストを取得"""
-    if not os.path.exists(USER_CSV_FILE):
-        return []
-    
-    users = []
-    with open(USER_CSV_FILE, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            # データファイルの存在確認
-            user_csv_path = resolve_csv_path(row['username'])
-            has_data = user_csv_path is not None and os.path.exists(user_csv_path)
-            
-            users.append({
-                'username': row['username'],
-                'display_name': row['display_name'],
-                'notes': row['notes'],
-                'total_sessions': int(row['total_sessions']),
-                'last_session': row['last_session'],
-                'has_data': has_data
-            })
-    return users
-
-def update_user_session(username, session_file):
-    """ユーザーのセッション情報を更新"""
-    if not os.path.exists(USER_CSV_FILE):
-        return False
-    
-    # 全ユーザーを読み込み
-    users = []
-    with open(USER_CSV_FILE, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            users.append(row)
-    
-    # 指定ユーザーを更新
-    for user in users:
-        if user['username'] == username:
-            user['last_session'] = session_file
-            user['total_sessions'] = str(int(user['total_sessions']) + 1)
-            break
-    
-    # CSVファイルを再書き込み
-    with open(USER_CSV_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "username", "display_name", "created_date", 
-            "last_session", "total_sessions", "notes"
-        ])
-        for user in users:
-            writer.writerow([
-                user['username'], user['display_name'], user['created_date'],
-                user['last_session'], user['total_sessions'], user['notes']
-            ])
-    
-    return True
+    """登録済みユーザーリストを取得（has_data はセッションが記録済みかどうか）"""
+    return [{
+        'username': u['username'],
+        'display_name': u['display_name'],
+        'notes': u['notes'],
+        'total_sessions': int(u['total_sessions']),
+        'last_session': u['last_session'],
+        'has_data': bool(u['last_session'])
+    } for u in user_management.get_users()]
 
 def get_available_users():
     """利用可能なユーザーリストを取得（後方互換性のため）"""
     registered_users = get_registered_users()
     return [user['username'] for user in registered_users]
 
+# ---- HTTP キャッシュ（ETag / 304）と圧縮 ----
+def _stat_key(path):
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return (path, st.st_ino, st.st_size, st.st_mtime_ns)
+
+def _etag(*parts):
+    return hashlib.blake2b(repr(parts).encode("utf-8"), digest_size=12).hexdigest()
+
+def _not_modified(etag):
+    """If-None-Match が etag と一致すれば 304 を返す（一致しなければ None）"""
+    if request.if_none_match.contains_weak(etag):
+        resp = Response(status=304)
+        resp.set_etag(etag, weak=True)
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+    return None
+
+def _with_etag(resp, etag, last_modified=None):
+    resp.set_etag(etag, weak=True)
+    if last_modified:
+        resp.last_modified = last_modified
+    # ブラウザに毎回 If-None-Match 付きで確認させる
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp
+
+def _series_etag(username):
+    """行をパースする前に、元ファイルの stat だけで応答が変わったかを判定するための (ETag, 最終更新時刻)"""
+    csv_path = resolve_csv_path(username)
+    if csv_path == "combined":
+        users = [u for u in get_registered_users() if u['has_data']]
+        stats = [_stat_key(resolve_csv_path(u['username'])) for u in users]
+        names = [(u['username'], u['display_name']) for u in users]
+    else:
+        stats, names = [_stat_key(csv_path)], []
+    mtimes = [st[3] for st in stats if st]
+    last_modified = max(mtimes) / 1e9 if mtimes else None
+    return _etag(names, stats, sorted(request.args.items(multi=True))), last_modified
+
+@app.after_request
+def _compress(resp):
+    """大きい JSON を gzip（brotli があれば br）で圧縮する"""
+    if (resp.status_code != 200 or resp.direct_passthrough or resp.is_streamed
+            or resp.mimetype != "application/json" or "Content-Encoding" in resp.headers):
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return resp
+    accept = request.headers.get("Accept-Encoding", "")
+    if brotli is not None and "br" in accept:
+        data, encoding = brotli.compress(data, quality=5), "br"
+    elif "gzip" in accept:
+        data, encoding = gzip.compress(data, compresslevel=6), "gzip"
+    else:
+        return resp
+    resp.set_data(data)
+    resp.headers["Content-Encoding"] = encoding
+    resp.headers["Content-Length"] = str(len(data))
+    resp.vary.add("Accept-Encoding")
+    return resp
+
+MAX_POINTS_LIMIT = 20000   # max_points で要求できる上限（/api/series・/api/history）
+
+def _clamp_points(max_points):
+    """max_points を 2..MAX_POINTS_LIMIT に収める（先頭と末尾の2点は必ず返す）"""
+    return max(2, min(max_points, MAX_POINTS_LIMIT))
+
 @app.get("/api/series")
 def api_series():
     try:
@@ -192,24 +330,286 @@ def api_series():
     except:
         limit = 720
     username = request.args.get("user")
+    since = request.args.get("since")
+    max_points = request.args.get("max_points", type=int)
+    if username and not user_management.get_user(username):
+        return jsonify({"error": "user not found", "user": username}), 404
     
-    # セッション情報を更新
-    if username:
+    etag, last_modified = _series_etag(username)
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    
+    rows, cursor, reset = read_series(limit, username, since)
+    if max_points:
+        rows = downsample_rows(rows, _clamp_points(max_points))
+    return _with_etag(jsonify({
+        "rows": rows, 
+        "csv": resolve_csv_path(username), 
+        "now": int(time.time()*1000),
+        "user": username,
+        "cursor": cursor,
+        "reset": reset
+    }), etag, last_modified)
+
+# ---- 過去セッション（複数夜）の履歴 ----
+HISTORY_MAX_POINTS = 1500
+_STAGE_NUM = {"Wake": 3, "Light_NREM_candidate": 2, "REM_candidate": 1.5, "Deep_candidate": 1}
+
+def _history_columns(username, session, live):
+    """
+    1セッション分を列で返す: (絶対時刻ミリ秒, {特徴量: 配列}, ステージ列, 添字→行 dict の関数)。
+    記録中のセッションは tail キャッシュ、終わったものは session_reader の mmap 列を使う。
+    """
+    path = os.path.join(USER_DATA_DIR, username, session['session_file'])
+    if not os.path.exists(path):
+        return None
+    start = session_start_time(session)
+    if live:
+        ent = _cached_rows(path)
+        rows = ent.rows[:]
+        start = start or ent.session_start_time or 0.0
+        t = (start + np.array([r["time"] for r in rows], dtype=np.float64)) * 1000
+        feats = {k: np.array([r[k] for r in rows], dtype=np.float64) for k in SERIES_FEATURES}
+        stages = [r["stage"] for r in rows]
+        return t, feats, stages, lambda i: dict(rows[i], time=float(t[i]))
+
+    st = open_session(path)[ROWS_STREAM]
+    if start is None:
+        start = os.stat(path).st_mtime - (float(st.t[-1]) if len(st) else 0.0)
+    t = (start + np.asarray(st.t, dtype=np.float64)) * 1000
+    cols = {k: np.nan_to_num(np.asarray(st.col(k), dtype=np.float64)) if k in st.columns else np.zeros(len(st))
+            for k in SERIES_FEATURES + ("confidence", "signal", "eog_on")}
+    stages = [x or "" for x in st.decode("stage")] if "stage" in st.columns else [""] * len(st)
+
+    def make_row(i):
+        row = {k: float(cols[k][i]) for k in cols}
+        row.update(time=float(t[i]), stage=stages[i], stage_num=_STAGE_NUM.get(stages[i]))
+        return row
+    return t, {k: cols[k] for k in SERIES_FEATURES}, stages, make_row
+
+def read_history(username, nights=1, max_points=HISTORY_MAX_POINTS):
+    """直近 nights セッションをつなげ、max_points 行以内に間引いて返す"""
+    sessions = session_index.list_sessions(username)[-max(nights, 1):]
+    latest = user_management.get_latest_session(username)
+    parts, used = [], []
+    for sess in sessions:
+        cols = _history_columns(username, sess, live=sess['session_file'] == latest)
+        if cols is not None and len(cols[0]):
+            parts.append(cols)
+            used.append(sess['session_file'])
+    if not parts:
+        return [], used, 0
+    
+    t = np.concatenate([p[0] for p in parts])
+    feats = {k: np.concatenate([p[1][k] for p in parts]) for k in SERIES_FEATURES}
+    stages = [x for p in parts for x in p[2]]
+    offsets = np.cumsum([0] + [len(p[0]) for p in parts])
+    sel = select_indices(t, feats, stages, max_points) if max_points > 0 else np.arange(len(t))
+    rows = []
+    for i in sel.tolist():
+        k = int(np.searchsorted(offsets, i, side="right")) - 1
+        rows.append(parts[k][3](i - offsets[k]))
+    return rows, used, len(t)
+
+@app.get("/api/history")
+def api_history():
+    """ユーザーの直近 nights セッション分の行（max_points 行以内に間引き）"""
+    username = request.args.get("user")
+    if not username:
+        return jsonify({"error": "user is required"}), 400
+    if not user_management.get_user(username):
+        return jsonify({"error": "user not found", "user": username}), 404
+    nights = request.args.get("nights", 1, type=int)
+    max_points = _clamp_points(request.args.get("max_points", HISTORY_MAX_POINTS, type=int))
+    rows, sessions, total = read_history(username, nights, max_points)
+    return jsonify({
+        "rows": rows,
+        "user": username,
+        "sessions": sessions,
+        "total_rows": total,
+        "now": int(time.time()*1000),
+    })
+
+@app.get("/api/summary")
+def api_summary():
+    """
+    セッションの要約指標。SleepApp が書く <csv>.summary.json を返す
+    （無い古いセッションだけ CSV の行から計算する）。session 省略時は最新のセッション。
+    """
+    username = request.args.get("user")
+    if not username:
+        return jsonify({"error": "user is required"}), 400
+    if not user_management.get_user(username):
+        return jsonify({"error": "user not found", "user": username}), 404
+    session = request.args.get("session")
+    if session:
+        csv_path = _user_file(username, session)
+    else:
         csv_path = resolve_csv_path(username)
-        if csv_path:
-            update_user_session(username, os.path.basename(csv_path))
+    if not csv_path or not os.path.exists(csv_path):
+        return jsonify({"error": "session not found", "user": username}), 404
     
+    summary = load_summary(csv_path)
+    source = "sidecar"
+    if summary is None:
+        summary = summarize_rows(_cached_rows(csv_path).rows)
+        source = "rows"
     return jsonify({
-        "rows": read_rows(limit, username), 
-        "csv": resolve_csv_path(username), 
+        "user": username,
+        "session": os.path.basename(csv_path),
+        "summary": summary,
+        "source": source,
+    })
+
+@app.get("/api/users/<username>/sessions")
+def api_user_sessions(username):
+    """ユーザーの全セッション（開始時刻順）を索引から返す"""
+    if not user_management.get_user(username):
+        return jsonify({"error": "user not found"}), 404
+    sessions = [{
+        "session": s['session_file'],
+        "start_time": session_start_time(s),
+        "end_time": s['end_time'],
+        "rows": s['rows'],
+        "size": s['size'],
+        "summary": s['summary'],
+    } for s in session_index.list_sessions(username)]
+    return jsonify({"user": username, "sessions": sessions})
+
+@app.get("/api/users/<username>/trend")
+def api_user_trend(username):
+    """セッションごとの要約指標の推移。metric は "total_sleep_sec" や "stage_sec.REM_candidate" など"""
+    if not user_management.get_user(username):
+        return jsonify({"error": "user not found"}), 404
+    metric = request.args.get("metric", "total_sleep_sec")
+    return jsonify({"user": username, "metric": metric, "points": session_index.trend(username, metric)})
+
+# ---- Server-Sent Events ----
+SSE_POLL_SEC = 0.5        # ファイル末尾を確認する間隔
+SSE_HEARTBEAT_SEC = 15.0  # 行が無いときのコメント送信間隔（プロキシの切断よけ）
+SSE_IDLE_SEC = 30.0       # 購読者がいなくなってから watcher を止めるまで
+
+class _SeriesWatcher:
+    """
+    ユーザー（None は統合ビュー）ごとに1つだけ動く tail 読みスレッド。
+    新しい行を見つけたら (前回の cursor, rows, cursor, reset) を全購読者のキューへ配る。
+    """
+    def __init__(self, username, limit):
+        self.username = username
+        self.limit = limit
+        self.cursor = None
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._run, name=f"SeriesWatcher-{username}", daemon=True)
+
+    def subscribe(self):
+        q = queue.SimpleQueue()
+        with self.lock:
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def _run(self):
+        idle_since = None
+        while True:
+            with self.lock:
+                subs = list(self.subscribers)
+            if not subs:
+                idle_since = idle_since or time.time()
+                if time.time() - idle_since > SSE_IDLE_SEC:
+                    with _WATCHERS_LOCK:
+                        with self.lock:
+                            if not self.subscribers:
+                                _WATCHERS.pop(self.username, None)
+                                return
+            else:
+                idle_since = None
+                try:
+                    prev = self.cursor
+                    rows, cursor, reset = read_series(self.limit, self.username, prev)
+                    if rows or cursor != prev:
+                        self.cursor = cursor
+                        for q in subs:
+                            q.put((prev, rows, cursor, reset))
+                except Exception as e:
+                    print("[WARN] series watcher:", e)
+            time.sleep(SSE_POLL_SEC)
+
+_WATCHERS = {}
+_WATCHERS_LOCK = threading.Lock()
+
+def _subscribe(username, limit=720):
+    """username の watcher（無ければ起動）に購読者キューを登録して (watcher, queue) を返す"""
+    with _WATCHERS_LOCK:
+        w = _WATCHERS.get(username)
+        if w is None:
+            w = _WATCHERS[username] = _SeriesWatcher(username, limit)
+            w.thread.start()
+        return w, w.subscribe()
+
+def _sse_event(username, rows, cursor, reset):
+    data = json.dumps({
+        "rows": rows,
+        "csv": resolve_csv_path(username),
         "now": int(time.time()*1000),
-        "user": username
+        "user": username,
+        "cursor": cursor,
+        "reset": reset,
     })
+    return f"id: {cursor}\nevent: rows\ndata: {data}\n\n"
+
+@app.get("/api/stream")
+def api_stream():
+    """
+    新しい行を Server-Sent Events で送る。接続時に Last-Event-ID（または since）以降の行を
+    まとめて送り、その後は watcher が見つけた行を届いた順に送る。
+    """
+    try:
+        limit = int(request.args.get("limit", "720"))
+    except:
+        limit = 720
+    username = request.args.get("user")
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    if username and not user_management.get_user(username):
+        return jsonify({"error": "user not found", "user": username}), 404
+
+    def gen():
+        watcher, q = _subscribe(username)
+        try:
+            rows, cursor, reset = read_series(limit, username, since)
+            yield "retry: 3000\n" + _sse_event(username, rows, cursor, reset)
+            while True:
+                try:
+                    prev, rows, new_cursor, reset = q.get(timeout=SSE_HEARTBEAT_SEC)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if prev != cursor:
+                    # 接続時の読み込みと watcher の通知がずれたら自分の cursor から読み直す
+                    rows, new_cursor, reset = read_series(limit, username, cursor)
+                    if not rows and new_cursor == cursor:
+                        continue
+                cursor = new_cursor
+                yield _sse_event(username, rows, cursor, reset)
+        finally:
+            watcher.unsubscribe(q)
+
+    return Response(stream_with_context(gen()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 @app.get("/api/users")
 def api_users():
     """登録済みユーザーリストを返す"""
-    return jsonify({"users": get_registered_users()})
+    db = user_management.USER_DB_FILE
+    etag = _etag(_stat_key(db), _stat_key(db + "-wal"))
+    not_modified = _not_modified(etag)
+    if not_modified:
+        return not_modified
+    return _with_etag(jsonify({"users": get_registered_users()}), etag)
 
 @app.get("/")
 def root():
@@ -362,5 +762,5 @@ if __name__ == "__main__":
     print(f"[INFO] serving frontend at http://localhost:{port}")
     print(f"[INFO] watching CSV: {resolve_csv_path()}")
     print(f"[INFO] user data directory: {USER_DATA_DIR}")
-    print(f"[INFO] user management CSV: {USER_CSV_FILE}")
+    print(f"[INFO] user registry: {user_management.USER_DB_FILE}")
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,116 @@
+# session_index.py
+"""
+user_data/<username>/ にある全セッション CSV の索引（user_management の sessions テーブル）を
+ファイルの増減・更新に合わせて同期する。
+
+サイズと mtime が索引と同じファイルは読まないので、同期は scandir 1回ぶんで済む。
+CSV が消えた（移動された）セッションは索引からも消す（記録を始めたばかりでまだ CSV の無い
+最新セッションは残す）。
+要約は SleepApp が書く <csv>.summary.json を使い、無い古いセッションだけ CSV から計算する。
+sync_user() は同じユーザーに対して SYNC_INTERVAL_SEC に1回しか走らない。
+"""
+import csv, os, re, threading, time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import user_management
+from session_summary import load_summary, summarize_rows
+
+BASE_CSV_NAME = "sleep_candidates"
+SYNC_INTERVAL_SEC = 30.0
+
+_STAMP_RE = re.compile(r"(\d{8}_\d{6})")
+_last_sync: Dict[str, float] = {}
+_sync_lock = threading.Lock()
+
+
+def session_start_time(session: Dict) -> Optional[float]:
+    """登録簿の開始時刻、無ければファイル名のタイムスタンプ"""
+    if session.get('start_time'):
+        return session['start_time']
+    m = _STAMP_RE.search(session['session_file'])
+    if m:
+        return datetime.strptime(m.group(1), "%Y%m%d_%H%M%S").timestamp()
+    return None
+
+
+def _csv_summary(path: str) -> Dict:
+    summary = load_summary(path)
+    if summary is not None:
+        return summary
+    with open(path, "r", newline="", encoding="utf-8") as f:
+        rows = [{"time": float(r.get("time") or 0), "stage": r.get("stage") or None,
+                 "signal": float(r.get("signal") or 0), "eog_on": float(r.get("eog_on") or 0)}
+                for r in csv.DictReader(f)]
+    return summarize_rows(rows)
+
+
+def sync_user(username: str, root: str = user_management.USER_DATA_DIR, force: bool = False) -> int:
+    """索引を username のディレクトリに合わせる。追加・更新・削除したセッション数を返す（未登録のユーザーは 0）"""
+    if not user_management.get_user(username):
+        return 0
+    now = time.time()
+    with _sync_lock:
+        if not force and now - _last_sync.get(username, 0.0) < SYNC_INTERVAL_SEC:
+            return 0
+        _last_sync[username] = now
+
+    user_dir = os.path.join(root, username)
+    known = {s['session_file']: s for s in user_management.get_sessions(username)}
+    seen = set()
+    n = 0
+    entries = []
+    if os.path.isdir(user_dir):
+        with os.scandir(user_dir) as it:
+            entries = [e for e in it if _is_session_csv(e.name)]
+    for e in entries:
+        seen.add(e.name)
+        st = e.stat()
+        k = known.get(e.name, {})
+        if k.get('size') == st.st_size and k.get('mtime') == st.st_mtime:
+            continue
+        try:
+            summary = _csv_summary(e.path)
+        except (OSError, ValueError) as err:
+            print(f"[WARN] session index: {e.path}: {err}")
+            continue
+        start = session_start_time(dict(k, session_file=e.name))
+        end = start + summary['last_t'] if start is not None and summary.get('last_t') is not None else None
+        user_management.upsert_session(username, e.name, start, end, summary['rows'], summary,
+                                       st.st_size, st.st_mtime)
+        n += 1
+
+    latest = user_management.get_latest_session(username)
+    gone = [f for f in known if _is_session_csv(f) and f not in seen and f != latest]
+    if gone:
+        user_management.delete_sessions(username, gone)
+        n += len(gone)
+    return n
+
+
+def _is_session_csv(name: str) -> bool:
+    return name.startswith(BASE_CSV_NAME + "_") and name.endswith(".csv")
+
+
+def list_sessions(username: str) -> List[Dict]:
+    sync_user(username)
+    return user_management.get_sessions(username)
+
+
+def metric_value(summary: Optional[Dict], metric: str):
+    """"stage_sec.REM_candidate" のようなドット区切りで summary の値を取り出す"""
+    v = summary
+    for key in metric.split("."):
+        if not isinstance(v, dict):
+            return None
+        v = v.get(key)
+    return v
+
+
+def trend(username: str, metric: str) -> List[Dict]:
+    """セッションごとの metric を開始時刻順で返す"""
+    return [{
+        "session": s['session_file'],
+        "start_time": session_start_time(s),
+        "value": metric_value(s['summary'], metric),
+    } for s in list_sessions(username) if s['summary'] is not None]
@@ -0,0 +1,267 @@
+# session_reader.py
+"""
+セッションファイル（raw_*.ddraw の生ストリーム、sleep_candidates_*.csv の派生行）を
+ストリームごとの列ファイル <src>.cols/ に展開し、np.memmap でゼロコピーに読むリーダー。
+
+  s = open_session("user_data/mitachi/raw_20250901_010203.ddraw")
+  mot = s["mot"].slice(t0, t1)          # 時刻列の二分探索 + ビュー（コピーなし）
+  rows = open_session("user_data/mitachi/sleep_candidates_20250901_010203.csv")["rows"]
+
+元ファイルは mmap して読み、どこまで読んだか（バイト位置・スキーマ・辞書）を index.json に残す。
+元ファイルは追記されるだけなので、記録中で伸びたときは続きだけを読んで列ファイルに追記する
+（置き換え・切り詰め・列の追加があったときだけ最初から作り直す）。
+派生行 CSV は "rows" という1ストリームになり、t が time 列、v がそれ以外の列
+（stage などの文字列列は辞書コード、空欄は NaN）。
+"""
+import csv, json, mmap, os, threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from raw_log import RAW_LOG_EXT, LogScanner, map_file, merge_blocks, read_log
+
+COLS_SUFFIX = ".cols"
+ROWS_STREAM = "rows"
+_INDEX = "index.json"
+_FORMAT = 2     # 列ファイルの形式（違うものは作り直す）
+
+_LOCKS: Dict[str, threading.Lock] = {}
+_LOCKS_LOCK = threading.Lock()
+
+
+class Stream:
+    """1ストリーム分の時刻 t（昇順, float64）と値 v（行 = サンプル）"""
+    def __init__(self, name: str, columns: List[str], t: np.ndarray, v: np.ndarray,
+                 codes: Optional[Dict[int, str]] = None):
+        self.name = name
+        self.columns = list(columns)
+        self.t = t
+        self.v = v
+        self.dict = codes or {}
+
+    def __len__(self):
+        return len(self.t)
+
+    def col(self, name: str) -> np.ndarray:
+        return self.v[:, self.columns.index(name)]
+
+    def decode(self, name: str) -> List[Optional[str]]:
+        """辞書コード化された文字列列を元の文字列に戻す（NaN は None）"""
+        return [None if c != c else self.dict.get(int(c)) for c in self.col(name).tolist()]
+
+    def span(self, t0: Optional[float] = None, t1: Optional[float] = None) -> Tuple[int, int]:
+        """t0 <= t < t1 の添字範囲"""
+        i0 = 0 if t0 is None else int(np.searchsorted(self.t, t0, side="left"))
+        i1 = len(self.t) if t1 is None else int(np.searchsorted(self.t, t1, side="left"))
+        return i0, max(i0, i1)
+
+    def slice(self, t0: Optional[float] = None, t1: Optional[float] = None) -> "Stream":
+        i0, i1 = self.span(t0, t1)
+        return Stream(self.name, self.columns, self.t[i0:i1], self.v[i0:i1], self.dict)
+
+
+class Session:
+    def __init__(self, path: str, meta: Dict, streams: Dict[str, Stream]):
+        self.path = path
+        self.meta = meta
+        self.streams = streams
+
+    def __getitem__(self, name: str) -> Stream:
+        return self.streams[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.streams
+
+    def slice(self, t0: Optional[float] = None, t1: Optional[float] = None) -> Dict[str, Stream]:
+        return {name: s.slice(t0, t1) for name, s in self.streams.items()}
+
+
+class _RowsScanner:
+    """派生行 CSV を前から読む。LogScanner と同じく state() で続きから読める"""
+    def __init__(self, state: Optional[Dict] = None):
+        state = state or {}
+        self.offset = state.get("offset", 0)
+        self.header = state.get("header")
+        self.codes: Dict[str, int] = dict(state.get("codes", {}))
+
+    def state(self) -> Dict:
+        return {"offset": self.offset, "header": self.header, "codes": self.codes}
+
+    def scan(self, buf) -> Tuple[Dict, Dict[str, Dict]]:
+        """offset 以降の完全な行を rows ストリームの配列にする（書きかけの最終行は次回）"""
+        chunk = bytes(buf[self.offset:])
+        cut = chunk.rfind(b"\n") + 1
+        reader = csv.reader(chunk[:cut].decode("utf-8").splitlines())
+        self.offset += cut
+        if self.header is None and cut:
+            self.header = next(reader, None) or ["time"]
+        header = self.header or ["time"]
+        rows = [r for r in reader if len(r) == len(header)]
+        columns = header[1:]
+        t = np.empty(len(rows), dtype=np.float64)
+        v = np.full((len(rows), len(columns)), np.nan, dtype=np.float64)
+        for i, r in enumerate(rows):
+            t[i] = float(r[0] or 0)
+            for j, x in enumerate(r[1:]):
+                if x == "":
+                    continue
+                try:
+                    v[i, j] = float(x)
+                except ValueError:
+                    v[i, j] = self.codes.setdefault(x, len(self.codes))
+        stream = {"columns": columns, "t": t, "v": v, "dict": {c: s for s, c in self.codes.items()}}
+        return {}, {ROWS_STREAM: stream}
+
+
+def _scan(path: str, state: Optional[Dict]) -> Tuple[Dict, Dict[str, Dict], Dict]:
+    """path を mmap し、state の続きを読んで (meta, 増えた分のストリーム, 新しい state) を返す"""
+    buf = map_file(path)
+    try:
+        if path.endswith(RAW_LOG_EXT):
+            sc = LogScanner(state)
+            try:
+                blocks = sc.scan(buf)
+            except ValueError as e:
+                raise ValueError(f"{e}: {path}") from None
+            streams = {}    # ヘッダもまだ書かれていない記録中のファイルは空
+            for name, columns in sc.columns.items():
+                t, v = merge_blocks(blocks.get(name, []), columns, sc.value_dtype)
+                streams[name] = {"columns": columns, "t": t, "v": v, "dict": sc.dicts.get(name, {})}
+            del blocks
+            meta = sc.meta
+        else:
+            sc = _RowsScanner(state)
+            meta, streams = sc.scan(buf)
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+    return meta, streams, sc.state()
+
+
+def _load_source(path: str) -> Tuple[Dict, Dict[str, Dict]]:
+    if path.endswith(RAW_LOG_EXT):
+        return read_log(path)
+    meta, streams, _ = _scan(path, None)
+    return meta, streams
+
+
+def _stamp(path: str) -> Dict:
+    st = os.stat(path)
+    return {"source_ino": st.st_ino, "source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns}
+
+
+def _lock(cache_dir: str) -> threading.Lock:
+    with _LOCKS_LOCK:
+        return _LOCKS.setdefault(cache_dir, threading.Lock())
+
+
+def _read_index(cache_dir: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(cache_dir, _INDEX), "r", encoding="utf-8") as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get("format") == _FORMAT else None
+
+
+def _write_index(cache_dir: str, index: Dict):
+    # index.json を最後に置き換えるので、読み手は古い組か新しい組のどちらかを見る
+    tmp = os.path.join(cache_dir, _INDEX + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp, os.path.join(cache_dir, _INDEX))
+
+
+def _resumable(index: Optional[Dict], stamp: Dict) -> bool:
+    """同じファイルが伸びただけなら True（続きから読める）"""
+    return (index is not None and index.get("source_ino") == stamp["source_ino"]
+            and stamp["source_size"] > index.get("source_size", 0))
+
+
+def _append(path: str, arr: np.ndarray, keep: int):
+    """列ファイルを keep バイトに切りそろえてから arr を追記する（前回書きかけた分は捨てる）"""
+    with open(path, "r+b" if keep else "wb") as f:
+        f.truncate(keep)
+        f.seek(keep)
+        f.write(np.ascontiguousarray(arr).tobytes())
+
+
+def _update_cache(path: str, cache_dir: str, stamp: Dict, index: Optional[Dict]) -> Dict:
+    """列ファイルを元ファイルに追いつかせ、新しい index を返す"""
+    os.makedirs(cache_dir, exist_ok=True)
+    if _resumable(index, stamp):
+        meta, new, state = _scan(path, index["scan"])
+        # 既存のストリームに列が増えたら、列ファイルの幅が変わるので作り直す
+        if any(name in index["streams"] and index["streams"][name]["columns"] != s["columns"]
+               for name, s in new.items()):
+            index = None
+    else:
+        index = None
+    if index is None:
+        for fn in os.listdir(cache_dir):
+            if fn.endswith((".bin", ".npy")):
+                os.remove(os.path.join(cache_dir, fn))
+        index = {"format": _FORMAT, "streams": {}}
+        meta, new, state = _scan(path, None)
+
+    for name, s in new.items():
+        ent = index["streams"].get(name)
+        if ent is None:
+            i = len(index["streams"])
+            ent = index["streams"][name] = {"columns": s["columns"], "dtype": s["v"].dtype.str, "n": 0,
+                                            "files": {"t": f"{i}.t.bin", "v": f"{i}.v.bin"}}
+        n = ent["n"]
+        itemsize = np.dtype(ent["dtype"]).itemsize
+        _append(os.path.join(cache_dir, ent["files"]["t"]), s["t"].astype(np.float64, copy=False), n * 8)
+        _append(os.path.join(cache_dir, ent["files"]["v"]), s["v"].astype(ent["dtype"], copy=False),
+                n * len(ent["columns"]) * itemsize)
+        ent["n"] = n + len(s["t"])
+        ent["dict"] = {str(k): v for k, v in s["dict"].items()}
+    index.update(stamp, meta=meta, scan=state)
+    _write_index(cache_dir, index)
+    return index
+
+
+def _open_cache(path: str, cache_dir: str, index: Dict) -> Optional[Session]:
+    streams = {}
+    try:
+        for name, sc in index["streams"].items():
+            n, ncols, dtype = sc["n"], len(sc["columns"]), np.dtype(sc["dtype"])
+            if n:
+                t = np.memmap(os.path.join(cache_dir, sc["files"]["t"]), dtype=np.float64, mode="r", shape=(n,))
+            else:
+                t = np.empty(0)
+            if n and ncols:
+                v = np.memmap(os.path.join(cache_dir, sc["files"]["v"]), dtype=dtype, mode="r", shape=(n, ncols))
+            else:
+                v = np.empty((n, ncols), dtype=dtype)
+            streams[name] = Stream(name, sc["columns"], t, v, {int(k): s for k, s in sc["dict"].items()})
+    except (OSError, ValueError, KeyError):
+        return None
+    return Session(path, index.get("meta", {}), streams)
+
+
+def open_session(path: str, cache: bool = True, rebuild: bool = False) -> Session:
+    """
+    path（*.ddraw または派生行 *.csv）を開く。
+    cache=True なら <path>.cols/ を使い（無ければ作り、伸びていれば追記し）、mmap したビューを返す。
+    列ファイルを書けない場所では、読み込んだ配列をそのまま返す。
+    """
+    stamp = _stamp(path)    # mmap より先に取る（あとから伸びた分は次に開いたときに読む）
+    cache_dir = path + COLS_SUFFIX
+    if cache:
+        try:
+            with _lock(cache_dir):
+                index = None if rebuild else _read_index(cache_dir)
+                if index is None or any(index.get(k) != v for k, v in stamp.items()):
+                    index = _update_cache(path, cache_dir, stamp, index)
+                s = _open_cache(path, cache_dir, index)
+                if s is None:
+                    s = _open_cache(path, cache_dir, _update_cache(path, cache_dir, stamp, None))
+            if s is not None:
+                return s
+        except OSError as e:
+            print(f"[WARN] session cache not written ({cache_dir}): {e}")
+    meta, streams = _load_source(path)
+    return Session(path, meta, {name: Stream(name, s["columns"], s["t"], s["v"], s["dict"])
+                                for name, s in streams.items()})
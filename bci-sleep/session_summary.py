@@ -0,0 +1,124 @@
+# session_summary.py
+"""
+1セッション（1晩）の要約指標を行の追加ごとに O(1) で更新する。
+SleepApp が行を書くたびに add_row() して <csv>.summary.json に保存し、
+/api/summary はその JSON を返すだけにする。
+
+各行は直前の行からの経過時間（最大 HOP_SEC、先頭行は HOP_SEC）の区間として数える。
+品質不足の行は pow を受けるたびに出るので、行数ではなく時間で積算する。
+- onset_latency_sec : セッション開始から最初の睡眠ステージ（Wake 以外）まで
+- rem_latency_sec   : 入眠から最初の REM 候補まで
+- waso_sec          : 入眠後の Wake。最後の覚醒以降（まだ眠りに戻っていない分）は含めない
+- transitions       : 有効行どうしのステージの切り替わり回数
+- signal_coverage   : signal >= MIN_QUALITY だった時間の割合
+- eog_on_fraction   : eog_on だった時間の割合
+"""
+import json, os
+from typing import Dict, Iterable, Optional
+
+from sleep_engine import STAGES, HOP_SEC, MIN_QUALITY
+
+SUMMARY_SUFFIX = ".summary.json"
+SLEEP_STAGES = tuple(s for s in STAGES if s != "Wake")
+
+
+class SessionSummary:
+    def __init__(self, hop_sec: float = HOP_SEC):
+        self.hop_sec = hop_sec
+        self.n_rows = 0
+        self.first_t: Optional[float] = None
+        self.last_t: Optional[float] = None
+        self.stage_sec = {s: 0.0 for s in STAGES}
+        self.poor_quality_sec = 0.0
+        self.onset_t: Optional[float] = None
+        self.first_rem_t: Optional[float] = None
+        self.transitions = 0
+        self.waso_sec = 0.0
+        self._wake_pending = 0.0    # 入眠後、最後に眠っていた時点からの Wake（眠りに戻ったら WASO に入れる）
+        self._last_stage: Optional[str] = None
+        self._total_sec = 0.0
+        self._signal_ok_sec = 0.0
+        self._eog_on_sec = 0.0
+
+    def add(self, t: float, stage: Optional[str], signal: float = 1.0, eog_on: float = 0.0):
+        """1行追加。stage が None/空は品質不足の行"""
+        self.n_rows += 1
+        if self.first_t is None:
+            self.first_t = t
+            dt = self.hop_sec
+        else:
+            dt = min(max(t - self.last_t, 0.0), self.hop_sec)
+        self.last_t = t
+        self._total_sec += dt
+        if signal >= MIN_QUALITY:
+            self._signal_ok_sec += dt
+        if eog_on >= 0.5:
+            self._eog_on_sec += dt
+
+        if not stage:
+            self.poor_quality_sec += dt
+            return
+        self.stage_sec[stage] = self.stage_sec.get(stage, 0.0) + dt
+        if self._last_stage is not None and stage != self._last_stage:
+            self.transitions += 1
+        self._last_stage = stage
+
+        if stage in SLEEP_STAGES:
+            if self.onset_t is None:
+                self.onset_t = t
+            self.waso_sec += self._wake_pending
+            self._wake_pending = 0.0
+            if stage == "REM_candidate" and self.first_rem_t is None:
+                self.first_rem_t = t
+        elif stage == "Wake" and self.onset_t is not None:
+            self._wake_pending += dt
+
+    def add_row(self, r: Dict):
+        """SleepEngine.step() の行を追加"""
+        self.add(r['t'], r.get('stage'), float(r.get('signal', 1.0)), float(r.get('eog_on', 0.0)))
+
+    def to_dict(self) -> Dict:
+        n = self.n_rows
+        tst = sum(self.stage_sec[s] for s in SLEEP_STAGES)
+        total = self._total_sec
+        return {
+            "rows": n,
+            "first_t": self.first_t,
+            "last_t": self.last_t,
+            "stage_sec": {k: round(v, 3) for k, v in self.stage_sec.items()},
+            "poor_quality_sec": round(self.poor_quality_sec, 3),
+            "total_sleep_sec": round(tst, 3),
+            "sleep_efficiency": round(tst / total, 4) if total > 0 else 0.0,
+            "onset_latency_sec": self.onset_t,
+            "rem_latency_sec": (self.first_rem_t - self.onset_t) if self.first_rem_t is not None else None,
+            "waso_sec": round(self.waso_sec, 3),
+            "transitions": self.transitions,
+            "signal_coverage": round(self._signal_ok_sec / total, 4) if total > 0 else 0.0,
+            "eog_on_fraction": round(self._eog_on_sec / total, 4) if total > 0 else 0.0,
+        }
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+
+def summary_path(csv_path: str) -> str:
+    return csv_path + SUMMARY_SUFFIX
+
+
+def summarize_rows(rows: Iterable[Dict]) -> Dict:
+    """/api/series 形式の行（time は相対秒、stage は空文字で品質不足）から作り直す"""
+    s = SessionSummary()
+    for r in rows:
+        s.add(r['time'], r.get('stage') or None, float(r.get('signal') or 0.0), float(r.get('eog_on') or 0.0))
+    return s.to_dict()
+
+
+def load_summary(csv_path: str) -> Optional[Dict]:
+    try:
+        with open(summary_path(csv_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
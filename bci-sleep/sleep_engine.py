@@ -1,32 +1,315 @@
 # sleep_engine.py
-import time, math
-from collections import deque, defaultdict
+import time, math, bisect
+from collections import defaultdict
 from typing import List, Dict, Tuple, Optional
 
+import numpy as np
+
+from eog_dsp import SaccadeDetector, PolyphaseDecimator
+
 EPOCH_SEC = 30      # 30秒で特徴量要約
 HOP_SEC = 5         # 5秒ごとに更新
 MIN_QUALITY = 0.3   # dev.signal の最低ライン
+RESYNC_EVERY = 4096 # 増分集計の丸め誤差をリセットする push 間隔
 
 STAGES = ["Wake", "Light_NREM_candidate", "REM_candidate", "Deep_candidate"]
 
+# fac スコアのバケット境界: [<0.3, 0.3-1.0(weak), 1.0-2.0(facial), >=2.0(eye)]
+FAC_BUCKET_EDGES = (0.3, 1.0, 2.0)
+FAC_BUCKET_WEIGHTS = (0.0, 0.3, 0.6, 1.0)
+
+# pow ラベル "<channel>/<band>" のバンド・部位の分類
+BAND_THETA, BAND_ALPHA, BAND_BETA, BAND_OTHER = range(4)
+N_BANDS = 4
+REGIONS = ("frontal", "temporal", "occipital")
+
+def _channel_region(ch: str) -> Optional[str]:
+    """10-20 法の電極名から部位を返す（frontal/temporal/occipital 以外は None）"""
+    head = ch.rstrip("0123456789zZ").upper()
+    if head in ("FT", "TP", "T"):
+        return "temporal"
+    if head in ("O", "PO"):
+        return "occipital"
+    if head in ("F", "AF", "FC", "FP"):
+        return "frontal"
+    return None
+
 class Ring:
-    def __init__(self, seconds: int):
+    """
+    時間窓つきリングバッファ（NumPy 配列で事前確保）。
+    タイムスタンプ列と値ブロック（スカラーなら1次元、ベクトルなら2次元）を
+    連続領域 [start:end] に保持するので、values()/times() はコピーなしのビューを返す。
+    古いサンプルの削除は searchsorted による二分探索（タイムスタンプは単調増加を前提）。
+    返したビューは次の push までの間だけ有効。
+    aggregators には push/evict で更新される増分集計（RunningMoments など）を渡す。
+    """
+    def __init__(self, seconds: int, capacity: int = 256, aggregators=()):
         self.seconds = seconds
-        self.buf = deque()  # (t, value)
+        self._cap = max(8, int(capacity))
+        self._t = np.empty(self._cap, dtype=np.float64)
+        self._v = None          # 最初の push で値の shape を決めて確保
+        self._shape = None
+        self._start = 0
+        self._end = 0
+        self.aggregators = list(aggregators)
+        self._since_resync = 0
 
     def push(self, t: float, v):
-        self.buf.append((t, v))
+        shape = np.shape(v)
+        if shape != self._shape:
+            self._alloc(shape)
+        if self._end == self._cap:
+            self._make_room(1)
+        i = self._end
+        self._t[i] = t
+        self._v[i] = v
+        self._end = i + 1
+        for agg in self.aggregators:
+            agg.push(v)
         self._trim(t)
+        self._since_resync += 1
+        if self._since_resync >= RESYNC_EVERY:
+            self._resync()
+
+    def _resync(self):
+        self._since_resync = 0
+        vals = self.values()
+        for agg in self.aggregators:
+            agg.resync(vals)
+
+    def extend(self, ts, vs):
+        """
+        複数サンプルをまとめて追加（時刻昇順）。古いサンプルの削除は最後に1回だけ行い、
+        結果は push を1個ずつ呼んだ場合と同じ窓になる。
+        """
+        ts = np.asarray(ts, dtype=np.float64)
+        vs = np.asarray(vs, dtype=np.float64)
+        n = len(ts)
+        if n == 0:
+            return
+        shape = vs.shape[1:]
+        if shape != self._shape:
+            self._alloc(shape)
+        if self._end + n > self._cap:
+            self._make_room(n)
+        i = self._end
+        self._t[i:i + n] = ts
+        self._v[i:i + n] = vs
+        self._end = i + n
+        for agg in self.aggregators:
+            agg.push_many(vs)
+        self._trim(float(ts[-1]))
+        self._since_resync += n
+        if self._since_resync >= RESYNC_EVERY:
+            self._resync()
+
+    def _alloc(self, shape):
+        # 値の次元が変わった（pow ラベルの変更など）ときは古い窓を捨てて確保し直す
+        self._shape = shape
+        self._v = np.empty((self._cap,) + shape, dtype=np.float64)
+        self._start = self._end = 0
+        for agg in self.aggregators:
+            agg.reset()
+
+    def _make_room(self, n: int):
+        live = self._end - self._start
+        if live + n > self._cap // 2:
+            # 窓に対して容量が小さい → 倍々で拡張（償却 O(1)）
+            cap = self._cap
+            while live + n > cap // 2:
+                cap *= 2
+            t = np.empty(cap, dtype=np.float64)
+            v = np.empty((cap,) + self._shape, dtype=np.float64)
+            t[:live] = self._t[self._start:self._end]
+            v[:live] = self._v[self._start:self._end]
+            self._t, self._v, self._cap = t, v, cap
+        else:
+            # 生きている区間を先頭へ詰め直す
+            self._t[:live] = self._t[self._start:self._end]
+            self._v[:live] = self._v[self._start:self._end]
+        self._start, self._end = 0, live
 
     def _trim(self, now: float):
-        while self.buf and now - self.buf[0][0] > self.seconds:
-            self.buf.popleft()
+        cut = now - self.seconds
+        if self._start == self._end or self._t[self._start] >= cut:
+            return
+        k = int(np.searchsorted(self._t[self._start:self._end], cut, side="left"))
+        if self.aggregators:
+            evicted = self._v[self._start:self._start + k]
+            for agg in self.aggregators:
+                agg.evict(evicted)
+        self._start += k
 
     def values(self):
-        return [v for _, v in self.buf]
+        if self._v is None:
+            return np.empty(0, dtype=np.float64)
+        return self._v[self._start:self._end]
+
+    def times(self):
+        return self._t[self._start:self._end]
+
+    def last_time(self) -> float:
+        return float(self._t[self._end - 1]) if self._end > self._start else 0.0
+
+    def clear(self):
+        self._start = self._end = 0
+        for agg in self.aggregators:
+            agg.reset()
 
     def empty(self):
-        return len(self.buf) == 0
+        return self._end == self._start
+
+    def __len__(self):
+        return self._end - self._start
+
+class RunningMoments:
+    """
+    窓内の件数・合計・二乗和を push/evict で増分更新し、平均と分散を O(1) で返す。
+    ベクトル値なら列ごとに集計する。桁落ちを避けるため最初の値（resync 時は平均）を
+    原点にずらして積算し、Ring から定期的に resync される。
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self._shift = 0.0
+        self._s = 0.0
+        self._ss = 0.0
+
+    def push(self, v):
+        if self.n == 0:
+            self._shift = np.array(v, dtype=np.float64) if np.ndim(v) else float(v)
+            self._s = self._ss = self._shift * 0.0
+        d = v - self._shift
+        self._s = self._s + d
+        self._ss = self._ss + d * d
+        self.n += 1
+
+    def push_many(self, block):
+        if len(block) == 0:
+            return
+        if self.n == 0:
+            self._shift = block[0].copy() if block.ndim > 1 else float(block[0])
+            self._s = self._ss = self._shift * 0.0
+        d = block - self._shift
+        self._s = self._s + d.sum(axis=0)
+        self._ss = self._ss + (d * d).sum(axis=0)
+        self.n += len(block)
+
+    def evict(self, block):
+        k = len(block)
+        if k == 0:
+            return
+        self.n -= k
+        if self.n <= 0:
+            self.reset()
+            return
+        d = block - self._shift
+        self._s = self._s - d.sum(axis=0)
+        self._ss = self._ss - (d * d).sum(axis=0)
+
+    def resync(self, vals):
+        self.reset()
+        if len(vals) == 0:
+            return
+        self._shift = vals.mean(axis=0)
+        d = vals - self._shift
+        self.n = len(vals)
+        self._s = d.sum(axis=0)
+        self._ss = (d * d).sum(axis=0)
+
+    def mean(self):
+        if self.n == 0:
+            return 0.0
+        return self._shift + self._s / self.n
+
+    def var(self):
+        if self.n == 0:
+            return 0.0
+        m = self._s / self.n
+        return np.maximum(self._ss / self.n - m * m, 0.0)
+
+
+class BucketCounter:
+    """
+    スカラー値を edges で区切ったバケットごとに数える。
+    バケット i は edges[i-1] <= v < edges[i]（両端は開区間）。
+    """
+    def __init__(self, edges):
+        self.edges = list(edges)
+        self._edges = np.asarray(self.edges, dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        self.n = 0
+        self.counts = [0] * (len(self.edges) + 1)
+
+    def push(self, v):
+        self.counts[bisect.bisect_right(self.edges, v)] += 1
+        self.n += 1
+
+    def push_many(self, block):
+        if len(block) == 0:
+            return
+        idx = np.searchsorted(self._edges, block, side="right")
+        for i, c in enumerate(np.bincount(idx, minlength=len(self.counts)).tolist()):
+            self.counts[i] += c
+        self.n += len(block)
+
+    def evict(self, block):
+        if len(block) == 0:
+            return
+        idx = np.searchsorted(self._edges, block, side="right")
+        for i, c in enumerate(np.bincount(idx, minlength=len(self.counts)).tolist()):
+            self.counts[i] -= c
+        self.n -= len(block)
+
+    def resync(self, vals):
+        self.reset()
+        for v in vals.tolist():
+            self.push(v)
+
+
+class SortedWindow:
+    """
+    窓内のスカラー値を bisect で並べ替え済みに保つ順序統計（中央値用）。
+    挿入・削除は二分探索＋memmove なので、窓サイズ数千程度なら全ソートより十分速い。
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._s = []
+
+    def push(self, v):
+        bisect.insort(self._s, float(v))
+
+    def push_many(self, block):
+        if len(block) < 16:
+            for v in block.tolist():
+                bisect.insort(self._s, v)
+        else:
+            # まとまった量は末尾に足して並べ直す（timsort が既存の整列区間を活かす）
+            self._s.extend(block.tolist())
+            self._s.sort()
+
+    def evict(self, block):
+        s = self._s
+        for v in block.tolist():
+            i = bisect.bisect_left(s, v)
+            if i < len(s) and s[i] == v:
+                del s[i]
+
+    def resync(self, vals):
+        self._s = sorted(vals.tolist())
+
+    def median(self) -> float:
+        s = self._s; n = len(s)
+        if n == 0:
+            return 0.0
+        return s[n//2] if n % 2 else 0.5*(s[n//2-1] + s[n//2])
+
 
 class SleepEngine:
     """
@@ -36,14 +319,20 @@ class SleepEngine:
     """
     def __init__(self):
         self.pow_labels: List[str] = []
-        self.theta_idx: List[int] = []
-        self.alpha_idx: List[int] = []
-        self.beta_idx:  List[int] = []  # betaL + betaH
+        self.pow_channels: List[str] = []
+        self.set_pow_labels([])
+        self.channel_theta_alpha = np.zeros(0)  # 直近エポックのチャネル別 θ/α
+
+        # 窓内の統計は push/evict で増分更新（hop ごとの全再計算をしない）
+        self.pow_stats = RunningMoments()
+        self.mot_stats = SortedWindow()
+        self.fac_stats = BucketCounter(FAC_BUCKET_EDGES)
+        self.eog_stats = RunningMoments()
 
-        self.pow_ring = Ring(EPOCH_SEC)
-        self.mot_ring = Ring(EPOCH_SEC)
-        self.fac_ring = Ring(EPOCH_SEC)
-        self.eog_ring = Ring(EPOCH_SEC)
+        self.pow_ring = Ring(EPOCH_SEC, aggregators=[self.pow_stats])
+        self.mot_ring = Ring(EPOCH_SEC, capacity=4096, aggregators=[self.mot_stats])
+        self.fac_ring = Ring(EPOCH_SEC, aggregators=[self.fac_stats])
+        self.eog_ring = Ring(EPOCH_SEC, capacity=4096, aggregators=[self.eog_stats])
 
         self.dev_signal = 1.0
         self.last_epoch_time = 0.0
@@ -51,8 +340,10 @@ class SleepEngine:
         self.hold_until = 0.0
         self.hold_min_sec = 20.0
 
-        self._eog_decim = 0
         self._eog_fs_target = 50.0
+        self._eog_resampler: Optional[PolyphaseDecimator] = None
+        self._eog_pending = 0
+        self.saccades = SaccadeDetector(fs=self._eog_fs_target, window_sec=EPOCH_SEC)
         self.eog_last_ts = 0.0
         self.eog_available_window_sec = 10.0
         self.prev_eog_available = None
@@ -61,15 +352,48 @@ class SleepEngine:
 
     # ------- ラベル処理 -------
     def set_pow_labels(self, labels: List[str]):
+        """
+        ラベル列を一度だけ解析し、列ごとのバンド ID・チャネル ID と
+        部位（frontal/temporal/occipital）への割り当てを配列にしておく。
+        以降のエポックはこれを使った bincount 1回でバンド平均を求める。
+        """
         self.pow_labels = labels
-        self.theta_idx, self.alpha_idx, self.beta_idx = [], [], []
-        for i, lab in enumerate(labels):
-            if lab.endswith("/theta"):
-                self.theta_idx.append(i)
-            elif lab.endswith("/alpha"):
-                self.alpha_idx.append(i)
-            elif lab.endswith("/betaL") or lab.endswith("/betaH"):
-                self.beta_idx.append(i)
+        channels: List[str] = []
+        band_id, chan_id = [], []
+        for lab in labels:
+            ch, _, band = lab.rpartition("/")
+            if band == "theta":
+                band_id.append(BAND_THETA)
+            elif band == "alpha":
+                band_id.append(BAND_ALPHA)
+            elif band in ("betaL", "betaH"):
+                band_id.append(BAND_BETA)
+            else:
+                band_id.append(BAND_OTHER)
+            if ch not in channels:
+                channels.append(ch)
+            chan_id.append(channels.index(ch))
+        self.pow_channels = channels
+
+        self._band_id = np.asarray(band_id, dtype=np.intp)
+        self.theta_mask = self._band_id == BAND_THETA
+        self.alpha_mask = self._band_id == BAND_ALPHA
+        self.beta_mask = self._band_id == BAND_BETA
+        self.theta_idx = np.flatnonzero(self.theta_mask)
+        self.alpha_idx = np.flatnonzero(self.alpha_mask)
+        self.beta_idx = np.flatnonzero(self.beta_mask)  # betaL + betaH
+
+        # (channel, band) の平坦化インデックスと各セルの列数
+        self._cb_id = np.asarray(chan_id, dtype=np.intp) * N_BANDS + self._band_id
+        self._cb_size = len(channels) * N_BANDS
+        self._cb_count = np.bincount(self._cb_id, minlength=self._cb_size).reshape(-1, N_BANDS)
+
+        # 部位 × チャネルの 0/1 行列（どの部位にも入らないチャネルは全て 0）
+        self._region_mat = np.zeros((len(REGIONS), len(channels)))
+        for j, ch in enumerate(channels):
+            r = _channel_region(ch)
+            if r is not None:
+                self._region_mat[REGIONS.index(r), j] = 1.0
 
     # ------- ストリーム入力 -------
     def on_pow(self, t: float, vec: List[float], consider_missing_zero: bool = True):
@@ -122,76 +446,129 @@ class SleepEngine:
         
         self.fac_ring.push(t, activity_score)
 
+    def _eog_decimator(self, src_fs: float) -> PolyphaseDecimator:
+        # 入力レートが変わったときだけフィルタを作り直す（状態は呼び出し間で保持）
+        r = self._eog_resampler
+        if r is None or r.fs_in != float(src_fs):
+            r = self._eog_resampler = PolyphaseDecimator(src_fs, self._eog_fs_target)
+        return r
+
+    def _push_eog(self, ts, vs):
+        self.eog_ring.extend(ts, vs)
+        self._eog_pending += len(vs)
+
     def on_eog_sample(self, t: float, v: float, src_fs_hint: float = 200.0):
-        self._eog_decim += 1
-        decim = max(1, int(src_fs_hint / self._eog_fs_target))
-        if (self._eog_decim % decim) != 0:
-            return
-        self.eog_ring.push(t, float(v))
+        ts, vs = self._eog_decimator(src_fs_hint).push(t, float(v))
+        if len(vs):
+            self._push_eog(ts, vs)
         self.eog_last_ts = t
 
+    # ------- バッチ入力（CSV リプレイやキューの一括ドレイン用） -------
+    def on_pow_batch(self, ts, mat, consider_missing_zero: bool = True):
+        """
+        pow を複数行まとめて追加。ts は (n,)、mat は (n, ラベル数)。
+        on_pow を1行ずつ呼んだ場合と同じ結果になる（全ゼロ行は捨てる）。
+        """
+        ts = np.asarray(ts, dtype=np.float64)
+        mat = np.asarray(mat, dtype=np.float64)
+        if consider_missing_zero and len(mat):
+            keep = np.any(mat != 0, axis=1)
+            ts, mat = ts[keep], mat[keep]
+        self.pow_ring.extend(ts, mat)
+
+    def on_mot_batch(self, ts, mot_mat):
+        """mot を複数行まとめて追加。加速度 (ACCX, ACCY, ACCZ) の RMS を一括計算する"""
+        ts = np.asarray(ts, dtype=np.float64)
+        mot = np.asarray(mot_mat, dtype=np.float64)
+        if mot.ndim == 2 and mot.shape[1] >= 12:
+            acc = mot[:, 9:12]
+            rms = (acc * acc).sum(axis=1) ** 0.5
+        else:
+            rms = np.zeros(len(ts))
+        self.mot_ring.extend(ts, rms)
+
+    def on_eog_block(self, ts, vs, src_fs_hint: float = 200.0):
+        """EOG の生サンプル列をまとめて追加（on_eog_sample と同じリサンプラを通す）"""
+        ts = np.asarray(ts, dtype=np.float64)
+        if len(ts) == 0:
+            return
+        out_t, out_v = self._eog_decimator(src_fs_hint).process(ts, vs)
+        if len(out_v):
+            self._push_eog(out_t, out_v)
+        self.eog_last_ts = float(ts[-1])
+
     def eog_available(self, now: float) -> bool:
         return (self.eog_last_ts > 0.0) and ((now - self.eog_last_ts) <= self.eog_available_window_sec)
 
     # ------- 特徴量 -------
-    def _mean(self, xs): return sum(xs) / len(xs) if xs else 0.0
-    def _median(self, xs):
-        if not xs: return 0.0
-        s = sorted(xs); n = len(s)
-        return s[n//2] if n % 2 else 0.5*(s[n//2-1] + s[n//2])
-    def _var(self, xs):
-        if not xs: return 0.0
-        m = self._mean(xs)
-        return sum((x-m)*(x-m) for x in xs)/len(xs)
-
-    def _theta_alpha_ratio(self, vec):
-        if not self.theta_idx or not self.alpha_idx: return 0.0
-        th = self._mean([vec[i] for i in self.theta_idx if i < len(vec)])
-        al = self._mean([vec[i] for i in self.alpha_idx if i < len(vec)])
-        return (th / max(al, 1e-9)) if al > 0 else 0.0
-
-    def _beta_rel(self, vec):
-        if not self.beta_idx: return 0.0
-        bt = self._mean([vec[i] for i in self.beta_idx if i < len(vec)])
-        total = self._mean(vec) if vec else 1.0
-        return bt / max(total, 1e-9)
-
-    def _eog_saccade_rate(self, xs, fs=50.0):
-        if len(xs) < 5: return 0.0
-        diffs = [abs(xs[i]-xs[i-1]) for i in range(1, len(xs))]
-        m = self._mean(diffs)
-        sd = (self._mean([(d-m)*(d-m) for d in diffs]))**0.5
-        if sd < 1e-9: return 0.0
-        thr = m + 2.5*sd
-        events, i = 0, 0
-        while i < len(diffs):
-            if diffs[i] > thr:
-                events += 1
-                i += int(0.1 * fs)  # 100msリフラクトリ
-            else:
-                i += 1
-        return events / (len(xs)/fs)
+    @staticmethod
+    def _ratio(th, al):
+        # θ/α（α が 0 なら 0）。配列にも要素ごとに効く
+        return np.where(al > 0, th / np.maximum(al, 1e-9), 0.0)
 
-    def _calculate_fac_activity_rate(self, fac_vals):
+    def _band_features(self, vec) -> Dict[str, float]:
+        """
+        エポック平均ベクトルから θ/α・β相対量を求める。(channel, band) ごとの合計を
+        bincount 1回で出し、そこからチャネル別・部位別の θ/α も追加コストなしで得る。
+        """
+        vec = np.asarray(vec, dtype=np.float64)
+        n = min(len(vec), len(self._cb_id))
+        if n == len(self._cb_id):
+            cnt = self._cb_count
+        else:
+            cnt = np.bincount(self._cb_id[:n], minlength=self._cb_size).reshape(-1, N_BANDS)
+        cb = np.bincount(self._cb_id[:n], weights=vec[:n], minlength=self._cb_size).reshape(-1, N_BANDS)
+
+        band_sum, band_cnt = cb.sum(axis=0), cnt.sum(axis=0)
+        band_mean = band_sum / np.maximum(band_cnt, 1)
+        th, al, bt = band_mean[BAND_THETA], band_mean[BAND_ALPHA], band_mean[BAND_BETA]
+
+        theta_alpha = float(self._ratio(th, al)) if len(self.theta_idx) and len(self.alpha_idx) else 0.0
+        if len(self.beta_idx):
+            total = float(vec.mean()) if len(vec) else 1.0
+            beta_rel = bt / max(total, 1e-9)
+        else:
+            beta_rel = 0.0
+
+        ch_mean = cb / np.maximum(cnt, 1)
+        self.channel_theta_alpha = self._ratio(ch_mean[:, BAND_THETA], ch_mean[:, BAND_ALPHA])
+        reg_sum = self._region_mat @ cb
+        reg_mean = reg_sum / np.maximum(self._region_mat @ cnt, 1)
+        reg_ratio = self._ratio(reg_mean[:, BAND_THETA], reg_mean[:, BAND_ALPHA])
+
+        f = {"theta_alpha": theta_alpha, "beta_rel": float(beta_rel)}
+        for name, r in zip(REGIONS, reg_ratio.tolist()):
+            f[f"theta_alpha_{name}"] = r
+        return f
+
+    def _feed_saccades(self):
+        # push() で貯まっている EOG をリサンプラから吐き出させ、1サンプル入力でも
+        # ブロック入力でも同じ窓で特徴量を計算する
+        if self._eog_resampler is not None:
+            ts, vs = self._eog_resampler.process((), ())
+            if len(vs):
+                self._push_eog(ts, vs)
+        # 前回の step 以降に届いた EOG だけを検出器に渡す（窓全体は見直さない）
+        n = min(self._eog_pending, len(self.eog_ring))
+        self._eog_pending = 0
+        if n > 0:
+            self.saccades.update(self.eog_ring.times()[-n:], self.eog_ring.values()[-n:])
+
+    def _calculate_fac_activity_rate(self, counter: BucketCounter):
         """
         Calculate facial activity rate with weighted scoring
         Returns normalized activity rate between 0.0 and 1.0
         """
-        if not fac_vals:
+        if counter.n <= 0:
             return 0.0
         
-        # Count different activity levels
-        high_activity = sum(1 for v in fac_vals if v >= 2.0)  # Eye movements
-        medium_activity = sum(1 for v in fac_vals if 1.0 <= v < 2.0)  # Facial expressions
-        low_activity = sum(1 for v in fac_vals if 0.3 <= v < 1.0)  # Weak activity
+        # Weighted calculation over the bucket counts
+        # (eye movements 1.0, facial expressions 0.6, weak activity 0.3)
+        weighted_score = sum(c * w for c, w in zip(counter.counts, FAC_BUCKET_WEIGHTS))
         
-        # Weighted calculation
-        total_samples = len(fac_vals)
-        weighted_score = (high_activity * 1.0 + medium_activity * 0.6 + low_activity * 0.3)
-        
-        return min(1.0, weighted_score / total_samples)
+        return min(1.0, weighted_score / counter.n)
 
-    def _is_fac_stream_active(self) -> bool:
+    def _is_fac_stream_active(self, now: float) -> bool:
         """
         Check if facial expression stream is actively providing data
         """
@@ -199,55 +576,47 @@ class SleepEngine:
             return False
         
         # Check if we have recent facial expression data (within last 10 seconds)
-        recent_data = [v for t, v in self.fac_ring.buf if time.time() - t <= 10.0]
-        return len(recent_data) > 0
-
-    def _epoch_features(self) -> Dict[str, float]:
-        pow_vals = self.pow_ring.values()
-        mot_vals = self.mot_ring.values()
-        fac_vals = self.fac_ring.values()
-        now = time.time()
-        if not pow_vals or not mot_vals:
-            return {}
+        return now - self.fac_ring.last_time() <= 10.0
 
-        vec_len = len(pow_vals[0])
-        ave_vec = [0.0] * vec_len
-        for v in pow_vals:
-            for i in range(min(vec_len, len(v))):
-                ave_vec[i] += v[i]
-        ave_vec = [x / len(pow_vals) for x in ave_vec]
+    def _epoch_features(self, now: float) -> Dict[str, float]:
+        # now はサンプルと同じ時間軸（step に渡された時刻）。壁時計は使わないので
+        # 記録データのリプレイでもライブと同じ行になる
+        if self.pow_ring.empty() or self.mot_ring.empty():
+            return {}
 
-        theta_alpha = self._theta_alpha_ratio(ave_vec)
-        beta_rel = self._beta_rel(ave_vec)
-        motion_rms = self._median(mot_vals)
+        band = self._band_features(self.pow_stats.mean())
+        motion_rms = self.mot_stats.median()
         # Enhanced facial activity rate calculation
-        fac_rate = self._calculate_fac_activity_rate(fac_vals)
+        fac_rate = self._calculate_fac_activity_rate(self.fac_stats)
 
         eog_on = self.eog_available(now)
-        eog_vals = self.eog_ring.values()
-        if eog_on and eog_vals:
-            eog_var = self._var(eog_vals)
-            eog_sacc = self._eog_saccade_rate(eog_vals, fs=self._eog_fs_target)
+        self._feed_saccades()
+        if eog_on and len(self.eog_ring) >= 5:
+            eog_var = float(self.eog_stats.var())
+            sacc = self.saccades.stats(self.eog_ring.last_time(),
+                                       len(self.eog_ring) / self._eog_fs_target)
         else:
             eog_var = 0.0
-            eog_sacc = 0.0
+            sacc = {"rate": 0.0, "count": 0.0, "amp": 0.0, "dir": 0.0}
 
         if self.prev_eog_available is None or self.prev_eog_available != eog_on:
             print(f"[INFO] EOG availability changed: {self.prev_eog_available} -> {eog_on}")
             self.prev_eog_available = eog_on
 
         # Check facial expression stream status
-        fac_active = self._is_fac_stream_active()
+        fac_active = self._is_fac_stream_active(now)
 
         return {
-            "theta_alpha": theta_alpha,
-            "beta_rel": beta_rel,
+            **band,
             "motion_rms": motion_rms,
             "fac_rate": fac_rate,
             "fac_active": 1.0 if fac_active else 0.0,
             "signal": self.dev_signal,
             "eog_var": eog_var,
-            "eog_sacc": eog_sacc,
+            "eog_sacc": sacc["rate"],
+            "eog_sacc_n": sacc["count"],
+            "eog_sacc_amp": sacc["amp"],
+            "eog_sacc_dir": sacc["dir"],
             "eog_on": 1.0 if eog_on else 0.0
         }
 
@@ -326,15 +695,17 @@ class SleepEngine:
             return {
                 "t": now, "stage": None, "confidence": 0.0,
                 "theta_alpha": 0.0, "beta_rel": 0.0,
+                **{f"theta_alpha_{name}": 0.0 for name in REGIONS},
                 "motion_rms": 0.0, "fac_rate": 0.0, "fac_active": 0.0,
-                "signal": self.dev_signal, "eog_var": 0.0,
-                "eog_sacc": 0.0, "eog_on": 0.0, "note": "poor_quality"
+                "signal": round(self.dev_signal, 4), "eog_var": 0.0,
+                "eog_sacc": 0.0, "eog_sacc_n": 0.0, "eog_sacc_amp": 0.0, "eog_sacc_dir": 0.0,
+                "eog_on": 0.0, "note": "poor_quality"
             }
         if now - self.last_epoch_time < HOP_SEC:
             return None
         self.last_epoch_time = now
 
-        f = self._epoch_features()
+        f = self._epoch_features(now)
         if not f:
             return None
         raw_stage, conf = self._raw_stage(f)
@@ -347,3 +718,15 @@ class SleepEngine:
         }
         self.rows.append(row)
         return row
+
+
+# SleepApp が書き出す派生行 CSV の列と1行分の整形（リプレイ/サーバと共通）
+CSV_HEADER = ["time", "stage", "confidence", "theta_alpha", "beta_rel", "motion_rms",
+              "fac_rate", "fac_active", "signal", "eog_on", "eog_sacc"]
+
+def csv_row(r: Dict) -> List:
+    return [
+        round(r['t'], 1), r['stage'] or "", r['confidence'],
+        r['theta_alpha'], r['beta_rel'], r['motion_rms'],
+        r['fac_rate'], r.get('fac_active', 0.0), r['signal'], r.get('eog_on', 0.0), r.get('eog_sacc', 0.0)
+    ]
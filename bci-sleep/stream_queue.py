@@ -0,0 +1,170 @@
+# stream_queue.py
+"""
+websocket の受信スレッドと、特徴量計算・ファイル書き込みをするワーカースレッドの間の有限キュー。
+受信側は put() するだけで決して待たない。溢れたときの扱いはストリームごとに決める:
+
+- KEEP     : なるべく捨てない（pow、セッション開始などの制御メッセージ）。maxsize を超えても入れて
+             overflow に数えるが、hard_cap（既定 4*maxsize）に達したら警告を出し、いちばん古いものを捨てる
+- COALESCE : 未処理のものがあれば、その位置のまま中身を最新に置き換える（dev）。キューに1件しか
+             持たないので、満杯でも最新のものは入れる
+- DROP     : 満杯なら新しく来たものを捨てる（mot, fac。policies に無いストリームもこれ）
+
+  q = StreamQueue(maxsize=2048, policies={"pow": KEEP, "dev": COALESCE})
+  q.put("pow", data)                    # 受信スレッド
+  for stream, data in q.get_batch():    # ワーカースレッド
+      ...
+"""
+import threading, time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+KEEP = "keep"
+COALESCE = "coalesce"
+DROP = "drop"
+
+DEFAULT_POLICIES = {"pow": KEEP, "dev": COALESCE, "mot": DROP, "fac": DROP}
+
+
+class StreamQueue:
+    def __init__(self, maxsize: int = 2048, policies: Optional[Dict[str, str]] = None,
+                 default_policy: str = DROP, hard_cap: Optional[int] = None):
+        self.maxsize = maxsize
+        self.hard_cap = hard_cap if hard_cap is not None else 4 * maxsize
+        self.policies = dict(DEFAULT_POLICIES if policies is None else policies)
+        self.default_policy = default_policy
+        self._q: deque = deque()
+        self._pending: Dict[str, list] = {}    # COALESCE: ストリーム -> キュー内の未処理エントリ
+        self._cond = threading.Condition()
+        self._closed = False
+        self.max_depth = 0
+        self.enqueued: Dict[str, int] = {}
+        self.dropped: Dict[str, int] = {}
+        self.coalesced: Dict[str, int] = {}
+        self.overflow = 0
+        self._capped = False    # hard_cap に達して古いものを捨てている（警告は1回）
+
+    def put(self, stream: str, item: Any) -> bool:
+        """入れられた（または置き換えた）ら True、捨てたら False。待たない"""
+        policy = self.policies.get(stream, self.default_policy)
+        with self._cond:
+            if self._closed:
+                return False
+            if policy == COALESCE:
+                entry = self._pending.get(stream)
+                if entry is not None:
+                    entry[1] = item
+                    self.coalesced[stream] = self.coalesced.get(stream, 0) + 1
+                    return True
+            full = len(self._q) >= self.maxsize
+            if full and policy == DROP:
+                self.dropped[stream] = self.dropped.get(stream, 0) + 1
+                return False
+            if full:
+                self.overflow += 1
+                if len(self._q) >= self.hard_cap:
+                    self._drop_oldest()
+            entry = [stream, item]
+            self._q.append(entry)
+            if policy == COALESCE:
+                self._pending[stream] = entry
+            self.enqueued[stream] = self.enqueued.get(stream, 0) + 1
+            if len(self._q) > self.max_depth:
+                self.max_depth = len(self._q)
+            self._cond.notify()
+            return True
+
+    def _drop_oldest(self):
+        if not self._capped:
+            self._capped = True
+            print(f"[WARN] stream queue reached {self.hard_cap} items; dropping oldest")
+        old = self._q.popleft()
+        if self._pending.get(old[0]) is old:
+            del self._pending[old[0]]
+        self.dropped[old[0]] = self.dropped.get(old[0], 0) + 1
+
+    def get_batch(self, max_items: int = 256, timeout: Optional[float] = None) -> List[Tuple[str, Any]]:
+        """溜まっている分を受信順に最大 max_items 件取り出す（空なら timeout まで待つ。閉じたら空リスト）"""
+        with self._cond:
+            if not self._q and not self._closed:
+                self._cond.wait(timeout)
+            out = []
+            while self._q and len(out) < max_items:
+                entry = self._q.popleft()
+                stream = entry[0]
+                if self._pending.get(stream) is entry:
+                    del self._pending[stream]
+                out.append((stream, entry[1]))
+            if self._capped and len(self._q) < self.maxsize:
+                self._capped = False
+            return out
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def __len__(self):
+        return len(self._q)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {"depth": len(self._q), "max_depth": self.max_depth, "overflow": self.overflow,
+                    "enqueued": dict(self.enqueued), "dropped": dict(self.dropped),
+                    "coalesced": dict(self.coalesced)}
+
+    def format_stats(self) -> str:
+        s = self.stats()
+        dropped = ", ".join(f"{k}={v}" for k, v in sorted(s["dropped"].items())) or "none"
+        coalesced = ", ".join(f"{k}={v}" for k, v in sorted(s["coalesced"].items())) or "none"
+        return (f"depth={s['depth']} (max {s['max_depth']}), dropped: {dropped}, "
+                f"coalesced: {coalesced}, overflow={s['overflow']}")
+
+
+class StreamWorker:
+    """
+    StreamQueue を別スレッドで処理する。handlers[stream](item) を受信順に呼び、
+    バッチごと（データが無くても1秒ごと）に idle() を呼ぶ。
+    """
+    def __init__(self, queue: StreamQueue, handlers: Dict[str, Callable[[Any], Any]],
+                 name: str = "StreamWorker", stats_sec: float = 60.0, idle: Optional[Callable[[], Any]] = None):
+        self.q = queue
+        self.handlers = handlers
+        self.idle = idle
+        self.stats_sec = stats_sec
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout: float = 5.0):
+        self.q.close()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join(timeout)
+
+    def _run(self):
+        next_stats = time.time() + self.stats_sec
+        while True:
+            batch = self.q.get_batch(timeout=1.0)
+            if not batch and self.q.closed:
+                break
+            for stream, item in batch:
+                handler = self.handlers.get(stream)
+                if handler is None:
+                    continue
+                try:
+                    handler(item)
+                except Exception as e:
+                    print(f"[ERR] {stream} handler: {e}")
+            if self.idle is not None:
+                try:
+                    self.idle()
+                except Exception as e:
+                    print(f"[ERR] worker idle: {e}")
+            if self.stats_sec and time.time() >= next_stats:
+                next_stats = time.time() + self.stats_sec
+                print("[INFO] stream queue:", self.q.format_stats())
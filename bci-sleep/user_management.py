@@ -1,90 +1,197 @@
 # user_management.py
+"""
+ユーザーとセッションの登録簿（user_data/users.db, SQLite WAL モード）。
+以前の user_data/users.csv があれば最初に開いたときに取り込む。
+"""
 import csv
+import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
 
-USER_CSV_FILE = "user_data/users.csv"
+USER_DATA_DIR = "user_data"
+USER_DB_FILE = os.path.join(USER_DATA_DIR, "users.db")
+USER_CSV_FILE = os.path.join(USER_DATA_DIR, "users.csv")   # 移行元
 
-def create_user_csv():
-    """ユーザー管理用CSVファイルを作成"""
-    os.makedirs("user_data", exist_ok=True)
-    
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username       TEXT PRIMARY KEY,
+    display_name   TEXT NOT NULL,
+    created_date   TEXT NOT NULL,
+    last_session   TEXT NOT NULL DEFAULT '',
+    total_sessions INTEGER NOT NULL DEFAULT 0,
+    notes          TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS sessions (
+    username     TEXT NOT NULL REFERENCES users(username),
+    session_file TEXT NOT NULL,
+    start_time   REAL,
+    end_time     REAL,
+    rows         INTEGER NOT NULL DEFAULT 0,
+    summary      TEXT,
+    size         INTEGER,
+    mtime        REAL,
+    PRIMARY KEY (username, session_file)
+);
+CREATE INDEX IF NOT EXISTS sessions_by_start ON sessions(username, start_time);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+"""
+
+_local = threading.local()
+_init_lock = threading.Lock()
+_initialized = set()    # スキーマ作成・移行を済ませた DB のパス（プロセスにつき1回）
+
+def _db():
+    """スレッドごとの接続。スキーマ作成と CSV からの移行はプロセスで最初の1回だけ"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        os.makedirs(os.path.dirname(USER_DB_FILE) or ".", exist_ok=True)
+        conn = sqlite3.connect(USER_DB_FILE, timeout=10.0, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _init_db(conn)
+        _local.conn = conn
+    return conn
+
+def _init_db(conn):
+    if USER_DB_FILE in _initialized:
+        return
+    with _init_lock:
+        if USER_DB_FILE in _initialized:
+            return
+        conn.executescript(_SCHEMA)
+        _upgrade_schema(conn)
+        _migrate_csv(conn)
+        _initialized.add(USER_DB_FILE)
+
+def _upgrade_schema(conn):
+    # 古い users.db の sessions にはファイルのサイズ・更新時刻の列が無い
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(sessions)")}
+    for name, decl in (("size", "INTEGER"), ("mtime", "REAL")):
+        if name not in cols:
+            conn.execute(f"ALTER TABLE sessions ADD COLUMN {name} {decl}")
+
+def _migrate_csv(conn):
     if not os.path.exists(USER_CSV_FILE):
-        with open(USER_CSV_FILE, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                "username", "display_name", "created_date", 
-                "last_session", "total_sessions", "notes"
-            ])
-        print(f"[INFO] Created user management CSV: {USER_CSV_FILE}")
+        return
+    # 移行済みなら書き込みロックを取らない（他プロセスが書き込み中でも待たない）
+    if conn.execute("SELECT 1 FROM meta WHERE key='csv_migrated'").fetchone():
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conn.execute("SELECT 1 FROM meta WHERE key='csv_migrated'").fetchone():
+            conn.execute("COMMIT")
+            return
+        n = 0
+        with open(USER_CSV_FILE, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                username = (row.get('username') or '').strip()
+                if not username:
+                    continue
+                last_session = row.get('last_session') or ''
+                conn.execute(
+                    "INSERT OR IGNORE INTO users VALUES (?, ?, ?, ?, ?, ?)",
+                    (username, row.get('display_name') or username, row.get('created_date') or '',
+                     last_session, int(row.get('total_sessions') or 0), row.get('notes') or ''))
+                if last_session:
+                    conn.execute("INSERT OR IGNORE INTO sessions (username, session_file) VALUES (?, ?)",
+                                 (username, last_session))
+                n += 1
+        conn.execute("INSERT INTO meta VALUES ('csv_migrated', ?)", (datetime.now().isoformat(),))
+        conn.execute("COMMIT")
+        print(f"[INFO] Migrated {n} users from {USER_CSV_FILE} to {USER_DB_FILE}")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
 
 def add_user(username, display_name=None, notes=""):
     """ユーザーを追加"""
-    create_user_csv()
-    
-    # 既存ユーザーをチェック
-    existing_users = get_users()
-    if username in [user['username'] for user in existing_users]:
+    cur = _db().execute(
+        "INSERT OR IGNORE INTO users (username, display_name, created_date, notes) VALUES (?, ?, ?, ?)",
+        (username, display_name or username, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), notes))
+    if cur.rowcount == 0:
         print(f"[WARN] User '{username}' already exists")
         return False
     
-    # 新しいユーザーを追加
-    with open(USER_CSV_FILE, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            username,
-            display_name or username,
-            datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            "",  # last_session
-            "0",  # total_sessions
-            notes
-        ])
-    
     print(f"[INFO] Added user: {username}")
     return True
 
 def get_users():
     """全ユーザー情報を取得"""
-    if not os.path.exists(USER_CSV_FILE):
-        return []
-    
-    users = []
-    with open(USER_CSV_FILE, "r", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            users.append(row)
-    return users
-
-def update_user_session(username, session_file):
-    """ユーザーのセッション情報を更新"""
-    if not os.path.exists(USER_CSV_FILE):
-        return False
-    
-    # 全ユーザーを読み込み
-    users = get_users()
-    
-    # 指定ユーザーを更新
-    for user in users:
-        if user['username'] == username:
-            user['last_session'] = session_file
-            user['total_sessions'] = str(int(user['total_sessions']) + 1)
-            break
-    
-    # CSVファイルを再書き込み
-    with open(USER_CSV_FILE, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([
-            "username", "display_name", "created_date", 
-            "last_session", "total_sessions", "notes"
-        ])
-        for user in users:
-            writer.writerow([
-                user['username'], user['display_name'], user['created_date'],
-                user['last_session'], user['total_sessions'], user['notes']
-            ])
-    
+    return [dict(r) for r in _db().execute("SELECT * FROM users ORDER BY rowid")]
+
+def get_user(username):
+    r = _db().execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    return dict(r) if r else None
+
+def get_latest_session(username):
+    """最後に記録したセッションのファイル名（無ければ空文字）"""
+    r = _db().execute("SELECT last_session FROM users WHERE username = ?", (username,)).fetchone()
+    return r[0] if r else ""
+
+def update_user_session(username, session_file, start_time=None):
+    """
+    ユーザーのセッション開始を記録する（計測側から1セッションにつき1回呼ぶ）。
+    同じ session_file で呼び直しても total_sessions は増えない。
+    """
+    conn = _db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if not conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone():
+            conn.execute("ROLLBACK")
+            return False
+        cur = conn.execute("INSERT OR IGNORE INTO sessions (username, session_file, start_time) VALUES (?, ?, ?)",
+                           (username, session_file, start_time))
+        if cur.rowcount:
+            conn.execute("UPDATE users SET last_session = ?, total_sessions = total_sessions + 1 WHERE username = ?",
+                         (session_file, username))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
     return True
 
+def update_session_stats(username, session_file, end_time, rows, summary=None):
+    """セッションの最終時刻・行数（と任意の集計値）を更新する"""
+    _db().execute(
+        "UPDATE sessions SET end_time = ?, rows = ?, summary = COALESCE(?, summary) "
+        "WHERE username = ? AND session_file = ?",
+        (end_time, rows, json.dumps(summary) if summary is not None else None, username, session_file))
+
+def upsert_session(username, session_file, start_time, end_time, rows, summary, size, mtime):
+    """セッション索引の1行を追加・更新する（users の last_session / total_sessions は変えない）"""
+    _db().execute(
+        "INSERT INTO sessions (username, session_file, start_time, end_time, rows, summary, size, mtime) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT(username, session_file) DO UPDATE SET start_time = COALESCE(sessions.start_time, excluded.start_time), "
+        "end_time = excluded.end_time, rows = excluded.rows, summary = excluded.summary, "
+        "size = excluded.size, mtime = excluded.mtime",
+        (username, session_file, start_time, end_time, rows,
+         json.dumps(summary) if summary is not None else None, size, mtime))
+
+def delete_sessions(username, session_files):
+    """セッション索引から行を消す（users の last_session / total_sessions は変えない）"""
+    _db().executemany("DELETE FROM sessions WHERE username = ? AND session_file = ?",
+                      [(username, f) for f in session_files])
+
+def get_session(username, session_file):
+    """1セッション分の登録（無ければ None）"""
+    r = _db().execute("SELECT * FROM sessions WHERE username = ? AND session_file = ?",
+                      (username, session_file)).fetchone()
+    return dict(r) if r else None
+
+def get_sessions(username):
+    """ユーザーのセッションを開始時刻順で返す（summary は dict に戻す）"""
+    out = []
+    for r in _db().execute("SELECT * FROM sessions WHERE username = ? ORDER BY start_time, session_file",
+                           (username,)):
+        d = dict(r)
+        d['summary'] = json.loads(d['summary']) if d['summary'] else None
+        out.append(d)
+    return out
+
 def list_users():
     """ユーザー一覧を表示"""
     users = get_users()